@@ -0,0 +1,246 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy.orm import Session
+
+import crud
+from database import SessionLocal
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Permite desactivar el registro de eventos por visita (el contador 'clicks'
+# de cada URL se sigue manteniendo aparte, en clicks.py)
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "True").lower() == "true"
+
+# Capacidad del buffer circular. Si el escritor no da abasto, se descartan
+# las visitas más antiguas en lugar de frenar las redirecciones.
+ANALYTICS_BUFFER_SIZE = int(os.getenv("ANALYTICS_BUFFER_SIZE", "100000"))
+
+# Cada cuántos segundos se escriben los eventos y cuántos como máximo por lote
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "2"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "5000"))
+
+# Base de datos GeoLite2/GeoIP2 Country local (.mmdb). Opcional: si no se
+# configura o falta el paquete 'geoip2', el país queda vacío.
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "")
+
+# ==============================================================================
+# 2. CLASIFICACIÓN DE LA VISITA
+# ==============================================================================
+
+# El orden importa: Edge y Opera incluyen 'Chrome' en su User-Agent, y
+# Chrome incluye 'Safari'.
+_FAMILIAS_NAVEGADOR = [
+    ("Bot", re.compile(r"bot|crawler|spider|slurp|facebookexternalhit", re.IGNORECASE)),
+    ("Edge", re.compile(r"Edg(e|A|iOS)?/")),
+    ("Opera", re.compile(r"OPR/|Opera")),
+    ("Samsung Internet", re.compile(r"SamsungBrowser/")),
+    ("Chrome", re.compile(r"Chrome/|CriOS/")),
+    ("Firefox", re.compile(r"Firefox/|FxiOS/")),
+    ("Safari", re.compile(r"Safari/")),
+    ("curl", re.compile(r"^curl/")),
+    ("Python", re.compile(r"python-requests|python-httpx|aiohttp|urllib", re.IGNORECASE)),
+]
+
+
+@lru_cache(maxsize=4096)
+def familia_navegador(user_agent: Optional[str]) -> str:
+    """Familia de navegador a partir del User-Agent (sin dependencias externas)."""
+    if not user_agent:
+        return "Unknown"
+    for familia, patron in _FAMILIAS_NAVEGADOR:
+        if patron.search(user_agent):
+            return familia
+    return "Other"
+
+
+def dominio_referrer(referrer: Optional[str]) -> Optional[str]:
+    """Dominio de origen de la visita (sin 'www.'), o None si no hay referrer."""
+    if not referrer:
+        return None
+    host = (urlparse(referrer).hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host or None
+
+
+class LocalizadorGeoIP:
+    """
+    País de una IP usando una base GeoIP local (nunca consulta servicios externos).
+
+    El paquete 'geoip2' es opcional; sin él, o sin GEOIP_DB_PATH, pais()
+    devuelve siempre None.
+    """
+
+    def __init__(self, ruta: str = GEOIP_DB_PATH):
+        self.ruta = ruta
+        self._lector = None
+        self._cargado = False
+
+    def _cargar(self) -> None:
+        self._cargado = True
+        if not self.ruta:
+            return
+        try:
+            import geoip2.database
+            self._lector = geoip2.database.Reader(self.ruta)
+        except ImportError:
+            print("Advertencia: GEOIP_DB_PATH configurado pero 'geoip2' no está instalado")
+        except Exception as e:
+            print(f"Advertencia: no se pudo abrir la base GeoIP '{self.ruta}': {e}")
+
+    def pais(self, ip: Optional[str]) -> Optional[str]:
+        if not self._cargado:
+            self._cargar()
+        if self._lector is None or not ip:
+            return None
+        try:
+            return self._lector.country(ip).country.iso_code
+        except Exception:
+            # IP privada, no encontrada o mal formada
+            return None
+
+    def close(self) -> None:
+        if self._lector is not None:
+            self._lector.close()
+            self._lector = None
+        self._cargado = False
+
+# ==============================================================================
+# 3. REGISTRO DE EVENTOS (BUFFER CIRCULAR + ESCRITOR EN SEGUNDO PLANO)
+# ==============================================================================
+
+class RegistroEventos:
+    """
+    Guarda cada visita (hora, referrer, navegador, país) sin frenar la redirección.
+
+    La redirección solo añade una tupla a un deque acotado (append es
+    atómico, no hace falta lock). Un hilo de fondo lo vacía cada 'interval'
+    segundos: clasifica navegador y país fuera del camino crítico, inserta
+    los eventos en click_events y suma los agregados horarios y diarios con
+    crud.apply_click_events, todo en una transacción por lote.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        buffer_size: int = ANALYTICS_BUFFER_SIZE,
+        interval: float = ANALYTICS_FLUSH_INTERVAL,
+        batch_size: int = ANALYTICS_BATCH_SIZE,
+        geoip: Optional[LocalizadorGeoIP] = None,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.geoip = geoip or LocalizadorGeoIP()
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self.escritos = 0
+        self.descartados = 0
+
+    def registrar(self, key: str, referrer: Optional[str] = None,
+                  user_agent: Optional[str] = None, ip: Optional[str] = None) -> None:
+        """Anota una visita en memoria. No toca la base de datos."""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.descartados += 1
+        self._buffer.append((time.time(), key, referrer, user_agent, ip))
+        if len(self._buffer) >= self.batch_size:
+            self._despertar.set()
+
+    def pendientes(self) -> int:
+        """Visitas en el buffer que aún no se han escrito."""
+        return len(self._buffer)
+
+    def _a_evento(self, visita: tuple) -> dict:
+        ts, key, referrer, user_agent, ip = visita
+        return {
+            "key": key,
+            "ts": datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None),
+            "referrer": referrer[:1000] if referrer else None,
+            "referrer_host": dominio_referrer(referrer),
+            "ua_family": familia_navegador(user_agent),
+            "country": self.geoip.pais(ip),
+        }
+
+    def flush(self, session_factory: Optional[Callable[[], Session]] = None) -> int:
+        """
+        Escribe el buffer por lotes de 'batch_size'. Devuelve los eventos escritos.
+
+        Si un lote falla se devuelve al principio del buffer para reintentarlo.
+        """
+        total = 0
+        while self._buffer:
+            lote = []
+            while self._buffer and len(lote) < self.batch_size:
+                lote.append(self._buffer.popleft())
+
+            db = (session_factory or self.session_factory)()
+            try:
+                crud.apply_click_events(db, [self._a_evento(v) for v in lote])
+            except Exception:
+                self._buffer.extendleft(reversed(lote))
+                raise
+            finally:
+                db.close()
+
+            total += len(lote)
+            self.escritos += len(lote)
+        return total
+
+    def _bucle(self) -> None:
+        """Hilo de fondo: escribe por intervalo o cuando se llena un lote."""
+        while not self._parar.is_set():
+            self._despertar.wait(self.interval)
+            self._despertar.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error guardando eventos de visitas: {e}")
+
+    def start(self) -> None:
+        """Arranca el hilo escritor (se llama al iniciar la aplicación)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="click-events-writer", daemon=True)
+        self._hilo.start()
+
+    def stop(self) -> None:
+        """Detiene el hilo y escribe lo que quede en el buffer."""
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo:
+            self._hilo.join(timeout=self.interval + 5)
+            self._hilo = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error volcando eventos al apagar: {e}")
+        finally:
+            self.geoip.close()
+
+    def estadisticas(self) -> dict:
+        """Resumen para el endpoint de diagnóstico."""
+        return {
+            "enabled": ANALYTICS_ENABLED,
+            "buffered": len(self._buffer),
+            "buffer_size": self._buffer.maxlen,
+            "written": self.escritos,
+            "dropped": self.descartados,
+            "geoip": bool(self.geoip.ruta),
+        }
+
+
+# Instancia compartida por toda la aplicación
+registro_eventos = RegistroEventos()
@@ -0,0 +1,108 @@
+"""
+Benchmark: redirección síncrona (threadpool) vs asíncrona (AsyncEngine).
+
+Monta sobre la app real una ruta con el código antiguo (def + Session +
+crud.get_url_by_key) y la compara con la ruta actual /{url_key}, que usa
+AsyncSession. La caché de resolución se desactiva para medir el acceso a la
+base de datos, no la memoria.
+
+Uso (desde backend/):
+    python benchmarks/bench_async.py --rows 10000 --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Base de datos temporal: hay que fijarla ANTES de importar la aplicación
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+# El benchmark mide la aplicación, no el límite por cliente
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import Depends
+from fastapi.responses import RedirectResponse, HTMLResponse
+from sqlalchemy.orm import Session
+
+import crud
+import models
+from cache import cache_resolucion
+from database import SessionLocal, engine, async_engine, Base
+from main import app, get_db
+
+
+@app.get("/_bench_sync/{url_key}")
+def redireccion_sincrona(url_key: str, db: Session = Depends(get_db)):
+    """Réplica de la ruta anterior: síncrona, corre en el threadpool."""
+    db_url = crud.get_url_by_key(db, url_key)
+    if db_url:
+        return RedirectResponse(db_url.target_url)
+    return HTMLResponse(status_code=404)
+
+
+def sembrar(rows: int) -> list[str]:
+    """Inserta 'rows' enlaces y devuelve sus claves."""
+    Base.metadata.create_all(bind=engine)
+    keys = [f"k{i:07d}" for i in range(rows)]
+    db = SessionLocal()
+    db.bulk_insert_mappings(
+        models.URLItem,
+        [{"key": k, "target_url": f"https://example.com/{k}", "clicks": 0, "is_active": True} for k in keys],
+    )
+    db.commit()
+    db.close()
+    return keys
+
+
+async def medir(prefijo: str, keys: list[str], total: int, concurrency: int) -> float:
+    """Lanza 'total' peticiones con 'concurrency' clientes y devuelve peticiones/segundo."""
+    transport = httpx.ASGITransport(app=app)
+    cola = iter(range(total))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def trabajador():
+            for _ in cola:
+                r = await client.get(f"{prefijo}{random.choice(keys)}")
+                assert r.status_code == 307, r.status_code
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador() for _ in range(concurrency)))
+        return total / (time.perf_counter() - inicio)
+
+
+async def main(args):
+    try:
+        keys = sembrar(args.rows)
+        cache_resolucion.max_size = 0  # Medimos la BD, no la caché
+
+        # Calentamiento
+        await medir("/_bench_sync/", keys, 200, args.concurrency)
+        await medir("/", keys, 200, args.concurrency)
+
+        antes = await medir("/_bench_sync/", keys, args.requests, args.concurrency)
+        despues = await medir("/", keys, args.requests, args.concurrency)
+
+        print(f"filas={args.rows} peticiones={args.requests} concurrencia={args.concurrency}")
+        print(f"  antes  (sync + threadpool): {antes:9.1f} req/s")
+        print(f"  después (AsyncSession):     {despues:9.1f} req/s")
+        print(f"  mejora: x{despues / antes:.2f}")
+    finally:
+        # Cerrar las conexiones de aiosqlite (sus hilos impedirían salir)
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        os.remove(DB_PATH)
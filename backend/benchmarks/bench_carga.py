@@ -0,0 +1,445 @@
+"""
+Benchmark de carga: redirecciones y altas contra un uvicorn real.
+
+Siembra 'rows' enlaces en una base de datos SQLite (perfil de producción),
+arranca la aplicación en un proceso uvicorn aparte y la carga desde varios
+procesos cliente con httpx:
+
+    redirect  GET /{url_key}, claves con distribución de Zipf (--zipf-s):
+              pocas claves muy visitadas y una cola larga, como en la realidad
+    create    POST /url con destinos distintos (cada alta valida el destino)
+
+Para cada escenario mide peticiones/segundo, latencia p50/p95/p99 (vista
+por el cliente) y la memoria del servidor (RSS y pico), y guarda todo en
+un JSON para comparar ejecuciones (--compare).
+
+Sin red: los destinos son http://bench-destino.example.com/...; el proceso
+servidor resuelve ese dominio sin DNS y HTTP_PROXY lleva las comprobaciones
+de accesibilidad (cliente httpx compartido, con su pool real) a un destino
+de prueba local que responde 200 tras --target-latency ms.
+
+La primera siembra de millones de filas tarda: con --db la base de datos
+se conserva y las siguientes ejecuciones la reutilizan.
+
+Uso (desde backend/):
+    python benchmarks/bench_carga.py --rows 1000000 --db /tmp/carga.db --duration 20
+    python benchmarks/bench_carga.py --scenarios redirect --redirect-concurrency 128 --compare carga-anterior.json
+    python benchmarks/bench_carga.py --env DEFERRED_VALIDATION=true --scenarios create
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Dominio de los destinos: solo existe para el servidor del benchmark
+DOMINIO_DESTINO = "bench-destino.example.com"
+
+ESPERADOS = {"redirect": {301, 302, 307, 308}, "create": {200}}
+
+# ==============================================================================
+# 1. SIEMBRA
+# ==============================================================================
+
+def clave(i: int) -> str:
+    return f"c{i:08d}"
+
+
+def sembrar(rows: int) -> None:
+    """Crea el esquema e inserta enlaces hasta tener 'rows' (reutiliza los que ya haya)."""
+    from sqlalchemy import func, insert, select
+
+    import models
+    from database import actualizar_esquema, engine
+    from validation import huella_destino
+
+    actualizar_esquema(engine)
+    tabla = models.URLItem.__table__
+    with engine.connect() as conn:
+        existentes = conn.scalar(select(func.count()).select_from(tabla))
+    if existentes >= rows:
+        print(f"BD con {existentes} enlaces: se reutiliza")
+        engine.dispose()
+        return
+
+    inicio = time.perf_counter()
+    lote = 50_000
+    for desde in range(existentes, rows, lote):
+        filas = []
+        for i in range(desde, min(desde + lote, rows)):
+            destino = f"http://{DOMINIO_DESTINO}/k/{i}"
+            filas.append({"key": clave(i), "target_url": destino, "target_hash": huella_destino(destino),
+                          "clicks": 0, "is_active": True})
+        with engine.begin() as conn:
+            conn.execute(insert(tabla), filas)
+    engine.dispose()
+    print(f"Sembrados {rows - existentes} enlaces en {time.perf_counter() - inicio:.1f}s")
+
+# ==============================================================================
+# 2. DESTINO DE PRUEBA Y SERVIDOR
+# ==============================================================================
+
+def destino_prueba(puerto: int, latencia: float) -> None:
+    """
+    Proceso que hace de destino (y de proxy HTTP): a cualquier petición
+    responde 200 sin cuerpo tras 'latencia' segundos, con keep-alive.
+    """
+    respuesta = b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: keep-alive\r\n\r\n"
+
+    async def atender(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                cabecera = await reader.readuntil(b"\r\n\r\n")
+                longitud = 0
+                for linea in cabecera.split(b"\r\n"):
+                    if linea.lower().startswith(b"content-length:"):
+                        longitud = int(linea.split(b":", 1)[1])
+                if longitud:
+                    await reader.readexactly(longitud)
+                if latencia:
+                    await asyncio.sleep(latencia)
+                writer.write(respuesta)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def servir():
+        servidor = await asyncio.start_server(atender, "127.0.0.1", puerto)
+        async with servidor:
+            await servidor.serve_forever()
+
+    asyncio.run(servir())
+
+
+def servir_aplicacion(puerto: int) -> None:
+    """
+    Proceso servidor: la aplicación en uvicorn, como server.py con un worker,
+    pero resolviendo DOMINIO_DESTINO sin DNS. El resto de la validación
+    (formato, caché DNS, HEAD con el cliente compartido) es el de siempre.
+    """
+    import uvicorn
+
+    import main
+
+    async def resolver_sin_red(hostname: str) -> tuple[bool, str]:
+        if hostname == DOMINIO_DESTINO:
+            return True, ""
+        return False, f"No se pudo resolver el dominio '{hostname}'"
+
+    main._resolver_dns = resolver_sin_red
+    uvicorn.run(main.app, host="127.0.0.1", port=puerto, log_level="warning")
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servidor(puerto: int, entorno: dict) -> subprocess.Popen:
+    import httpx
+
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(puerto)], cwd=BACKEND_DIR, env=entorno,
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError("El servidor terminó al arrancar")
+        try:
+            if httpx.get(f"http://127.0.0.1:{puerto}/api/health", timeout=1, trust_env=False).status_code == 200:
+                return proceso
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("El servidor no arrancó a tiempo")
+
+
+def memoria(pid: int) -> dict:
+    """RSS actual y pico del proceso en MiB (Linux, /proc)."""
+    valores = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                campo, _, resto = linea.partition(":")
+                if campo in ("VmRSS", "VmHWM"):
+                    valores[campo] = round(int(resto.split()[0]) / 1024, 1)
+    except OSError:
+        return {"rss_mb": None, "peak_rss_mb": None}
+    return {"rss_mb": valores.get("VmRSS"), "peak_rss_mb": valores.get("VmHWM")}
+
+# ==============================================================================
+# 3. GENERACIÓN DE CARGA
+# ==============================================================================
+
+class Zipf:
+    """
+    Rangos con distribución de Zipf (P(r) ~ 1/r^s) sobre n claves.
+
+    El rango se convierte en índice de clave con una permutación
+    multiplicativa (r * a mod n), así las claves calientes quedan repartidas
+    por la tabla y no son las primeras insertadas.
+    """
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.n = n
+        self.rng = rng
+        self.acumulados = list(itertools.accumulate(1 / r ** s for r in range(1, n + 1)))
+        self.total = self.acumulados[-1]
+        self.a = 2654435761 % n or 1
+        while math.gcd(self.a, n) != 1:
+            self.a += 1
+
+    def indice(self) -> int:
+        rango = bisect.bisect_left(self.acumulados, self.rng.random() * self.total)
+        return min(rango, self.n - 1) * self.a % self.n
+
+
+def cliente(base_url: str, escenario: str, args, numero: int, concurrencia: int, resultado) -> None:
+    """
+    Proceso cliente: 'concurrencia' conexiones durante calentamiento +
+    duración. Solo guarda las peticiones que empiezan tras el calentamiento.
+    """
+    import httpx
+
+    rng = random.Random(args.seed + numero)
+    zipf = Zipf(args.rows, args.zipf_s, rng) if escenario == "redirect" else None
+    esperados = ESPERADOS[escenario]
+
+    async def carga():
+        latencias: list[float] = []
+        estados: Counter = Counter()
+        altas = itertools.count()
+        medir_desde = time.perf_counter() + args.warmup
+        fin = medir_desde + args.duration
+        limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limites, timeout=60, trust_env=False) as http:
+            async def trabajador():
+                while True:
+                    inicio = time.perf_counter()
+                    if inicio >= fin:
+                        return
+                    try:
+                        if zipf:
+                            r = await http.get(f"/{clave(zipf.indice())}")
+                        else:
+                            destino = f"http://{DOMINIO_DESTINO}/n/{args.seed}-{numero}-{next(altas)}"
+                            r = await http.post("/url", json={"target_url": destino})
+                        estado = r.status_code
+                    except httpx.HTTPError as e:
+                        estado = type(e).__name__
+                    if inicio >= medir_desde:
+                        latencias.append(time.perf_counter() - inicio)
+                        estados[estado if estado in esperados else f"error:{estado}"] += 1
+
+            await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        return latencias, estados
+
+    resultado.put(asyncio.run(carga()))
+
+
+def percentil(ordenadas: list[float], p: float) -> float:
+    """Percentil 'p' (0-100) por el método del rango más cercano."""
+    if not ordenadas:
+        return 0.0
+    return ordenadas[max(0, math.ceil(p / 100 * len(ordenadas)) - 1)]
+
+
+def ejecutar_escenario(base_url: str, escenario: str, concurrencia: int, args, servidor_pid: int) -> dict:
+    """Lanza los clientes del escenario y agrega sus resultados."""
+    procesos_cliente = min(args.clients, concurrencia)
+    cola = multiprocessing.Queue()
+    procesos = [
+        multiprocessing.Process(
+            target=cliente,
+            args=(base_url, escenario, args, n, concurrencia // procesos_cliente + (n < concurrencia % procesos_cliente), cola),
+        )
+        for n in range(procesos_cliente)
+    ]
+    antes = memoria(servidor_pid)
+    for p in procesos:
+        p.start()
+    latencias: list[float] = []
+    estados: Counter = Counter()
+    for _ in procesos:
+        parciales, conteo = cola.get()
+        latencias += parciales
+        estados += conteo
+    for p in procesos:
+        p.join()
+    despues = memoria(servidor_pid)
+
+    latencias.sort()
+    errores = sum(n for estado, n in estados.items() if str(estado).startswith("error:"))
+    return {
+        "concurrency": concurrencia,
+        "requests": len(latencias),
+        "errors": errores,
+        "rps": round(len(latencias) / args.duration, 1),
+        "latency_ms": {
+            "mean": round(sum(latencias) / len(latencias) * 1000, 3) if latencias else 0.0,
+            "p50": round(percentil(latencias, 50) * 1000, 3),
+            "p95": round(percentil(latencias, 95) * 1000, 3),
+            "p99": round(percentil(latencias, 99) * 1000, 3),
+            "max": round(latencias[-1] * 1000, 3) if latencias else 0.0,
+        },
+        "status": {str(estado): n for estado, n in sorted(estados.items(), key=lambda e: str(e[0]))},
+        "server_memory": {"before": antes, "after": despues},
+    }
+
+# ==============================================================================
+# 4. INFORME Y COMPARACIÓN
+# ==============================================================================
+
+def commit_actual() -> str | None:
+    try:
+        salida = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return salida.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def imprimir(escenario: str, r: dict) -> None:
+    lat = r["latency_ms"]
+    mem = r["server_memory"]["after"]
+    print(f"  {escenario:9s} c={r['concurrency']:<4d} {r['rps']:9.1f} req/s   "
+          f"p50 {lat['p50']:7.2f} ms  p95 {lat['p95']:7.2f} ms  p99 {lat['p99']:7.2f} ms   "
+          f"errores {r['errors']}   RSS {mem['rss_mb']} MiB (pico {mem['peak_rss_mb']})")
+
+
+def comparar(actual: dict, ruta: str) -> None:
+    """Imprime la variación de cada escenario frente a un JSON anterior."""
+    with open(ruta, encoding="utf-8") as f:
+        anterior = json.load(f)
+    print(f"Comparación con {ruta} (commit {anterior.get('commit')}):")
+    for escenario, r in actual["scenarios"].items():
+        previo = anterior.get("scenarios", {}).get(escenario)
+        if not previo:
+            continue
+        cambios = [f"req/s {r['rps'] / previo['rps'] - 1:+.1%}" if previo["rps"] else "req/s n/d"]
+        for p in ("p50", "p95", "p99"):
+            antes = previo["latency_ms"][p]
+            cambios.append(f"{p} {r['latency_ms'][p] / antes - 1:+.1%}" if antes else f"{p} n/d")
+        print(f"  {escenario:9s} " + "   ".join(cambios))
+
+# ==============================================================================
+# 5. PROGRAMA PRINCIPAL
+# ==============================================================================
+
+def main(args) -> None:
+    temporal = args.db is None
+    if temporal:
+        fd, args.db = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(args.db)  # actualizar_esquema la crea con auto_vacuum incremental
+    ruta_db = os.path.abspath(args.db)
+
+    entorno = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{ruta_db}",
+        SQLITE_PRODUCTION="true",
+        # El benchmark mide la aplicación, no el límite por cliente ni la purga
+        RATE_LIMIT_ENABLED="false",
+        PURGE_ENABLED="false",
+    )
+    entorno.update(valor.split("=", 1) for valor in args.env)
+    os.environ["DATABASE_URL"] = entorno["DATABASE_URL"]
+    os.environ["SQLITE_PRODUCTION"] = "true"
+
+    destino = None
+    servidor = None
+    try:
+        sembrar(args.rows)
+
+        puerto_destino = puerto_libre()
+        destino = multiprocessing.Process(target=destino_prueba, args=(puerto_destino, args.target_latency / 1000),
+                                          daemon=True)
+        destino.start()
+        entorno["HTTP_PROXY"] = f"http://127.0.0.1:{puerto_destino}"
+        entorno.pop("NO_PROXY", None)
+        entorno.pop("no_proxy", None)
+
+        puerto = puerto_libre()
+        servidor = arrancar_servidor(puerto, entorno)
+        base_url = f"http://127.0.0.1:{puerto}"
+
+        informe = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit_actual(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "serve")},
+            "scenarios": {},
+        }
+        print(f"filas={args.rows} duración={args.duration}s (+{args.warmup}s calentamiento) "
+              f"clientes={args.clients} zipf s={args.zipf_s} núcleos={os.cpu_count()}")
+        concurrencias = {"redirect": args.redirect_concurrency, "create": args.create_concurrency}
+        for escenario in args.scenarios:
+            resultado = ejecutar_escenario(base_url, escenario, concurrencias[escenario], args, servidor.pid)
+            informe["scenarios"][escenario] = resultado
+            imprimir(escenario, resultado)
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait(timeout=30)
+        if destino:
+            destino.terminate()
+        if temporal:
+            for sufijo in ("", "-wal", "-shm"):
+                if os.path.exists(ruta_db + sufijo):
+                    os.remove(ruta_db + sufijo)
+
+    salida = args.output or os.path.join(
+        BACKEND_DIR, "benchmarks", "resultados", f"carga-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {salida}")
+    if args.compare:
+        comparar(informe, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--db", help="fichero SQLite a conservar entre ejecuciones (por defecto, temporal)")
+    parser.add_argument("--scenarios", nargs="+", choices=("redirect", "create"), default=["redirect", "create"])
+    parser.add_argument("--duration", type=float, default=10, help="segundos medidos por escenario")
+    parser.add_argument("--warmup", type=float, default=2, help="segundos de calentamiento (no se miden)")
+    parser.add_argument("--redirect-concurrency", type=int, default=64)
+    parser.add_argument("--create-concurrency", type=int, default=16)
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="procesos cliente (la concurrencia se reparte entre ellos)")
+    parser.add_argument("--zipf-s", type=float, default=1.0, help="exponente de Zipf (mayor = más concentrado)")
+    parser.add_argument("--target-latency", type=float, default=20, help="ms que tarda el destino de prueba")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", nargs="*", default=[], metavar="CLAVE=VALOR",
+                        help="configuración extra del servidor (ej: DEFERRED_VALIDATION=true)")
+    parser.add_argument("--output", help="fichero JSON de resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)  # uso interno: proceso servidor
+    argumentos = parser.parse_args()
+    if argumentos.serve:
+        servir_aplicacion(argumentos.serve)
+    else:
+        main(argumentos)
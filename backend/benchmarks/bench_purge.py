@@ -0,0 +1,72 @@
+"""
+Benchmark: purga por lotes de enlaces caducados (purge.py).
+
+Siembra 'rows' enlaces, de los que 'expired' ya han caducado, y los purga
+con distintos tamaños de lote. Para cada uno muestra el tiempo por lote
+(lo que dura el bloqueo de escritura en SQLite), el total y cuántas
+páginas devuelve al disco el vacuum incremental.
+
+Uso (desde backend/):
+    python benchmarks/bench_purge.py --rows 100000 --expired 50000 --batches 100,500,2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Base de datos temporal: hay que fijarla ANTES de importar la aplicación
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("METRICS_ENABLED", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import SessionLocal, engine, actualizar_esquema
+from purge import PurgaEnlaces
+
+
+def sembrar(rows: int, expired: int) -> None:
+    """Inserta 'rows' enlaces; los 'expired' primeros caducaron hace un día."""
+    ayer = datetime.utcnow() - timedelta(days=1)
+    manana = datetime.utcnow() + timedelta(days=1)
+    db = SessionLocal()
+    db.query(models.URLItem).delete()
+    db.bulk_insert_mappings(models.URLItem, [
+        {"key": f"k{i:07d}", "target_url": f"https://example.com/{i}", "clicks": 0, "is_active": True,
+         "expires_at": ayer if i < expired else manana}
+        for i in range(rows)
+    ])
+    db.commit()
+    db.close()
+
+
+def main(args):
+    # BD nueva: actualizar_esquema la crea con auto_vacuum=INCREMENTAL
+    os.remove(DB_PATH)
+    actualizar_esquema(engine)
+    print(f"filas={args.rows} caducadas={args.expired}")
+
+    for tamano in (int(t) for t in args.batches.split(",")):
+        sembrar(args.rows, args.expired)
+        purga = PurgaEnlaces(batch_size=tamano, pause=0)
+        informe = purga.ejecutar()
+        assert informe["purged"] == args.expired, informe
+        print(f"  lote {tamano:6d}  {informe['batches']:5d} lotes   {informe['batch_ms_avg']:8.2f} ms/lote "
+              f"(máx. {informe['batch_ms_max']:8.2f})   total {informe['total_ms']:9.1f} ms   "
+              f"vacuum {informe['vacuum_ms']:7.1f} ms ({informe['freed_pages']} páginas)   "
+              f"analyze {informe['analyze_ms']:5.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--expired", type=int, default=50000)
+    parser.add_argument("--batches", default="100,500,2000")
+    try:
+        main(parser.parse_args())
+    finally:
+        engine.dispose()
+        if os.path.exists(DB_PATH):
+            os.remove(DB_PATH)
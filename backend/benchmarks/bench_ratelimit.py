@@ -0,0 +1,148 @@
+"""
+Benchmark: coste del límite de peticiones (ratelimit.py) por petición.
+
+Mide redirecciones servidas desde la caché por el camino rápido (la
+petición más barata de la aplicación, donde más se notaría) con el
+limitador desactivado y activado. Los límites se fijan muy altos para que
+no se rechace nada: solo se mide el coste de comprobar el cubo. Las
+peticiones llegan desde 'clientes' IPs distintas.
+
+Además mide el almacén en memoria aislado (coste de 'consumir') y su
+tamaño con muchos clientes, y el almacén compartido en la BD.
+
+Uso (desde backend/):
+    python benchmarks/bench_ratelimit.py --requests 20000 --clients 10000 --concurrency 50 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Base de datos temporal: hay que fijarla ANTES de importar la aplicación
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("METRICS_ENABLED", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import ratelimit
+from database import SessionLocal, engine, async_engine, Base
+from main import app
+
+
+def sembrar(rows: int) -> list[str]:
+    """Inserta 'rows' enlaces y devuelve sus claves."""
+    Base.metadata.create_all(bind=engine)
+    keys = [f"k{i:05d}" for i in range(rows)]
+    db = SessionLocal()
+    db.bulk_insert_mappings(
+        models.URLItem,
+        [{"key": k, "target_url": f"https://example.com/{k}", "clicks": 0, "is_active": True} for k in keys],
+    )
+    db.commit()
+    db.close()
+    return keys
+
+
+async def peticion(url_key: str, ip: str) -> int:
+    """Una petición GET /{url_key} desde 'ip' contra la app ASGI; devuelve el código de estado."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": f"/{url_key}", "raw_path": f"/{url_key}".encode(),
+        "root_path": "", "query_string": b"", "server": ("bench", 80), "client": (ip, 5000),
+        "headers": [(b"host", b"bench"), (b"user-agent", b"bench")],
+    }
+    estado = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensaje):
+        nonlocal estado
+        if mensaje["type"] == "http.response.start":
+            estado = mensaje["status"]
+
+    await app(scope, receive, send)
+    return estado
+
+
+async def medir(keys: list[str], ips: list[str], total: int, concurrency: int) -> float:
+    """Lanza 'total' peticiones con 'concurrency' tareas y devuelve peticiones/segundo."""
+    cola = iter(range(total))
+
+    async def trabajador():
+        for _ in cola:
+            estado = await peticion(random.choice(keys), random.choice(ips))
+            assert estado == 307, estado
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrency)))
+    return total / (time.perf_counter() - inicio)
+
+
+async def main(args):
+    keys = sembrar(args.rows)
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(args.clients)]
+    sin_limite = ratelimit.Regla(1e12, 1e12)
+
+    print(f"peticiones={args.requests} clientes={args.clients} concurrencia={args.concurrency}")
+
+    # Rondas alternas y el mejor resultado de cada modo (la primera calienta la caché)
+    resultados = {False: 0.0, True: 0.0}
+    for ronda in range(args.rounds):
+        for activo in (False, True):
+            ratelimit.RATE_LIMIT_ENABLED = activo
+            ratelimit.limitador = ratelimit.LimitadorPeticiones({"redirect": sin_limite}, ratelimit.AlmacenMemoria())
+            req_s = await medir(keys, ips, args.requests, args.concurrency)
+            if ronda:
+                resultados[activo] = max(resultados[activo], req_s)
+
+    antes, despues = resultados[False], resultados[True]
+    coste = (1 / despues - 1 / antes) * 1e6
+    print(f"  redirección   sin límite {antes:9.1f} req/s   con límite {despues:9.1f} req/s   "
+          f"({despues / antes - 1:+.1%}, {coste:+.1f} µs/petición)")
+
+    # Almacén en memoria aislado: coste de una comprobación y memoria por cliente
+    tracemalloc.start()
+    almacen = ratelimit.AlmacenMemoria(max_cubos=max(args.clients, 1))
+    for ip in ips:
+        await almacen.consumir("redirect", ip, 600, 10)
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    n = 200_000
+    inicio = time.perf_counter()
+    for i in range(n):
+        await almacen.consumir("redirect", ips[i % len(ips)], 600, 10)
+    por_llamada = (time.perf_counter() - inicio) / n * 1e6
+    print(f"  memoria       {por_llamada:.2f} µs/comprobación, {memoria / len(almacen):.0f} bytes/cliente "
+          f"({len(almacen)} clientes)")
+
+    # Almacén compartido en la BD (una transacción por comprobación)
+    almacen_bd = ratelimit.AlmacenBD(engine=async_engine)
+    n = 2000
+    inicio = time.perf_counter()
+    for i in range(n):
+        await almacen_bd.consumir("create", ips[i % len(ips)], 30, 0.5)
+    print(f"  base de datos {(time.perf_counter() - inicio) / n * 1e6:.0f} µs/comprobación (SQLite)")
+
+    # Cerrar las conexiones de aiosqlite (sus hilos impedirían salir)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        os.remove(DB_PATH)
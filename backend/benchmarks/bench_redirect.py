@@ -0,0 +1,135 @@
+"""
+Benchmark: camino rápido de redirección (RedireccionRapida) vs ruta FastAPI.
+
+Llama a la aplicación ASGI directamente, sin servidor ni cliente HTTP, para
+medir solo el coste de atender la petición dentro de la app (enrutado,
+dependencias, respuesta). La ruta FastAPI /{url_key} se mide desactivando
+el camino rápido en caliente (redirect.REDIRECT_FAST_PATH = False).
+
+Escenarios:
+    caché     enlaces ya resueltos en la caché de resolución
+    sin caché caché desactivada: cada petición consulta la BD
+    404       claves inexistentes (página de error)
+    404 filtro lo mismo con el filtro de Bloom de claves cargado (keyfilter.py)
+
+Uso (desde backend/):
+    python benchmarks/bench_redirect.py --rows 10000 --requests 20000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Base de datos temporal: hay que fijarla ANTES de importar la aplicación
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("METRICS_ENABLED", "false")
+# El benchmark mide la aplicación, no el límite por cliente
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import redirect
+from cache import cache_resolucion, RESOLUTION_CACHE_SIZE
+from database import SessionLocal, engine, async_engine, Base
+from keyfilter import filtro_claves
+from main import app
+
+
+def sembrar(rows: int) -> list[str]:
+    """Inserta 'rows' enlaces y devuelve sus claves."""
+    Base.metadata.create_all(bind=engine)
+    keys = [f"k{i:07d}" for i in range(rows)]
+    db = SessionLocal()
+    db.bulk_insert_mappings(
+        models.URLItem,
+        [{"key": k, "target_url": f"https://example.com/{k}", "clicks": 0, "is_active": True} for k in keys],
+    )
+    db.commit()
+    db.close()
+    return keys
+
+
+async def peticion(url_key: str) -> int:
+    """Una petición GET /{url_key} contra la app ASGI; devuelve el código de estado."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": f"/{url_key}", "raw_path": f"/{url_key}".encode(),
+        "root_path": "", "query_string": b"", "server": ("bench", 80), "client": ("127.0.0.1", 5000),
+        "headers": [(b"host", b"bench"), (b"user-agent", b"bench")],
+    }
+    estado = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensaje):
+        nonlocal estado
+        if mensaje["type"] == "http.response.start":
+            estado = mensaje["status"]
+
+    await app(scope, receive, send)
+    return estado
+
+
+async def medir(keys: list[str], total: int, concurrency: int, esperado: int) -> float:
+    """Lanza 'total' peticiones con 'concurrency' tareas y devuelve peticiones/segundo."""
+    cola = iter(range(total))
+
+    async def trabajador():
+        for _ in cola:
+            estado = await peticion(random.choice(keys))
+            assert estado == esperado, estado
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrency)))
+    return total / (time.perf_counter() - inicio)
+
+
+async def comparar(nombre: str, keys: list[str], args, esperado: int, cache: bool) -> None:
+    resultados = {}
+    for rapido in (False, True):
+        redirect.REDIRECT_FAST_PATH = rapido
+        cache_resolucion.clear()
+        cache_resolucion.max_size = RESOLUTION_CACHE_SIZE if cache else 0
+        await medir(keys, min(args.requests, len(keys)), args.concurrency, esperado)  # calentamiento
+        resultados[rapido] = await medir(keys, args.requests, args.concurrency, esperado)
+
+    antes, despues = resultados[False], resultados[True]
+    print(f"  {nombre:10s} ruta FastAPI {antes:9.1f} req/s   camino rápido {despues:9.1f} req/s   x{despues / antes:.2f}")
+
+
+async def main(args):
+    keys = sembrar(args.rows)
+    # Claves calientes que caben en la caché (el resto se mide sin caché)
+    calientes = keys[: min(len(keys), RESOLUTION_CACHE_SIZE)]
+    inexistentes = [f"nope{i}" for i in range(1000)]
+
+    print(f"filas={args.rows} peticiones={args.requests} concurrencia={args.concurrency}")
+    await comparar("caché", calientes, args, 307, cache=True)
+    await comparar("sin caché", keys, args, 307, cache=False)
+    await comparar("404", inexistentes, args, 404, cache=False)
+
+    await filtro_claves.cargar(async_engine)
+    await comparar("404 filtro", inexistentes, args, 404, cache=False)
+    informe = filtro_claves.estadisticas()
+    print(f"  filtro: {informe['memory_bytes'] / 1024:.0f} KiB, {informe['hashes']} hashes, "
+          f"fp estimada {informe['estimated_fp_rate']:.4%}, observada {informe['observed_fp_rate']:.4%}")
+
+    # Cerrar las conexiones de aiosqlite (sus hilos impedirían salir)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        os.remove(DB_PATH)
@@ -0,0 +1,146 @@
+"""
+Benchmark: SQLite por defecto (rollback journal) vs perfil de producción (WAL).
+
+Lanza cada perfil en un proceso aparte (la configuración de database.py se
+lee al importar) y mide una carga mixta durante '--duration' segundos:
+'--readers' clientes pidiendo /{url_key} (forward_to_target_url, con la
+caché de resolución desactivada) y '--writers' clientes creando enlaces
+con POST /url (create_url, sin validación de red). El acumulador de
+visitas y el registro de eventos corren en segundo plano como en producción,
+así que hay escrituras compitiendo con las lecturas.
+
+Uso (desde backend/):
+    python benchmarks/bench_sqlite.py --rows 10000 --duration 10 --readers 50 --writers 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def carga(args) -> dict:
+    """Ejecuta la carga mixta en este proceso y devuelve los resultados."""
+    sys.path.insert(0, BACKEND_DIR)
+
+    import httpx
+    import main
+    import models
+    from analytics import registro_eventos
+    from cache import cache_resolucion
+    from clicks import acumulador_clicks
+    from database import SessionLocal, async_engine, actualizar_esquema, engine
+
+    actualizar_esquema(engine)
+    keys = [f"k{i:07d}" for i in range(args.rows)]
+    db = SessionLocal()
+    db.bulk_insert_mappings(
+        models.URLItem,
+        [{"key": k, "target_url": f"https://example.com/{k}", "clicks": 0, "is_active": True} for k in keys],
+    )
+    db.commit()
+    db.close()
+
+    # Medimos la BD, no la caché ni la red
+    cache_resolucion.max_size = 0
+    main.VALIDATE_URLS = False
+
+    async def dns_ok(_):
+        return True, "DNS resuelto (benchmark)"
+
+    main.verificar_resolucion_dns = dns_ok
+
+    acumulador_clicks.interval = 0.2
+    registro_eventos.interval = 0.2
+    acumulador_clicks.start()
+    registro_eventos.start()
+
+    resultados = {"redirects": 0, "creates": 0, "errors": 0}
+    fin = time.perf_counter() + args.duration
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def lector():
+            while time.perf_counter() < fin:
+                r = await client.get(f"/{random.choice(keys)}")
+                resultados["redirects" if r.status_code == 307 else "errors"] += 1
+
+        async def escritor(n: int):
+            i = 0
+            while time.perf_counter() < fin:
+                i += 1
+                r = await client.post("/url", json={"target_url": f"https://example.com/new/{n}/{i}"})
+                resultados["creates" if r.status_code == 200 else "errors"] += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(
+            *(lector() for _ in range(args.readers)),
+            *(escritor(n) for n in range(args.writers)),
+        )
+        transcurrido = time.perf_counter() - inicio
+
+    acumulador_clicks.stop()
+    registro_eventos.stop()
+    await async_engine.dispose()
+    engine.dispose()
+
+    return {
+        "redirects_per_s": resultados["redirects"] / transcurrido,
+        "creates_per_s": resultados["creates"] / transcurrido,
+        "errors": resultados["errors"],
+    }
+
+
+def lanzar(perfil: str, args) -> dict:
+    """Ejecuta un perfil en un subproceso con su propia base de datos temporal."""
+    fd, ruta = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    entorno = dict(os.environ, DATABASE_URL=f"sqlite:///{ruta}",
+                   SQLITE_PRODUCTION="true" if perfil == "production" else "false",
+                   RATE_LIMIT_ENABLED="false")
+    try:
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker",
+             "--rows", str(args.rows), "--duration", str(args.duration),
+             "--readers", str(args.readers), "--writers", str(args.writers)],
+            env=entorno, cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        )
+    finally:
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=50)
+    parser.add_argument("--writers", type=int, default=5)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(carga(args))))
+        return
+
+    antes = lanzar("default", args)
+    despues = lanzar("production", args)
+
+    print(f"filas={args.rows} duración={args.duration}s lectores={args.readers} escritores={args.writers}")
+    for nombre, r in (("por defecto (journal)", antes), ("producción (WAL)", despues)):
+        print(f"  {nombre:22s} redirects: {r['redirects_per_s']:8.1f} req/s  "
+              f"creates: {r['creates_per_s']:7.1f} req/s  errores: {r['errors']}")
+    print(f"  mejora redirects: x{despues['redirects_per_s'] / max(antes['redirects_per_s'], 1e-9):.2f}  "
+          f"creates: x{despues['creates_per_s'] / max(antes['creates_per_s'], 1e-9):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark: escalado de redirecciones con el número de workers.
+
+Arranca server.py (uvicorn real) con 1, 2, 4... procesos sobre la misma
+base de datos SQLite (perfil de producción), lanza la carga desde varios
+procesos cliente y mide peticiones/segundo contra /{url_key}. Con varios
+workers, además, borra un enlace y mide cuánto tarda en dejar de
+redirigir en todos ellos (propagación del canal de invalidación).
+
+Para que la medida tenga sentido, los clientes necesitan CPU propia: en
+una máquina con N núcleos, compara hasta N/2 workers.
+
+Uso (desde backend/):
+    python benchmarks/bench_workers.py --workers 1 2 4 --duration 10 --rows 10000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Base de datos temporal: hay que fijarla ANTES de importar los modelos
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["SQLITE_PRODUCTION"] = "true"
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+
+
+def sembrar(rows: int) -> list[str]:
+    """Inserta 'rows' enlaces y devuelve sus claves."""
+    import models
+    from database import SessionLocal, actualizar_esquema, engine
+
+    actualizar_esquema(engine)
+    keys = [f"k{i:07d}" for i in range(rows)]
+    db = SessionLocal()
+    db.bulk_insert_mappings(
+        models.URLItem,
+        [{"key": k, "target_url": f"https://example.com/{k}", "clicks": 0, "is_active": True} for k in keys],
+    )
+    db.commit()
+    db.close()
+    engine.dispose()
+    return keys
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servidor(workers: int, puerto: int) -> subprocess.Popen:
+    # Todas las peticiones salen de 127.0.0.1: con el límite por cliente
+    # activo se contarían como un único cliente
+    entorno = dict(os.environ, WEB_CONCURRENCY=str(workers), HOST="127.0.0.1", PORT=str(puerto),
+                   RATE_LIMIT_ENABLED="false")
+    proceso = subprocess.Popen(
+        [sys.executable, "server.py"], cwd=BACKEND_DIR, env=entorno,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(f"http://127.0.0.1:{puerto}/api/health", timeout=1).status_code == 200:
+                return proceso
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("El servidor no arrancó a tiempo")
+
+
+def cliente(base_url: str, keys: list[str], duracion: float, concurrencia: int, resultado) -> None:
+    """Proceso cliente: 'concurrencia' conexiones pidiendo redirecciones durante 'duracion' s."""
+    async def carga():
+        hechas = 0
+        fin = time.perf_counter() + duracion
+        async with httpx.AsyncClient(base_url=base_url) as http:
+            async def trabajador():
+                nonlocal hechas
+                while time.perf_counter() < fin:
+                    r = await http.get(f"/{random.choice(keys)}")
+                    if r.status_code == 307:
+                        hechas += 1
+            await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        return hechas
+
+    resultado.put(asyncio.run(carga()))
+
+
+def medir(base_url: str, keys: list[str], args) -> float:
+    cola = multiprocessing.Queue()
+    por_cliente = max(1, args.concurrency // args.clients)
+    procesos = [
+        multiprocessing.Process(target=cliente, args=(base_url, keys, args.duration, por_cliente, cola))
+        for _ in range(args.clients)
+    ]
+    for p in procesos:
+        p.start()
+    total = sum(cola.get() for _ in procesos)
+    for p in procesos:
+        p.join()
+    return total / args.duration
+
+
+def medir_propagacion(base_url: str, key: str, limite: float = 30) -> float:
+    """Borra 'key' y devuelve los segundos hasta que ningún worker la redirige."""
+    # Conexiones nuevas en cada petición para repartirlas entre workers
+    sin_keepalive = httpx.Limits(max_keepalive_connections=0)
+    with httpx.Client(base_url=base_url, limits=sin_keepalive) as http:
+        for _ in range(50):
+            http.get(f"/{key}")  # calienta la caché de todos los workers
+        inicio = time.perf_counter()
+        assert http.delete(f"/urls/{key}").status_code == 200
+        seguidas = 0
+        while seguidas < 50:
+            if time.perf_counter() - inicio > limite:
+                return float("inf")
+            seguidas = seguidas + 1 if http.get(f"/{key}").status_code == 404 else 0
+        return time.perf_counter() - inicio
+
+
+def main(args):
+    keys = sembrar(args.rows)
+    base = None
+
+    print(f"filas={args.rows} duración={args.duration}s clientes={args.clients} "
+          f"concurrencia={args.concurrency} núcleos={os.cpu_count()}")
+    for n, workers in enumerate(args.workers):
+        puerto = puerto_libre()
+        servidor = arrancar_servidor(workers, puerto)
+        base_url = f"http://127.0.0.1:{puerto}"
+        try:
+            medir(base_url, keys, argparse.Namespace(**{**vars(args), "duration": 2}))  # calentamiento
+            rps = medir(base_url, keys, args)
+            base = base or rps
+            linea = f"  workers={workers:<3d} {rps:9.1f} req/s  escalado x{rps / base:.2f} (ideal x{workers / args.workers[0]:.0f})"
+            if workers > 1:
+                linea += f"  propagación de borrado: {medir_propagacion(base_url, keys[n]):.2f}s"
+            print(linea)
+        finally:
+            servidor.terminate()
+            servidor.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--concurrency", type=int, default=64)
+    try:
+        main(parser.parse_args())
+    finally:
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(DB_PATH + sufijo):
+                os.remove(DB_PATH + sufijo)
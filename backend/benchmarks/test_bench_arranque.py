@@ -0,0 +1,92 @@
+"""
+Tiempo de arranque: cuánto cuesta 'import main' (python -X importtime).
+
+Cada worker y cada ejecución de los tests importan main, y con escalado bajo
+demanda el arranque en frío cuenta. Estas pruebas fijan un presupuesto para
+el tiempo de importación y comprueban que las dependencias pesadas que solo
+se usan al validar (httpx, validators) no se cargan al importar, y que
+importar no toca la base de datos.
+
+Uso (desde backend/):
+    pytest benchmarks/test_bench_arranque.py -s     # -s muestra el desglose
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Presupuesto (ms) para el tiempo acumulado de 'import main'. Hoy ronda
+# 0,65 s en un núcleo modesto, casi todo FastAPI y SQLAlchemy; el margen
+# absorbe máquinas de CI lentas sin dejar pasar regresiones grandes.
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+
+# Se toma el mínimo de varias ejecuciones para reducir el ruido
+REPETICIONES = 3
+
+
+def _entorno(db_path: str) -> dict:
+    return dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", PYTHONPATH=BACKEND_DIR)
+
+
+def tiempos_importacion(db_path: str) -> dict[str, int]:
+    """
+    Ejecuta 'python -X importtime -c "import main"' en un proceso limpio y
+    devuelve el tiempo acumulado (microsegundos) de cada módulo importado
+    directamente por main, más el total bajo la clave 'main'.
+    """
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=_entorno(db_path), capture_output=True, text=True, check=True,
+    ).stderr
+
+    # Las líneas salen en post-orden: los hijos antes que el padre, con dos
+    # espacios más de sangría por nivel. Los hijos directos de main son los
+    # de nivel 1 que aparecen antes de su línea.
+    tiempos: dict[str, int] = {}
+    pendientes: dict[str, int] = {}
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "cumulative" in linea:
+            continue
+        _, acumulado, nombre = linea.split("|")
+        nivel = (len(nombre) - len(nombre.lstrip())) // 2
+        if nivel == 1:
+            pendientes[nombre.strip()] = int(acumulado)
+        elif nivel == 0:
+            if nombre.strip() == "main":
+                tiempos.update(pendientes)
+                tiempos["main"] = int(acumulado)
+            pendientes = {}
+    return tiempos
+
+
+def _db_temporal() -> str:
+    directorio = tempfile.mkdtemp()
+    return os.path.join(directorio, "arranque.db")
+
+
+def test_importar_main_no_carga_dependencias_pesadas_ni_toca_la_bd():
+    db_path = _db_temporal()
+    codigo = "import sys, main; print(','.join(m for m in ('httpx', 'validators') if m in sys.modules))"
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo],
+        cwd=BACKEND_DIR, env=_entorno(db_path), capture_output=True, text=True, check=True,
+    ).stdout.strip()
+
+    assert salida == "", f"Importados al arrancar: {salida}"
+    # El esquema se crea en el lifespan (o con server.py --migrate), no al importar
+    assert not os.path.exists(db_path)
+
+
+def test_tiempo_de_importacion_dentro_del_presupuesto():
+    db_path = _db_temporal()
+    ejecuciones = [tiempos_importacion(db_path) for _ in range(REPETICIONES)]
+    mejor = min(ejecuciones, key=lambda t: t["main"])
+
+    desglose = sorted(((t, m) for m, t in mejor.items() if m != "main"), reverse=True)[:10]
+    print(f"\nimport main: {mejor['main'] / 1000:.0f} ms (presupuesto {STARTUP_IMPORT_BUDGET_MS:.0f} ms)")
+    for tiempo, modulo in desglose:
+        print(f"  {modulo:28s} {tiempo / 1000:7.1f} ms")
+
+    assert mejor["main"] / 1000 <= STARTUP_IMPORT_BUDGET_MS
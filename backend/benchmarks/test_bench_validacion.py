@@ -0,0 +1,251 @@
+"""
+Benchmark del validador de URLs (pytest-benchmark).
+
+Compara la implementación anterior de validar_formato_url + validar_dominio
+(copiada abajo tal cual, como referencia) con el validador de una sola
+pasada de validation.py, sobre un corpus de URLs válidas e inválidas.
+
+Uso (desde backend/):
+    pytest benchmarks/test_bench_validacion.py --benchmark-group-by=group
+"""
+import os
+import re
+import sys
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import MAX_URL_LENGTH, VALID_TLDS, validar_url, validate_many
+
+# ==============================================================================
+# CORPUS
+# ==============================================================================
+
+URLS_VALIDAS = [
+    "https://www.google.com",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "http://example.org/path/to/page.html",
+    "https://sub.domain.example.co.uk/a/b/c?x=1&y=2",
+    "https://github.com/SergioC2410/url_shortener",
+    "https://maps.google.es/maps?q=madrid",
+    "https://en.wikipedia.org/wiki/URL_shortening",
+    "https://my-site.io/",
+    "https://docs.python.org/3/library/ipaddress.html",
+    "https://news.ycombinator.com/item?id=1",
+]
+
+URLS_INVALIDAS = [
+    "https://pizza",
+    "https://ejemplo.zz",
+    "https://a..com",
+    "https://-malo.com",
+    "https://x.com",
+    "https://mal_guion.com/ruta",
+    "https://ejemplo.com:8080/",
+    "https://localhost/admin",
+    "https://192.168.1.1/router",
+    "https://" + "a" * MAX_URL_LENGTH + ".com",
+]
+
+CORPUS = (URLS_VALIDAS + URLS_INVALIDAS) * 10
+
+# ==============================================================================
+# IMPLEMENTACIÓN ANTERIOR (REFERENCIA)
+# ==============================================================================
+
+# Dominios bloqueados (ejemplos comunes)
+BLOCKED_DOMAINS = [
+    "localhost",
+    "127.0.0.1",
+    "0.0.0.0",
+    "::1",
+    "192.168.",
+    "10.",
+    "172.16.",
+    "172.17.",
+    "172.18.",
+    "172.19.",
+    "172.20.",
+    "172.21.",
+    "172.22.",
+    "172.23.",
+    "172.24.",
+    "172.25.",
+    "172.26.",
+    "172.27.",
+    "172.28.",
+    "172.29.",
+    "172.30.",
+    "172.31.",
+]
+
+# ==============================================================================
+# 1.2 FUNCIONES DE VALIDACIÓN MEJORADAS
+# ==============================================================================
+
+def legacy_validar_formato_url(url: str) -> tuple[bool, str]:
+    """Valida el formato básico de una URL de manera estricta"""
+    # Validación de longitud
+    if len(url) > MAX_URL_LENGTH:
+        return False, f"La URL es demasiado larga (máximo {MAX_URL_LENGTH} caracteres)"
+    
+    # Eliminar protocolo si existe para analizar el dominio
+    clean_url = url.lower()
+    if clean_url.startswith(('http://', 'https://')):
+        clean_url = clean_url.split('://', 1)[1]
+    
+    # Eliminar ruta y parámetros si existen
+    domain_part = clean_url.split('/')[0]
+    
+    # Verificar que tenga al menos un punto
+    if '.' not in domain_part:
+        return False, "El dominio debe contener un punto (ej: ejemplo.com)"
+    
+    # Dividir dominio para analizar
+    domain_parts = domain_part.split('.')
+    
+    # Verificar que haya al menos 2 partes después del último punto
+    if len(domain_parts) < 2:
+        return False, "Dominio incompleto (ej: ejemplo.com)"
+    
+    # Verificar cada parte del dominio
+    for part in domain_parts:
+        if not part:
+            return False, "Parte del dominio vacía"
+        if len(part) < 1:  # No permitir partes de dominio vacías
+            return False, "Parte del dominio demasiado corta"
+        if not re.match(r'^[a-z0-9]([a-z0-9-]*[a-z0-9])?$', part):
+            return False, f"Parte del dominio inválida: '{part}'"
+    
+    # Verificar el TLD (extensión del dominio)
+    tld = domain_parts[-1].lower()
+    if tld not in VALID_TLDS:
+        return False, f"Extensión de dominio no válida: '.{tld}'"
+    
+    # Verificar que el dominio principal (sin TLD) no sea demasiado corto
+    main_domain = domain_parts[-2] if len(domain_parts) >= 2 else ''
+    if len(main_domain) < 2 and main_domain not in {'co', 'ac', 'go', 'or', 'ne', 'com'}:
+        return False, "Nombre de dominio principal demasiado corto"
+    
+    # Patrón regex más estricto para URL completa
+    patron_url = re.compile(
+        r'^(https?://)?'  # http:// o https:// (opcional)
+        r'([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+'  # dominio
+        r'[A-Za-z]{2,}'  # extensión de dominio (al menos 2 caracteres)
+        r'(:[0-9]{1,5})?'  # puerto opcional
+        r'(/.*)?$',  # ruta opcional
+        re.IGNORECASE
+    )
+    
+    if not patron_url.match(url):
+        return False, "Formato de URL inválido"
+    
+    return True, ""
+
+def legacy_validar_dominio(url: str) -> tuple[bool, str]:
+    """Valida que el dominio no sea local, privado o sospechoso"""
+    try:
+        parsed = urlparse(url)
+        if not parsed.hostname:
+            return False, "URL sin dominio válido"
+        
+        hostname = parsed.hostname.lower()
+        
+        # Verificar dominios bloqueados
+        for blocked in BLOCKED_DOMAINS:
+            if hostname.startswith(blocked):
+                return False, f"Dominio no permitido: {hostname}"
+        
+        # Verificar si es IP
+        if re.match(r'^\d+\.\d+\.\d+\.\d+$', hostname):
+            octetos = list(map(int, hostname.split('.')))
+            # IPs privadas
+            if octetos[0] == 10:
+                return False, "IP privada (10.x.x.x) no permitida"
+            elif octetos[0] == 172 and 16 <= octetos[1] <= 31:
+                return False, "IP privada (172.16-31.x.x) no permitida"
+            elif octetos[0] == 192 and octetos[1] == 168:
+                return False, "IP privada (192.168.x.x) no permitida"
+        
+        # Verificar que el dominio tenga al menos 2 partes separadas por punto
+        if hostname.count('.') < 1:
+            return False, "Dominio debe tener al menos un punto separador"
+        
+        # Verificar que no sea solo un TLD (como "com" o "org")
+        domain_parts = hostname.split('.')
+        if len(domain_parts) < 2:
+            return False, "Dominio incompleto"
+        
+        # Verificar que el último segmento (TLD) tenga al menos 2 caracteres
+        tld = domain_parts[-1]
+        if len(tld) < 2:
+            return False, "Extensión de dominio demasiado corta"
+        
+        # Verificar dominio principal
+        main_domain = domain_parts[-2]
+        if len(main_domain) < 2:
+            return False, "Nombre de dominio principal demasiado corto"
+        
+        return True, ""
+        
+    except Exception as e:
+        return False, f"Error validando dominio: {str(e)}"
+
+
+def legacy_validar(url: str) -> bool:
+    return legacy_validar_formato_url(url)[0] and legacy_validar_dominio(url)[0]
+
+# ==============================================================================
+# TESTS
+# ==============================================================================
+
+@pytest.mark.parametrize("url", URLS_VALIDAS + URLS_INVALIDAS)
+def test_mismo_veredicto_que_la_version_anterior(url):
+    """El validador nuevo acepta y rechaza exactamente lo mismo sobre el corpus"""
+    assert validar_url(url)[0] == legacy_validar(url)
+
+def test_validate_many_conserva_el_orden():
+    resultados = validate_many(["www.google.com", "pizza", "www.google.com"])
+    assert [ok for ok, _ in resultados] == [True, False, True]
+    assert resultados[0][1] == "https://www.google.com"
+
+def test_aceleracion_minima():
+    """
+    Con URLs válidas (el caso habitual, que recorre todas las comprobaciones)
+    el validador nuevo es varias veces más rápido. En local ronda x4; el
+    umbral es conservador para no fallar en máquinas de CI ruidosas.
+    """
+    def medir(funcion):
+        inicio = time.perf_counter()
+        for _ in range(200):
+            for url in URLS_VALIDAS:
+                funcion(url)
+        return time.perf_counter() - inicio
+
+    antes, despues = medir(legacy_validar), medir(validar_url)
+    assert antes / despues >= 2, f"solo x{antes / despues:.1f}"
+
+@pytest.mark.benchmark(group="validas")
+def test_bench_validas_anterior(benchmark):
+    benchmark(lambda: [legacy_validar(url) for url in URLS_VALIDAS])
+
+@pytest.mark.benchmark(group="validas")
+def test_bench_validas_una_pasada(benchmark):
+    benchmark(lambda: [validar_url(url) for url in URLS_VALIDAS])
+
+@pytest.mark.benchmark(group="corpus")
+def test_bench_corpus_anterior(benchmark):
+    benchmark(lambda: [legacy_validar(url) for url in CORPUS])
+
+@pytest.mark.benchmark(group="corpus")
+def test_bench_corpus_una_pasada(benchmark):
+    benchmark(lambda: [validar_url(url) for url in CORPUS])
+
+@pytest.mark.benchmark(group="lote")
+def test_bench_validate_many(benchmark):
+    benchmark(validate_many, [url.replace("https://", "") for url in CORPUS])
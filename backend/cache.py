@@ -0,0 +1,274 @@
+import os
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Número máximo de claves cortas que se mantienen en memoria.
+# Cada entrada ocupa poco (clave + URL destino), así que unas decenas de miles
+# caben sin problema incluso en instancias pequeñas.
+RESOLUTION_CACHE_SIZE = int(os.getenv("RESOLUTION_CACHE_SIZE", "10000"))
+
+# Tiempo de vida de cada entrada (segundos). Acota cuánto puede tardar en
+# verse un cambio hecho fuera de este proceso (ej: otro worker o un script).
+RESOLUTION_CACHE_TTL = float(os.getenv("RESOLUTION_CACHE_TTL", "300"))
+
+# Caché DNS: cuánto se recuerda un dominio que resuelve (positivo) y uno que
+# no resuelve (negativo, más corto para no castigar fallos transitorios).
+DNS_CACHE_SIZE = int(os.getenv("DNS_CACHE_SIZE", "10000"))
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", "300"))
+DNS_NEGATIVE_TTL = float(os.getenv("DNS_NEGATIVE_TTL", "30"))
+
+# Caché de accesibilidad por URL destino (resultado del HEAD/GET)
+VALIDATION_CACHE_SIZE = int(os.getenv("VALIDATION_CACHE_SIZE", "10000"))
+VALIDATION_CACHE_TTL = float(os.getenv("VALIDATION_CACHE_TTL", "3600"))
+
+# ==============================================================================
+# 2. CACHÉ DE RESOLUCIÓN DE CLAVES CORTAS
+# ==============================================================================
+
+class URLResuelta(NamedTuple):
+    """Datos mínimos necesarios para redirigir una clave corta."""
+    target_url: str
+    is_active: bool
+    # Política de redirección del enlace ('permanent', 'temporary' o None =
+    # la global) y fecha de su última edición (para ETag/Last-Modified)
+    redirect_type: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    # Caducidad (instante Unix) y límite de visitas, con las visitas que
+    # tenía al leerlo de la BD. None = sin caducidad / sin límite.
+    expires_at: Optional[float] = None
+    max_clicks: Optional[int] = None
+    clicks: int = 0
+
+
+class CacheResolucion:
+    """
+    Caché en memoria clave corta -> URLResuelta (destino, estado y política).
+
+    Combina dos políticas:
+      - LRU: cuando se llena, se descarta la entrada usada hace más tiempo.
+      - TTL: una entrada caduca pasado 'ttl' segundos aunque se use mucho.
+
+    Es segura entre hilos (las rutas síncronas de FastAPI corren en un
+    threadpool) y lleva contadores de aciertos, fallos y desalojos para
+    poder dimensionarla desde /api/health.
+    """
+
+    def __init__(self, max_size: int = RESOLUTION_CACHE_SIZE, ttl: float = RESOLUTION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._datos: "OrderedDict[str, tuple[float, URLResuelta]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[URLResuelta]:
+        """Devuelve la entrada si existe y no ha caducado, o None."""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(key)
+            if entrada is None:
+                self.misses += 1
+                return None
+
+            expira, valor = entrada
+            if expira <= ahora:
+                # Caducada: se elimina y cuenta como fallo
+                del self._datos[key]
+                self.misses += 1
+                return None
+
+            self._datos.move_to_end(key)
+            self.hits += 1
+            return valor
+
+    def set(self, key: str, target_url: str, is_active: bool,
+            redirect_type: Optional[str] = None, updated_at: Optional[datetime] = None,
+            expires_at: Optional[float] = None, max_clicks: Optional[int] = None, clicks: int = 0) -> None:
+        """Guarda (o refresca) una entrada, desalojando la menos usada si hace falta."""
+        # Los enlaces con máximo de visitas no se cachean: cada redirección
+        # necesita sus visitas actuales, que cambian con cada volcado
+        if self.max_size <= 0 or max_clicks is not None:
+            return
+
+        valor = URLResuelta(target_url, is_active, redirect_type, updated_at, expires_at, max_clicks, clicks)
+        with self._lock:
+            self._datos[key] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(key)
+            while len(self._datos) > self.max_size:
+                self._datos.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        """Elimina una clave (se llama al editar o borrar un enlace)."""
+        with self._lock:
+            self._datos.pop(key, None)
+
+    def clear(self) -> None:
+        """Vacía la caché por completo (los contadores se conservan)."""
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self) -> dict:
+        """Resumen para el endpoint de diagnóstico."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._datos),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# ==============================================================================
+# 3. CACHÉ DNS (ASÍNCRONA)
+# ==============================================================================
+
+ResultadoDNS = tuple[bool, str]
+
+
+class CacheDNS:
+    """
+    Caché de resoluciones DNS con TTL, caché negativa y deduplicación.
+
+    - Un dominio que resuelve se recuerda 'ttl' segundos; uno que no
+      resuelve, 'negative_ttl' segundos.
+    - Si llegan varias consultas simultáneas del mismo dominio (típico en
+      una importación masiva), solo se lanza una resolución y todas esperan
+      el mismo futuro.
+
+    Se usa desde el event loop, por lo que no necesita locks.
+    """
+
+    def __init__(self, max_size: int = DNS_CACHE_SIZE, ttl: float = DNS_CACHE_TTL,
+                 negative_ttl: float = DNS_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._datos: "OrderedDict[str, tuple[float, ResultadoDNS]]" = OrderedDict()
+        self._en_curso: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    async def resolver(self, hostname: str,
+                       resolutor: Callable[[str], Awaitable[ResultadoDNS]]) -> ResultadoDNS:
+        """Devuelve el resultado cacheado o resuelve con 'resolutor' (una sola vez por dominio)."""
+        host = (hostname or "").lower()
+
+        entrada = self._datos.get(host)
+        if entrada is not None:
+            expira, resultado = entrada
+            if expira > time.monotonic():
+                self._datos.move_to_end(host)
+                self.hits += 1
+                return resultado
+            del self._datos[host]
+
+        futuro = self._en_curso.get(host)
+        if futuro is not None:
+            self.deduplicated += 1
+        else:
+            self.misses += 1
+            futuro = asyncio.ensure_future(resolutor(hostname))
+            self._en_curso[host] = futuro
+            futuro.add_done_callback(lambda f: self._guardar(host, f))
+
+        # shield: si una petición se cancela, no cancela la resolución de las demás
+        return await asyncio.shield(futuro)
+
+    def _guardar(self, host: str, futuro: asyncio.Future) -> None:
+        """Guarda el resultado al terminar la resolución (éxito o fallo)."""
+        self._en_curso.pop(host, None)
+        if futuro.cancelled() or futuro.exception() is not None or self.max_size <= 0:
+            return
+
+        resultado = futuro.result()
+        ttl = self.ttl if resultado[0] else self.negative_ttl
+        self._datos[host] = (time.monotonic() + ttl, resultado)
+        self._datos.move_to_end(host)
+        while len(self._datos) > self.max_size:
+            self._datos.popitem(last=False)
+
+    def clear(self) -> None:
+        """Vacía la caché (los contadores se conservan)."""
+        self._datos.clear()
+
+    def estadisticas(self) -> dict:
+        """Resumen para el endpoint de diagnóstico."""
+        return {
+            "size": len(self._datos),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "deduplicated": self.deduplicated,
+        }
+
+
+# ==============================================================================
+# 4. CACHÉ DE ACCESIBILIDAD POR URL
+# ==============================================================================
+
+class CacheValidacion:
+    """
+    Recuerda durante 'ttl' segundos si una URL destino respondió o no.
+
+    Los clientes reenvían una y otra vez los mismos destinos populares;
+    con esto solo se sondea cada URL una vez por TTL. Se usa desde el
+    event loop (validación) y no necesita locks.
+    """
+
+    def __init__(self, max_size: int = VALIDATION_CACHE_SIZE, ttl: float = VALIDATION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._datos: "OrderedDict[str, tuple[float, tuple[bool, str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[tuple[bool, str]]:
+        """Devuelve (accesible, mensaje) si está cacheado y vigente, o None."""
+        entrada = self._datos.get(url)
+        if entrada is None or entrada[0] <= time.monotonic():
+            if entrada is not None:
+                del self._datos[url]
+            self.misses += 1
+            return None
+        self._datos.move_to_end(url)
+        self.hits += 1
+        return entrada[1]
+
+    def set(self, url: str, resultado: tuple[bool, str]) -> None:
+        """Guarda el resultado de la comprobación de una URL."""
+        if self.max_size <= 0:
+            return
+        self._datos[url] = (time.monotonic() + self.ttl, resultado)
+        self._datos.move_to_end(url)
+        while len(self._datos) > self.max_size:
+            self._datos.popitem(last=False)
+
+    def estadisticas(self) -> dict:
+        """Resumen para el endpoint de diagnóstico."""
+        return {
+            "size": len(self._datos),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Instancias compartidas por toda la aplicación
+cache_resolucion = CacheResolucion()
+cache_dns = CacheDNS()
+cache_validacion = CacheValidacion()
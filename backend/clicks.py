@@ -0,0 +1,130 @@
+import os
+import threading
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+import crud
+from database import SessionLocal
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Cada cuántos segundos se vuelcan las visitas acumuladas a la base de datos
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "2"))
+
+# Si se acumulan más visitas pendientes que este umbral, se adelanta el volcado
+CLICK_FLUSH_THRESHOLD = int(os.getenv("CLICK_FLUSH_THRESHOLD", "1000"))
+
+# ==============================================================================
+# 2. ACUMULADOR DE VISITAS (WRITE-BEHIND)
+# ==============================================================================
+
+class AcumuladorClicks:
+    """
+    Agrupa en memoria las visitas de cada clave corta y las escribe por lotes.
+
+    La redirección solo suma en un diccionario (microsegundos); un hilo en
+    segundo plano vuelca los contadores cada 'interval' segundos, o antes si
+    se supera 'threshold', con un único UPDATE ... SET clicks = clicks + :n
+    por lote. Así la latencia de la redirección no depende de la escritura
+    en la base de datos, y el incremento atómico evita perder visitas aunque
+    haya varios workers escribiendo a la vez.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        interval: float = CLICK_FLUSH_INTERVAL,
+        threshold: int = CLICK_FLUSH_THRESHOLD,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.threshold = threshold
+        self._pendientes: dict[str, int] = {}
+        self._total_pendiente = 0
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def registrar(self, key: str, n: int = 1) -> None:
+        """Suma 'n' visitas a la clave. No toca la base de datos."""
+        with self._lock:
+            self._pendientes[key] = self._pendientes.get(key, 0) + n
+            self._total_pendiente += n
+            superado = self._total_pendiente >= self.threshold
+        if superado:
+            self._despertar.set()
+
+    def pendientes(self, key: str) -> int:
+        """Visitas de la clave que aún no se han escrito en la BD."""
+        with self._lock:
+            return self._pendientes.get(key, 0)
+
+    def flush(self, session_factory: Optional[Callable[[], Session]] = None) -> int:
+        """
+        Escribe todas las visitas pendientes en una sola transacción.
+
+        Si la escritura falla, los contadores se devuelven al acumulador para
+        reintentarlo en el siguiente ciclo. Devuelve el número de visitas escritas.
+        """
+        with self._lock:
+            lote = self._pendientes
+            self._pendientes = {}
+            self._total_pendiente = 0
+
+        if not lote:
+            return 0
+
+        db = None
+        try:
+            db = (session_factory or self.session_factory)()
+            crud.apply_click_increments(db, lote)
+        except Exception:
+            with self._lock:
+                for key, n in lote.items():
+                    self._pendientes[key] = self._pendientes.get(key, 0) + n
+                    self._total_pendiente += n
+            raise
+        finally:
+            if db is not None:
+                db.close()
+
+        return sum(lote.values())
+
+    def _bucle(self) -> None:
+        """Hilo de fondo: vuelca por intervalo o cuando se supera el umbral."""
+        while not self._parar.is_set():
+            self._despertar.wait(self.interval)
+            self._despertar.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error volcando visitas: {e}")
+
+    def start(self) -> None:
+        """Arranca el hilo de volcado (se llama al iniciar la aplicación)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="click-flusher", daemon=True)
+        self._hilo.start()
+
+    def stop(self) -> None:
+        """Detiene el hilo y hace un último volcado para no perder visitas."""
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo:
+            self._hilo.join(timeout=self.interval + 5)
+            self._hilo = None
+        try:
+            self.flush()
+        except Exception as e:
+            # Que no impida el resto del apagado (p. ej. volcar las analíticas)
+            print(f"Error volcando visitas al apagar: {e}")
+
+
+# Instancia compartida por toda la aplicación
+acumulador_clicks = AcumuladorClicks()
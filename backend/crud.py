@@ -1,7 +1,15 @@
+from sqlalchemy import select, insert, update, delete, bindparam, func, or_, and_, tuple_, case, literal, type_coerce, String
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import models, schemas
-import secrets
-import string
+import keygen
+from validation import normalizar_destino, huella_destino
+import base64
+import json
+from collections import Counter
+from datetime import datetime
+from typing import Optional
 
 # ==============================================================================
 # 1. FUNCIONES DE LECTURA (READ)
@@ -20,6 +28,17 @@ def get_url_by_key(db: Session, key: str):
     """
     return db.query(models.URLItem).filter(models.URLItem.key == key).first()
 
+# Máximo de parámetros por consulta IN (SQLite limita el número de variables)
+_TAMANO_BLOQUE_IN = 500
+
+def get_existing_keys(db: Session, keys: list[str]) -> set[str]:
+    """Cuáles de 'keys' existen ya (consultas IN por bloques)."""
+    existentes = set()
+    for i in range(0, len(keys), _TAMANO_BLOQUE_IN):
+        bloque = keys[i:i + _TAMANO_BLOQUE_IN]
+        existentes.update(db.scalars(select(models.URLItem.key).where(models.URLItem.key.in_(bloque))))
+    return existentes
+
 def get_urls(db: Session, skip: int = 0, limit: int = 100):
     """
     Obtiene una lista de todas las URLs guardadas.
@@ -44,19 +63,23 @@ def create_random_key(length: int = 5) -> str:
     Returns:
         str: La cadena generada.
     """
-    chars = string.ascii_letters + string.digits
-    return "".join(secrets.choice(chars) for _ in range(length))
+    return keygen.clave_aleatoria(length)
 
 # ==============================================================================
 # 3. FUNCIONES DE ESCRITURA (CREATE, UPDATE, DELETE)
 # ==============================================================================
 
+# Intentos con una clave nueva si la generada ya existe. Solo puede pasar si
+# se importaron claves que caen en el espacio del generador (importer.py).
+REINTENTOS_CLAVE = 5
+
 def create_url(db: Session, url: schemas.URLCreate) -> models.URLItem:
     """
     Crea una nueva entrada de URL acortada en la base de datos.
     
-    Implementa una verificación de colisiones: si la clave generada aleatoriamente
-    ya existe (caso muy raro), genera una nueva hasta encontrar una libre.
+    La clave la da el generador configurado (keygen.KEY_GENERATOR): con la
+    estrategia secuencial no hace falta comprobar colisiones en la BD (si la
+    clave ya existía, por una importación, se reintenta con otra).
 
     Args:
         db (Session): La sesión de base de datos.
@@ -65,26 +88,28 @@ def create_url(db: Session, url: schemas.URLCreate) -> models.URLItem:
     Returns:
         models.URLItem: La instancia del modelo creada y guardada.
     """
-    # Intentamos generar una clave única
-    key = create_random_key()
-    
-    # Programación defensiva: verificamos que la clave no exista ya en la BD
-    while get_url_by_key(db, key):
-        key = create_random_key()
+    for intento in range(REINTENTOS_CLAVE):
+        key = keygen.generador_claves.claves(db)[0]
 
-    # Instanciamos el modelo
-    db_url = models.URLItem(target_url=url.target_url, key=key)
-    
-    try:
-        db.add(db_url)
-        db.commit()
-        db.refresh(db_url)
-    except Exception as e:
-        # Hacemos rollback en caso de error inesperado para no dejar la sesión sucia
-        db.rollback()
-        raise e
+        # Instanciamos el modelo
+        db_url = models.URLItem(target_url=url.target_url, key=key, redirect_type=url.redirect_type,
+                                 target_hash=huella_destino(url.target_url),
+                                 expires_at=url.expires_at, max_clicks=url.max_clicks)
 
-    return db_url
+        try:
+            db.add(db_url)
+            adjust_summary(db, links=1, active_links=1)
+            db.commit()
+            db.refresh(db_url)
+            return db_url
+        except IntegrityError:
+            db.rollback()
+            if intento == REINTENTOS_CLAVE - 1:
+                raise
+        except Exception as e:
+            # Hacemos rollback en caso de error inesperado para no dejar la sesión sucia
+            db.rollback()
+            raise e
 
 def update_url(db: Session, db_url: models.URLItem, updates: schemas.URLUpdate):
     """
@@ -94,11 +119,17 @@ def update_url(db: Session, db_url: models.URLItem, updates: schemas.URLUpdate):
     el usuario realmente envió (ej: si solo envió is_active, no tocamos target_url).
     """
     update_data = updates.model_dump(exclude_unset=True)
+    activo_antes = db_url.is_active is not False
     
     for key, value in update_data.items():
         setattr(db_url, key, value)
+    if "target_url" in update_data:
+        db_url.target_hash = huella_destino(db_url.target_url)
+    # Cambia el ETag/Last-Modified de la redirección (hora de la BD, como created_at)
+    db_url.updated_at = func.now()
 
     db.add(db_url)
+    adjust_summary(db, active_links=(db_url.is_active is not False) - activo_antes)
     db.commit()
     db.refresh(db_url)
     return db_url
@@ -108,5 +139,663 @@ def delete_url(db: Session, db_url: models.URLItem):
     Elimina físicamente una URL de la base de datos.
     """
     db.delete(db_url)
+    adjust_summary(db, links=-1, active_links=-(db_url.is_active is not False), clicks=-(db_url.clicks or 0))
     db.commit()
-    return True
\ No newline at end of file
+    return True
+
+def apply_click_increments(db: Session, incrementos: dict[str, int]) -> None:
+    """
+    Suma a cada URL las visitas acumuladas en memoria, en una sola transacción.
+
+    Usa 'clicks = clicks + :n' en la propia sentencia UPDATE (executemany),
+    de modo que el incremento es atómico en la base de datos y no se pierden
+    visitas aunque varios procesos escriban a la vez (a diferencia de leer,
+    sumar y guardar el objeto ORM).
+
+    El total del resumen solo suma las visitas de claves que siguen existiendo
+    (las de un enlace borrado mientras se acumulaban se pierden con él).
+    """
+    tabla = models.URLItem.__table__
+    sentencia = (
+        update(tabla)
+        .where(tabla.c.key == bindparam("b_key"))
+        .values(clicks=func.coalesce(tabla.c.clicks, 0) + bindparam("b_n"))
+    )
+    try:
+        db.execute(sentencia, [{"b_key": key, "b_n": n} for key, n in incrementos.items()])
+        existentes = get_existing_keys(db, list(incrementos))
+        adjust_summary(db, clicks=sum(n for key, n in incrementos.items() if key in existentes))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+
+# ==============================================================================
+# 4. VERSIONES ASÍNCRONAS (AsyncSession)
+# ==============================================================================
+# Mismas operaciones que arriba, pero pensadas para las rutas 'async def' de
+# FastAPI: no bloquean el event loop ni ocupan un hilo del threadpool.
+
+async def get_url_by_key_async(db: AsyncSession, key: str):
+    """Versión asíncrona de get_url_by_key."""
+    result = await db.execute(select(models.URLItem).where(models.URLItem.key == key))
+    return result.scalars().first()
+
+async def get_existing_keys_async(db: AsyncSession, keys: list[str]) -> set[str]:
+    """Versión asíncrona de get_existing_keys."""
+    existentes = set()
+    for i in range(0, len(keys), _TAMANO_BLOQUE_IN):
+        bloque = keys[i:i + _TAMANO_BLOQUE_IN]
+        existentes.update(await db.scalars(select(models.URLItem.key).where(models.URLItem.key.in_(bloque))))
+    return existentes
+
+async def get_urls_async(db: AsyncSession, skip: int = 0, limit: int = 100):
+    """Versión asíncrona de get_urls."""
+    result = await db.execute(select(models.URLItem).offset(skip).limit(limit))
+    return result.scalars().all()
+
+# Ordenaciones admitidas: (columna principal, descendente)
+# Cada una recorre un índice compuesto (columna, id): el 'id' desempata.
+# Las de fecha van por created_at y no por el id: el importador guarda la
+# fecha original de cada enlace, que no sigue el orden de inserción.
+ORDENES_URLS = {
+    "date_desc": ("created_at", True),
+    "date_asc": ("created_at", False),
+    "clicks_desc": ("clicks", True),
+    "clicks_asc": ("clicks", False),
+    "alpha_asc": ("key", False),
+}
+
+# Expresión SQL de cada columna de ordenación (sin entrada: la propia columna)
+EXPRESIONES_ORDEN = {"clicks": models.VISITAS}
+
+# Tipos que puede traer un cursor para cada columna de ordenación
+# (created_at va como texto, ver get_urls_page_async)
+TIPOS_CURSOR = {"id": (int,), "clicks": (int,), "key": (str,), "created_at": (str,)}
+
+def encode_cursor(valores: list) -> str:
+    """Convierte la posición de la última fila en un cursor opaco para la URL."""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """Inverso de encode_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(valores, list):
+        raise ValueError("Cursor inválido")
+    return valores
+
+def filtro_prefijo(columna, prefijo: str):
+    """
+    columna empieza por 'prefijo', como rango [prefijo, siguiente) que
+    cualquier índice B-tree puede servir (un LIKE 'x%' solo lo usa con
+    según qué collation).
+    """
+    siguiente = prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+    return and_(columna >= prefijo, columna < siguiente)
+
+async def get_urls_page_async(db: AsyncSession, limit: int = 100, cursor: Optional[str] = None,
+                              sort: str = "date_desc", q: Optional[str] = None,
+                              skip: int = 0) -> tuple[list, Optional[str]]:
+    """
+    Paginación por cursor (keyset) con búsqueda y ordenación en el servidor.
+
+    En vez de OFFSET (que recorre y descarta todas las filas anteriores),
+    el cursor guarda los valores de ordenación de la última fila devuelta y
+    la siguiente página empieza con un WHERE (columna, id) > (valor, id)
+    sobre un índice, así que cuesta lo mismo en la página 1 que en la 10.000.
+
+    La búsqueda 'q' encuentra códigos que empiezan por 'q' (rango sobre el
+    índice de 'key', distingue mayúsculas como los códigos) y destinos que
+    contienen 'q' sin distinguir mayúsculas. Esta segunda parte no tiene
+    índice (un LIKE '%q%' no lo puede usar): se filtra mientras se recorre
+    el índice de la ordenación y se para al llenar la página, así que solo
+    es cara con términos que casi no aparecen. '%' y '_' se buscan
+    literalmente.
+
+    En SQLite las fechas son texto y no todas con el mismo formato
+    (CURRENT_TIMESTAMP no lleva microsegundos y las fechas de Python sí), así
+    que el cursor guarda created_at tal como está en la BD y se compara como
+    texto, igual que lo ordena el índice. En otras BD va en ISO 8601.
+
+    Devuelve (urls, cursor_siguiente) — cursor_siguiente es None al final.
+    """
+    if sort not in ORDENES_URLS:
+        raise ValueError(f"Orden no soportado: {sort}")
+    nombre, descendente = ORDENES_URLS[sort]
+    nombres = [nombre, "id"]
+    columnas = [EXPRESIONES_ORDEN.get(n, getattr(models.URLItem, n)) for n in nombres]
+    fecha_como_texto = "created_at" in nombres and db.bind.dialect.name == "sqlite"
+
+    if fecha_como_texto:
+        consulta = select(models.URLItem, type_coerce(models.URLItem.created_at, String).label("fecha_texto"))
+    else:
+        consulta = select(models.URLItem)
+
+    if q:
+        consulta = consulta.where(or_(filtro_prefijo(models.URLItem.key, q),
+                                      models.URLItem.target_url.icontains(q, autoescape=True)))
+
+    if cursor:
+        valores = decode_cursor(cursor)
+        if len(valores) != len(columnas) or any(
+            isinstance(valor, bool) or not isinstance(valor, TIPOS_CURSOR[n])
+            for valor, n in zip(valores, nombres)
+        ):
+            raise ValueError("Cursor inválido")
+        if "created_at" in nombres:
+            i = nombres.index("created_at")
+            if fecha_como_texto:
+                valores[i] = literal(valores[i], String)
+            else:
+                try:
+                    valores[i] = datetime.fromisoformat(valores[i])
+                except ValueError:
+                    raise ValueError("Cursor inválido")
+        posicion, valor = tuple_(*columnas), tuple_(*valores)
+        consulta = consulta.where(posicion < valor if descendente else posicion > valor)
+    elif skip:
+        consulta = consulta.offset(skip)
+
+    consulta = consulta.order_by(*(c.desc() if descendente else c.asc() for c in columnas))
+
+    # Pedimos una fila de más para saber si hay página siguiente
+    filas = (await db.execute(consulta.limit(limit + 1))).all()
+    urls = [fila[0] for fila in filas]
+
+    siguiente = None
+    if len(urls) > limit:
+        urls = urls[:limit]
+        ultima = urls[-1]
+        # Mismos valores que las expresiones de ordenación (clicks NULL -> 0)
+        valores = []
+        for n in nombres:
+            if n == "clicks":
+                valores.append(ultima.clicks or 0)
+            elif n == "created_at":
+                valores.append(filas[limit - 1][1] if fecha_como_texto else ultima.created_at.isoformat())
+            else:
+                valores.append(getattr(ultima, n))
+        siguiente = encode_cursor(valores)
+
+    return urls, siguiente
+
+async def create_url_async(db: AsyncSession, url: schemas.URLCreate,
+                           check_status: Optional[str] = None) -> models.URLItem:
+    """
+    Versión asíncrona de create_url.
+    'check_status' guarda el resultado de la comprobación de accesibilidad
+    ('pending' si se hará en segundo plano).
+    """
+    for intento in range(REINTENTOS_CLAVE):
+        key = (await keygen.generador_claves.claves_async(db))[0]
+
+        db_url = models.URLItem(target_url=url.target_url, key=key, check_status=check_status,
+                                 redirect_type=url.redirect_type, target_hash=huella_destino(url.target_url),
+                                 expires_at=url.expires_at, max_clicks=url.max_clicks)
+
+        try:
+            db.add(db_url)
+            await adjust_summary_async(db, links=1, active_links=1)
+            await db.commit()
+            await db.refresh(db_url)
+            return db_url
+        except IntegrityError:
+            await db.rollback()
+            if intento == REINTENTOS_CLAVE - 1:
+                raise
+        except Exception as e:
+            await db.rollback()
+            raise e
+
+async def update_url_async(db: AsyncSession, db_url: models.URLItem, updates: schemas.URLUpdate):
+    """Versión asíncrona de update_url."""
+    update_data = updates.model_dump(exclude_unset=True)
+    activo_antes = db_url.is_active is not False
+
+    for key, value in update_data.items():
+        setattr(db_url, key, value)
+    if "target_url" in update_data:
+        db_url.target_hash = huella_destino(db_url.target_url)
+    # Cambia el ETag/Last-Modified de la redirección (hora de la BD, como created_at)
+    db_url.updated_at = func.now()
+
+    db.add(db_url)
+    await adjust_summary_async(db, active_links=(db_url.is_active is not False) - activo_antes)
+    await db.commit()
+    await db.refresh(db_url)
+    return db_url
+
+async def delete_url_async(db: AsyncSession, db_url: models.URLItem):
+    """Versión asíncrona de delete_url."""
+    await db.delete(db_url)
+    await adjust_summary_async(db, links=-1, active_links=-(db_url.is_active is not False),
+                               clicks=-(db_url.clicks or 0))
+    await db.commit()
+    return True
+
+async def create_urls_bulk_async(db: AsyncSession, target_urls: list[str],
+                                 check_statuses: Optional[list[Optional[str]]] = None) -> list[models.URLItem]:
+    """
+    Crea muchas URLs cortas en una sola transacción.
+
+    Las claves se piden al generador de una vez y la inserción es un único INSERT
+    multi-fila (con RETURNING), en vez de un commit por enlace.
+    Devuelve los objetos creados en el mismo orden que 'target_urls'.
+    """
+    if not target_urls:
+        return []
+
+    check_statuses = check_statuses or [None] * len(target_urls)
+    claves = await keygen.generador_claves.claves_async(db, len(target_urls))
+
+    for intento in range(REINTENTOS_CLAVE):
+        filas = [
+            {"target_url": target, "key": key, "check_status": estado, "target_hash": huella_destino(target)}
+            for target, key, estado in zip(target_urls, claves, check_statuses)
+        ]
+        try:
+            result = await db.scalars(insert(models.URLItem).returning(models.URLItem), filas)
+            creadas = result.all()
+            await adjust_summary_async(db, links=len(filas), active_links=len(filas))
+            await db.commit()
+            break
+        except IntegrityError:
+            await db.rollback()
+            if intento == REINTENTOS_CLAVE - 1:
+                raise
+            # Se sustituyen solo las claves que ya existían
+            ocupadas = await get_existing_keys_async(db, claves)
+            nuevas = iter(await keygen.generador_claves.claves_async(db, len(ocupadas)))
+            claves = [next(nuevas) if key in ocupadas else key for key in claves]
+        except Exception as e:
+            await db.rollback()
+            raise e
+
+    # RETURNING no garantiza el orden; lo reconstruimos a partir de la clave
+    por_clave = {url.key: url for url in creadas}
+    return [por_clave[key] for key in claves]
+
+# ==============================================================================
+# 5. COMPROBACIÓN DE ACCESIBILIDAD EN SEGUNDO PLANO
+# ==============================================================================
+
+async def claim_pending_checks_async(db: AsyncSession, limit: int, ahora: datetime,
+                                     reclamar_antes: datetime) -> list[tuple[str, str]]:
+    """
+    Reserva hasta 'limit' comprobaciones pendientes, por orden de id, y
+    devuelve su (key, target_url). Pasan a 'checking' con la hora 'ahora'.
+
+    También retoma las que siguen en 'checking' desde antes de
+    'reclamar_antes' (el worker que las reservó se cayó sin terminarlas).
+    Es un único UPDATE ... RETURNING (y en PostgreSQL las filas ya
+    bloqueadas se saltan): dos workers nunca reservan la misma fila.
+    """
+    tabla = models.URLItem.__table__
+    disponible = or_(
+        tabla.c.check_status == "pending",
+        and_(tabla.c.check_status == "checking", tabla.c.check_started_at < reclamar_antes),
+    )
+    ids = (
+        select(tabla.c.id).where(disponible).order_by(tabla.c.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(tabla)
+        .where(tabla.c.id.in_(ids), disponible)
+        .values(check_status="checking", check_started_at=ahora)
+        .returning(tabla.c.key, tabla.c.target_url)
+    )
+    filas = [tuple(fila) for fila in result.all()]
+    await db.commit()
+    return filas
+
+async def release_checks_async(db: AsyncSession, keys: list[str]) -> None:
+    """Devuelve a 'pending' comprobaciones reservadas que no se llegaron a hacer."""
+    await db.execute(
+        update(models.URLItem.__table__)
+        .where(models.URLItem.key.in_(keys), models.URLItem.check_status == "checking")
+        .values(check_status="pending", check_started_at=None)
+    )
+    await db.commit()
+
+async def set_check_status_async(db: AsyncSession, key: str, target_url: str, check_status: str) -> None:
+    """
+    Guarda el resultado de la comprobación de un enlace.
+
+    Solo se actualiza si el destino sigue siendo el comprobado: si el enlace
+    se editó mientras tanto, su nueva comprobación ya está pendiente.
+    """
+    await db.execute(
+        update(models.URLItem)
+        .where(models.URLItem.key == key, models.URLItem.target_url == target_url)
+        .values(check_status=check_status, check_started_at=None)
+    )
+    await db.commit()
+# ==============================================================================
+# 6. ESTADÍSTICAS DE VISITAS (EVENTOS Y AGREGADOS)
+# ==============================================================================
+
+# Tope de valores por dimensión (referrer, navegador, país) en /stats
+TOP_DIMENSION = 10
+
+def _insert_sumando(db: Session, tabla, filas: list[dict], claves: list[str]) -> None:
+    """INSERT ... ON CONFLICT (claves) DO UPDATE SET clicks = clicks + excluded.clicks"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_dialecto
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_dialecto
+
+    sentencia = insert_dialecto(tabla)
+    sentencia = sentencia.on_conflict_do_update(
+        index_elements=claves,
+        set_={"clicks": tabla.c.clicks + sentencia.excluded.clicks},
+    )
+    db.execute(sentencia, filas)
+
+def apply_click_events(db: Session, eventos: list[dict]) -> None:
+    """
+    Guarda un lote de visitas y actualiza los agregados, en una sola transacción.
+
+    Cada evento es un dict con key, ts (datetime UTC), referrer, ua_family y
+    country. Los agregados horarios y diarios se suman en memoria antes de
+    escribirlos, así que el coste depende de las claves distintas del lote
+    y no del número de visitas.
+    """
+    horas: Counter = Counter()
+    dias: Counter = Counter()
+    for evento in eventos:
+        hora = evento["ts"].replace(minute=0, second=0, microsecond=0)
+        dia = hora.replace(hour=0)
+        horas[(evento["key"], hora)] += 1
+        dias[(evento["key"], dia, "total", "")] += 1
+        dias[(evento["key"], dia, "referrer", evento.get("referrer_host") or "")] += 1
+        dias[(evento["key"], dia, "browser", evento.get("ua_family") or "")] += 1
+        dias[(evento["key"], dia, "country", evento.get("country") or "")] += 1
+
+    columnas = ("key", "ts", "referrer", "ua_family", "country")
+    try:
+        db.execute(insert(models.ClickEvent), [{c: evento.get(c) for c in columnas} for evento in eventos])
+        _insert_sumando(
+            db, models.ClickStatHourly.__table__,
+            [{"key": k, "bucket": b, "clicks": n} for (k, b), n in horas.items()],
+            ["key", "bucket"],
+        )
+        _insert_sumando(
+            db, models.ClickStatDaily.__table__,
+            [{"key": k, "bucket": b, "dimension": d, "value": v, "clicks": n} for (k, b, d, v), n in dias.items()],
+            ["key", "bucket", "dimension", "value"],
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+
+async def get_click_series_async(db: AsyncSession, key: str, desde: datetime, hasta: datetime,
+                                 granularity: str = "day") -> list[tuple[datetime, int]]:
+    """Visitas por hora o por día en [desde, hasta), leídas solo de los agregados."""
+    if granularity == "hour":
+        tabla = models.ClickStatHourly
+        inicio = desde.replace(minute=0, second=0, microsecond=0)
+        consulta = select(tabla.bucket, tabla.clicks)
+    else:
+        tabla = models.ClickStatDaily
+        inicio = desde.replace(hour=0, minute=0, second=0, microsecond=0)
+        consulta = select(tabla.bucket, tabla.clicks).where(tabla.dimension == "total")
+
+    result = await db.execute(
+        consulta.where(tabla.key == key, tabla.bucket >= inicio, tabla.bucket < hasta).order_by(tabla.bucket)
+    )
+    return [tuple(fila) for fila in result.all()]
+
+async def get_click_breakdown_async(db: AsyncSession, key: str, desde: datetime,
+                                    hasta: datetime) -> dict[str, dict[str, int]]:
+    """
+    Reparto de visitas por referrer, navegador y país (con resolución diaria).
+
+    Devuelve {dimension: {valor: visitas}} con los TOP_DIMENSION valores
+    más frecuentes de cada dimensión.
+    """
+    tabla = models.ClickStatDaily
+    total = func.sum(tabla.clicks).label("total")
+    result = await db.execute(
+        select(tabla.dimension, tabla.value, total)
+        .where(
+            tabla.key == key,
+            tabla.dimension != "total",
+            tabla.bucket >= desde.replace(hour=0, minute=0, second=0, microsecond=0),
+            tabla.bucket < hasta,
+        )
+        .group_by(tabla.dimension, tabla.value)
+        .order_by(total.desc())
+    )
+
+    reparto: dict[str, dict[str, int]] = {"referrer": {}, "browser": {}, "country": {}}
+    for dimension, valor, visitas in result.all():
+        valores = reparto.setdefault(dimension, {})
+        if len(valores) < TOP_DIMENSION:
+            valores[valor or "unknown"] = visitas
+    return reparto
+
+# ==============================================================================
+# 7. INVALIDACIÓN DE CACHÉS ENTRE PROCESOS
+# ==============================================================================
+
+async def get_last_invalidation_id_async(db: AsyncSession) -> int:
+    """Id de la última invalidación registrada (0 si no hay ninguna)."""
+    return (await db.scalar(select(func.max(models.CacheInvalidation.id)))) or 0
+
+async def get_invalidations_async(db: AsyncSession, after_id: int, limit: int = 10000) -> list[tuple[int, str]]:
+    """Invalidaciones posteriores a 'after_id', en orden: [(id, key), ...]"""
+    result = await db.execute(
+        select(models.CacheInvalidation.id, models.CacheInvalidation.key)
+        .where(models.CacheInvalidation.id > after_id)
+        .order_by(models.CacheInvalidation.id)
+        .limit(limit)
+    )
+    return [tuple(fila) for fila in result.all()]
+
+async def purge_invalidations_async(db: AsyncSession, before: datetime) -> int:
+    """Borra las invalidaciones anteriores a 'before'. Devuelve cuántas se borraron."""
+    result = await db.execute(
+        delete(models.CacheInvalidation).where(models.CacheInvalidation.created_at < before)
+    )
+    await db.commit()
+    return result.rowcount
+
+# ==============================================================================
+# 8. EXPORTACIÓN
+# ==============================================================================
+
+# Columnas exportadas, en el orden del CSV
+COLUMNAS_EXPORTACION = (
+    "key", "target_url", "clicks", "is_active", "check_status", "redirect_type", "created_at", "updated_at",
+    "expires_at", "max_clicks",
+)
+
+async def stream_urls_async(db: AsyncSession, created_from: Optional[datetime] = None,
+                            created_to: Optional[datetime] = None, active: Optional[bool] = None,
+                            min_clicks: Optional[int] = None, batch_size: int = 1000):
+    """
+    Recorre las URLs filtradas en orden de id, de 'batch_size' en
+    'batch_size' filas, con un cursor del lado del servidor (yield_per):
+    nunca se cargan todas en memoria. Produce listas de filas.
+    """
+    tabla = models.URLItem.__table__
+    consulta = select(*(tabla.c[nombre] for nombre in COLUMNAS_EXPORTACION)).order_by(tabla.c.id)
+    if created_from is not None:
+        consulta = consulta.where(tabla.c.created_at >= created_from)
+    if created_to is not None:
+        consulta = consulta.where(tabla.c.created_at < created_to)
+    if active is not None:
+        # is_active NULL (filas antiguas) cuenta como activo
+        consulta = consulta.where(or_(tabla.c.is_active.is_(None), tabla.c.is_active) if active
+                                  else tabla.c.is_active.is_(False))
+    if min_clicks is not None:
+        consulta = consulta.where(func.coalesce(tabla.c.clicks, 0) >= min_clicks)
+
+    result = await db.stream(consulta.execution_options(yield_per=batch_size))
+    async for lote in result.partitions():
+        yield lote
+
+# ==============================================================================
+# 9. RESUMEN DEL PANEL DE ADMINISTRACIÓN
+# ==============================================================================
+
+CONTADORES_RESUMEN = ("links", "active_links", "clicks")
+
+_tabla_contadores = models.SummaryCounter.__table__
+_SUMAR_CONTADOR = (
+    update(_tabla_contadores)
+    .where(_tabla_contadores.c.name == bindparam("b_name"))
+    .values(value=_tabla_contadores.c.value + bindparam("b_delta"))
+)
+
+def _deltas(links: int, active_links: int, clicks: int) -> list[dict]:
+    valores = {"links": links, "active_links": active_links, "clicks": clicks}
+    return [{"b_name": nombre, "b_delta": delta} for nombre, delta in valores.items() if delta]
+
+def adjust_summary(db: Session, links: int = 0, active_links: int = 0, clicks: int = 0) -> None:
+    """
+    Suma los cambios a los contadores del resumen, sin hacer commit: van en
+    la transacción del cambio que los provoca.
+    """
+    deltas = _deltas(links, active_links, clicks)
+    if deltas:
+        db.execute(_SUMAR_CONTADOR, deltas)
+
+async def adjust_summary_async(db: AsyncSession, links: int = 0, active_links: int = 0, clicks: int = 0) -> None:
+    """Versión asíncrona de adjust_summary."""
+    deltas = _deltas(links, active_links, clicks)
+    if deltas:
+        await db.execute(_SUMAR_CONTADOR, deltas)
+
+async def get_summary_async(db: AsyncSession, recompute: bool = False) -> dict[str, int]:
+    """
+    Lee los contadores. La primera vez (o con 'recompute') se calculan
+    recorriendo 'urls' una sola vez y se guardan; a partir de ahí solo se
+    actualizan con adjust_summary.
+    """
+    filas = dict((await db.execute(select(_tabla_contadores.c.name, _tabla_contadores.c.value))).all())
+    if not recompute and all(nombre in filas for nombre in CONTADORES_RESUMEN):
+        return filas
+
+    tabla = models.URLItem.__table__
+    total, activos, clicks = (await db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(case((tabla.c.is_active.is_(False), 0), else_=1)), 0),
+            func.coalesce(func.sum(tabla.c.clicks), 0),
+        ).select_from(tabla)
+    )).one()
+    filas = {"links": total, "active_links": activos, "clicks": clicks}
+    try:
+        await db.execute(delete(_tabla_contadores))
+        await db.execute(insert(_tabla_contadores), [{"name": n, "value": v} for n, v in filas.items()])
+        await db.commit()
+    except IntegrityError:
+        # Otro worker los inicializó a la vez: valen los suyos
+        await db.rollback()
+        return dict((await db.execute(select(_tabla_contadores.c.name, _tabla_contadores.c.value))).all())
+    return filas
+
+async def get_top_urls_async(db: AsyncSession, limit: int = 10) -> list[models.URLItem]:
+    """Las URLs más visitadas. Lee 'limit' entradas del índice (visitas, id), sin ordenar la tabla."""
+    result = await db.execute(
+        select(models.URLItem)
+        .order_by(models.VISITAS.desc(), models.URLItem.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+# ==============================================================================
+# 10. DEDUPLICACIÓN DE DESTINOS
+# ==============================================================================
+
+async def find_url_by_target_async(db: AsyncSession, target_url: str,
+                                   redirect_type: Optional[str] = None) -> Optional[models.URLItem]:
+    """
+    Enlace activo y sin caducidad ya existente con el mismo destino
+    (normalizado) y la misma política de redirección, o None.
+
+    Busca por target_hash (índice de 32 caracteres) y compara los destinos
+    normalizados de los candidatos, por si dos URLs compartieran resumen.
+    """
+    normalizada = normalizar_destino(target_url)
+    candidatos = await db.scalars(
+        select(models.URLItem)
+        .where(
+            models.URLItem.target_hash == huella_destino(target_url),
+            models.URLItem.is_active.is_not(False),
+            models.URLItem.expires_at.is_(None),
+            models.URLItem.max_clicks.is_(None),
+            models.URLItem.redirect_type.is_(None) if redirect_type is None
+            else models.URLItem.redirect_type == redirect_type,
+        )
+        .order_by(models.URLItem.id)
+    )
+    for url in candidatos:
+        if normalizar_destino(url.target_url) == normalizada:
+            return url
+    return None
+
+def fill_missing_target_hashes(db: Session, batch_size: int = 1000) -> int:
+    """
+    Calcula target_hash de los enlaces que no lo tienen (creados antes de
+    existir la columna). Se llama al migrar el esquema; con todo relleno es
+    una sola consulta sobre el índice. Devuelve cuántos se han rellenado.
+    """
+    tabla = models.URLItem.__table__
+    actualizar = update(tabla).where(tabla.c.id == bindparam("b_id")).values(target_hash=bindparam("b_hash"))
+    rellenados = 0
+    while True:
+        filas = db.execute(
+            select(tabla.c.id, tabla.c.target_url).where(tabla.c.target_hash.is_(None)).limit(batch_size)
+        ).all()
+        if not filas:
+            return rellenados
+        db.execute(actualizar, [{"b_id": id_, "b_hash": huella_destino(target)} for id_, target in filas])
+        db.commit()
+        rellenados += len(filas)
+
+# ==============================================================================
+# 11. PURGA DE ENLACES CADUCADOS
+# ==============================================================================
+
+def purge_expired_urls(db: Session, ahora: datetime, limit: int = 500, archive: bool = False) -> list[str]:
+    """
+    Borra (o archiva en urls_archive) hasta 'limit' enlaces caducados:
+    'expires_at' pasada o 'max_clicks' alcanzado. No hace commit.
+
+    Los candidatos salen de los índices de expires_at y max_clicks. El
+    DELETE ... RETURNING devuelve solo las filas que ha borrado esta
+    transacción, así que los contadores del resumen cuadran aunque otro
+    proceso purgue a la vez. Devuelve las claves borradas.
+    """
+    tabla = models.URLItem.__table__
+    ids = list(db.scalars(select(tabla.c.id).where(tabla.c.expires_at <= ahora).limit(limit)))
+    if len(ids) < limit:
+        agotados = select(tabla.c.id).where(
+            tabla.c.max_clicks.is_not(None), func.coalesce(tabla.c.clicks, 0) >= tabla.c.max_clicks
+        )
+        if ids:
+            agotados = agotados.where(tabla.c.id.not_in(ids))
+        ids += db.scalars(agotados.limit(limit - len(ids)))
+    if not ids:
+        return []
+
+    borradas = db.execute(delete(tabla).where(tabla.c.id.in_(ids)).returning(*tabla.c)).mappings().all()
+    if not borradas:
+        return []
+    if archive:
+        columnas = [c for c in models.URLArchive.__table__.c.keys() if c != "archived_at"]
+        db.execute(insert(models.URLArchive.__table__), [
+            {**{c: fila[c] for c in columnas}, "archived_at": ahora} for fila in borradas
+        ])
+    adjust_summary(
+        db, links=-len(borradas), active_links=-sum(fila["is_active"] is not False for fila in borradas),
+        clicks=-sum(fila["clicks"] or 0 for fila in borradas),
+    )
+    return [fila["key"] for fila in borradas]
@@ -1,6 +1,9 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 # Intentamos obtener la URL de la base de datos de las variables de entorno.
 # Si no existe (estamos en local), usamos SQLite por defecto para desarrollo rápido.
@@ -14,11 +17,84 @@ connect_args = {}
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     connect_args = {"check_same_thread": False}
 
+# ==============================================================================
+# PERFIL DE PRODUCCIÓN PARA SQLITE (OPCIONAL)
+# ==============================================================================
+
+# Con SQLITE_PRODUCTION=true cada conexión nueva aplica estos PRAGMAs.
+# Por defecto SQLite usa 'rollback journal', donde una escritura bloquea
+# a los lectores; en WAL los lectores no esperan a los escritores.
+SQLITE_PRODUCTION = os.getenv("SQLITE_PRODUCTION", "False").lower() == "true"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+# NORMAL en WAL: no pierde integridad, solo (ante un corte de luz) las
+# últimas transacciones confirmadas. Mucho menos fsync que FULL.
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))     # caché de páginas por conexión
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes leídos vía mmap
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))   # espera ante 'database is locked'
+
+# Pool de conexiones (SQLite en fichero y PostgreSQL). Sin el perfil, los
+# valores coinciden con los de SQLAlchemy. Con el perfil el pool es mayor:
+# las conexiones 'overflow' se cierran al devolverse y cada conexión nueva
+# vuelve a pagar los PRAGMAs. DB_POOL_RECYCLE=-1 no recicla.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20" if SQLITE_PRODUCTION else "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+
+
+def es_sqlite_en_memoria(url: str) -> bool:
+    """True si la URL apunta a una base SQLite en memoria (sin fichero)."""
+    return url.startswith("sqlite") and (":memory:" in url or "mode=memory" in url or url.rstrip("/").endswith(":"))
+
+
+def pragmas_sqlite() -> list[str]:
+    """PRAGMAs del perfil de producción, en el orden en que se aplican."""
+    return [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def aplicar_perfil_sqlite(motor) -> None:
+    """
+    Registra un evento 'connect' que aplica los PRAGMAs a cada conexión.
+
+    Sirve tanto para el motor síncrono como para el asíncrono (se pasa
+    async_engine.sync_engine): el adaptador de aiosqlite expone el mismo
+    cursor DB-API dentro del evento.
+    """
+    @event.listens_for(motor, "connect")
+    def _configurar_conexion(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas_sqlite():
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def opciones_pool(url: str) -> dict:
+    """Parámetros de pool para create_engine (SQLite en memoria usa su propio pool)."""
+    if es_sqlite_en_memoria(url):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
 # Creación del motor (Engine)
 # Nota: echo=True (comentado) sirve para ver los SQL logs en consola al depurar.
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args
+    connect_args=connect_args,
+    **opciones_pool(SQLALCHEMY_DATABASE_URL)
     # echo=True 
 )
 
@@ -27,5 +103,116 @@ engine = create_engine(
 # autoflush=False: Evita que SQLAlchemy mande datos a la DB antes de que estemos listos.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# ==============================================================================
+# MOTOR ASÍNCRONO (AsyncEngine)
+# ==============================================================================
+
+# Esquema síncrono (con o sin driver) -> su equivalente asíncrono.
+# Render/Heroku usan el prefijo antiguo 'postgres://'.
+DRIVERS_ASINCRONOS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgresql+pg8000": "postgresql+asyncpg",
+}
+
+def obtener_url_asincrona(url: str) -> str:
+    """
+    Traduce la URL de conexión síncrona a su driver asíncrono equivalente.
+    - SQLite     -> aiosqlite
+    - PostgreSQL -> asyncpg
+    Cualquier otro esquema (ej: un driver que ya es asíncrono, como
+    postgresql+psycopg) se respeta tal cual.
+    """
+    esquema, separador, resto = url.partition(":")
+    asincrono = DRIVERS_ASINCRONOS.get(esquema)
+    return asincrono + separador + resto if asincrono else url
+
+# Se puede forzar otra URL asíncrona con ASYNC_DATABASE_URL (ej: otro driver)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", obtener_url_asincrona(SQLALCHEMY_DATABASE_URL))
+
+# Las rutas async de FastAPI usan este motor directamente en el event loop,
+# sin pasar por el threadpool, así que el límite deja de ser el número de hilos.
+try:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **opciones_pool(ASYNC_DATABASE_URL))
+except (ImportError, InvalidRequestError) as e:
+    # Falta el driver asíncrono (ej: asyncpg con PostgreSQL) o el indicado
+    # no lo es (ej: ASYNC_DATABASE_URL con psycopg2)
+    raise RuntimeError(
+        f"No se puede crear el motor asíncrono para '{make_url(ASYNC_DATABASE_URL).drivername}': "
+        f"{str(e).rstrip('.')}. "
+        "Instala el driver (pip install -r requirements.txt) o indica otro con ASYNC_DATABASE_URL."
+    ) from e
+
+if SQLITE_PRODUCTION and SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    aplicar_perfil_sqlite(engine)
+if SQLITE_PRODUCTION and ASYNC_DATABASE_URL.startswith("sqlite"):
+    aplicar_perfil_sqlite(async_engine.sync_engine)
+
+# expire_on_commit=False: tras el commit los objetos siguen siendo legibles
+# sin otra consulta (en modo async no se permiten cargas perezosas implícitas).
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Clase base para los modelos ORM
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+# ==============================================================================
+# MIGRACIÓN LIGERA DEL ESQUEMA
+# ==============================================================================
+
+# Índices de versiones anteriores que se borran al migrar, por tabla
+INDICES_OBSOLETOS = {"urls": ("ix_urls_target_url", "ix_urls_clicks_id")}
+
+def _nombres_indices(conn, inspector, tabla: str) -> set[str]:
+    """
+    Nombres de los índices de 'tabla'. En SQLite se leen de sqlite_master:
+    la reflexión de SQLAlchemy omite los índices sobre expresiones (ej:
+    ix_urls_visitas_id) y se intentarían crear otra vez en cada arranque.
+    """
+    if conn.dialect.name == "sqlite":
+        filas = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :tabla"),
+                             {"tabla": tabla})
+        return {nombre for (nombre,) in filas}
+    return {i["name"] for i in inspector.get_indexes(tabla)}
+
+def actualizar_esquema(bind=engine) -> None:
+    """
+    Crea las tablas que falten y añade las columnas/índices nuevos.
+
+    'create_all' solo crea tablas inexistentes: si una tabla ya existe
+    (ej: sql_app.db de una versión anterior) no le añade columnas nuevas.
+    Aquí se completan con ALTER TABLE ADD COLUMN, que es aditivo y seguro
+    tanto en SQLite como en PostgreSQL. Las filas antiguas quedan con NULL.
+    """
+    # Base SQLite nueva: auto_vacuum incremental, para que la purga pueda
+    # devolver al disco las páginas libres sin un VACUUM completo (solo
+    # surte efecto antes de crear la primera tabla)
+    if bind.dialect.name == "sqlite" and not inspect(bind).get_table_names():
+        with bind.begin() as conn:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            Base.metadata.create_all(bind=conn)
+
+    Base.metadata.create_all(bind=bind)
+
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for tabla in Base.metadata.sorted_tables:
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name in existentes:
+                    continue
+                tipo = columna.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN "{columna.name}" {tipo}'))
+
+            indices = _nombres_indices(conn, inspector, tabla.name)
+            for indice in tabla.indexes:
+                if indice.name not in indices:
+                    indice.create(conn)
+
+            # Índices que el modelo ya no declara (ej: ix_urls_target_url, al
+            # que sustituye ix_urls_target_hash): solo ocupan disco y frenan las altas
+            for nombre in INDICES_OBSOLETOS.get(tabla.name, ()):
+                if nombre in indices:
+                    conn.execute(text(f"DROP INDEX {nombre}"))
\ No newline at end of file
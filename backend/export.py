@@ -0,0 +1,90 @@
+import os
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+import crud
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Filas que se leen de la BD (y se serializan) de cada vez. Acota la memoria
+# de la exportación sin importar el tamaño de la tabla.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Nivel de compresión gzip (1 = más rápido, 9 = más pequeño)
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+TIPOS_CONTENIDO = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+# ==============================================================================
+# 2. SERIALIZACIÓN POR LOTES
+# ==============================================================================
+
+def _valor(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+
+def lote_csv(filas, base_url: str) -> str:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for fila in filas:
+        escritor.writerow([_valor(v) for v in fila] + [f"{base_url}{fila.key}"])
+    return buffer.getvalue()
+
+
+def lote_ndjson(filas, base_url: str) -> str:
+    lineas = []
+    for fila in filas:
+        datos = {nombre: _valor(valor) for nombre, valor in fila._mapping.items()}
+        datos["url_completa"] = f"{base_url}{fila.key}"
+        lineas.append(json.dumps(datos, ensure_ascii=False))
+    return "\n".join(lineas) + "\n" if lineas else ""
+
+
+SERIALIZADORES: dict[str, Callable] = {"csv": lote_csv, "ndjson": lote_ndjson}
+
+# ==============================================================================
+# 3. FLUJO DE EXPORTACIÓN
+# ==============================================================================
+
+async def exportar_urls(engine: AsyncEngine, formato: str, base_url: str, comprimir: bool = False,
+                        batch_size: int = EXPORT_BATCH_SIZE, **filtros) -> AsyncIterator[bytes]:
+    """
+    Genera la exportación trozo a trozo para un StreamingResponse.
+
+    Abre su propia sesión: el cuerpo se sigue enviando cuando la ruta ya
+    ha devuelto la respuesta. Con 'comprimir', cada lote pasa por un
+    compresor gzip incremental (no se espera a tener el fichero entero).
+    """
+    serializar = SERIALIZADORES[formato]
+    compresor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if comprimir else None
+
+    def salida(texto: str) -> bytes:
+        datos = texto.encode("utf-8")
+        return compresor.compress(datos) if compresor else datos
+
+    if formato == "csv":
+        yield salida(",".join(crud.COLUMNAS_EXPORTACION + ("url_completa",)) + "\r\n")
+
+    async with AsyncSession(engine) as db:
+        async for filas in crud.stream_urls_async(db, batch_size=batch_size, **filtros):
+            trozo = salida(serializar(filas, base_url))
+            if trozo:
+                yield trozo
+
+    if compresor:
+        yield compresor.flush()
+
+
+def nombre_fichero(formato: str, ahora: Optional[datetime] = None) -> str:
+    return f"urls-{(ahora or datetime.now()).strftime('%Y%m%d')}.{formato}"
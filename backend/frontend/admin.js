@@ -2,12 +2,15 @@
    CONSTANTES Y CONFIGURACIÓN
    ============================================= */
 const API_ENDPOINTS = {
-    GET_ALL: "/urls",       // Obtener todas las URLs
+    GET_ALL: "/urls",       // Obtener URLs (paginado por cursor)
     CREATE: "/url",         // Crear nueva URL
     UPDATE: "/urls/{key}",  // Actualizar URL existente
-    DELETE: "/urls/{key}"   // Eliminar URL
+    DELETE: "/urls/{key}",  // Eliminar URL
+    SUMMARY: "/api/admin/summary"  // Totales y enlaces más visitados
 };
 
+const SUMMARY_TOP = 5;          // Enlaces en la lista de más visitados
+
 const SORT_OPTIONS = {
     DATE_DESC: "date_desc",     // Más recientes primero
     DATE_ASC: "date_asc",       // Más antiguos primero
@@ -16,12 +19,15 @@ const SORT_OPTIONS = {
     ALPHA_ASC: "alpha_asc"      // Orden alfabético
 };
 
+const PAGE_SIZE = 50;           // Enlaces por página (se cargan al hacer scroll)
+
 /* =============================================
    ESTADO GLOBAL DE LA APLICACIÓN
    ============================================= */
 let appState = {
-    urls: [],               // Todos los enlaces cargados
-    filteredUrls: [],       // Enlaces filtrados y ordenados
+    urls: [],               // Enlaces cargados hasta ahora (ya filtrados y ordenados por el servidor)
+    nextCursor: null,       // Cursor de la siguiente página (null = no hay más)
+    requestId: 0,           // Descarta respuestas de búsquedas anteriores
     isEditing: false,       // Modo edición vs creación
     currentEditKey: null,   // Clave del enlace siendo editado
     isLoading: false,       // Estado de carga
@@ -34,6 +40,7 @@ let appState = {
    ============================================= */
 const DOM = {
     tableBody: document.getElementById("table-body"),
+    loadMore: document.getElementById("load-more"),
     searchInput: document.getElementById("searchInput"),
     sortSelect: document.getElementById("sortSelect"),
     modal: document.getElementById("modal"),
@@ -43,7 +50,11 @@ const DOM = {
     editActiveCheckbox: document.getElementById("edit-active"),
     statusGroup: document.getElementById("status-group"),
     saveButton: document.getElementById("btn-save"),
-    modalForm: document.getElementById("modal-form")
+    modalForm: document.getElementById("modal-form"),
+    summaryTotal: document.getElementById("summary-total"),
+    summaryActive: document.getElementById("summary-active"),
+    summaryClicks: document.getElementById("summary-clicks"),
+    summaryTop: document.getElementById("summary-top")
 };
 
 /* =============================================
@@ -141,10 +152,24 @@ function showNotification(message, type = 'info') {
    ============================================= */
 
 /**
- * Carga todos los enlaces desde el servidor
+ * Construye la URL de la API con la búsqueda, el orden y el cursor actuales
+ */
+function buildListUrl(cursor = null) {
+    const params = new URLSearchParams({
+        limit: PAGE_SIZE,
+        sort: appState.sortBy
+    });
+    if (appState.searchTerm) params.set('q', appState.searchTerm);
+    if (cursor) params.set('cursor', cursor);
+    return `${API_ENDPOINTS.GET_ALL}?${params}`;
+}
+
+/**
+ * Carga la primera página de enlaces (el servidor filtra y ordena)
  */
 async function loadUrls() {
     setLoading(true);
+    const requestId = ++appState.requestId;
     
     try {
         // Mostrar estado de carga en la tabla
@@ -156,18 +181,20 @@ async function loadUrls() {
             </tr>
         `;
 
-        const response = await fetch(API_ENDPOINTS.GET_ALL);
+        const response = await fetch(buildListUrl());
         
         if (!response.ok) {
             throw new Error(`Error HTTP: ${response.status}`);
         }
 
         const data = await response.json();
+        if (requestId !== appState.requestId) return; // Llegó tarde: hay otra búsqueda en curso
+
         appState.urls = data;
+        appState.nextCursor = response.headers.get('X-Next-Cursor');
         
         // Actualizar la vista
-        filterAndSortUrls();
-        showNotification(`${data.length} enlaces cargados`, 'success');
+        renderTable();
         
     } catch (error) {
         console.error('Error al cargar URLs:', error);
@@ -191,6 +218,64 @@ async function loadUrls() {
     }
 }
 
+/**
+ * Carga la siguiente página y la añade al final de la tabla
+ */
+async function loadMoreUrls() {
+    if (!appState.nextCursor || appState.isLoading) return;
+
+    setLoading(true);
+    const requestId = appState.requestId;
+
+    try {
+        const response = await fetch(buildListUrl(appState.nextCursor));
+        if (!response.ok) {
+            throw new Error(`Error HTTP: ${response.status}`);
+        }
+
+        const data = await response.json();
+        if (requestId !== appState.requestId) return; // La búsqueda cambió mientras tanto
+
+        appState.urls = appState.urls.concat(data);
+        appState.nextCursor = response.headers.get('X-Next-Cursor');
+        appendRows(data);
+        updateLoadMore();
+
+    } catch (error) {
+        console.error('Error al cargar más URLs:', error);
+        showNotification('Error al cargar más enlaces', 'error');
+    } finally {
+        setLoading(false);
+    }
+}
+
+/**
+ * Carga el resumen (los totales los mantiene el servidor: no se recorre la tabla)
+ */
+async function loadSummary() {
+    try {
+        const response = await fetch(`${API_ENDPOINTS.SUMMARY}?top=${SUMMARY_TOP}`);
+        if (!response.ok) {
+            throw new Error(`Error HTTP: ${response.status}`);
+        }
+
+        const summary = await response.json();
+        DOM.summaryTotal.textContent = summary.total_links.toLocaleString('es-ES');
+        DOM.summaryActive.textContent = summary.active_links.toLocaleString('es-ES');
+        DOM.summaryClicks.textContent = summary.total_clicks.toLocaleString('es-ES');
+
+        DOM.summaryTop.replaceChildren(...summary.top_links.map(link => {
+            const item = document.createElement('li');
+            item.textContent = `${link.key} · ${link.clicks.toLocaleString('es-ES')} clics`;
+            item.title = link.target_url;
+            return item;
+        }));
+
+    } catch (error) {
+        console.error('Error al cargar el resumen:', error);
+    }
+}
+
 /**
  * Guarda un enlace (crea o actualiza)
  */
@@ -218,6 +303,7 @@ async function saveUrl(urlData, isEdit = false) {
         const result = await response.json();
         showNotification(isEdit ? 'Enlace actualizado' : 'Enlace creado', 'success');
         await loadUrls(); // Recargar la lista
+        loadSummary();
         
         return result;
         
@@ -246,6 +332,7 @@ async function deleteUrl(key) {
 
         showNotification('Enlace eliminado', 'success');
         await loadUrls(); // Recargar la lista
+        loadSummary();
         
     } catch (error) {
         console.error('Error al eliminar:', error);
@@ -257,59 +344,13 @@ async function deleteUrl(key) {
    FILTRADO Y ORDENAMIENTO
    ============================================= */
 
-/**
- * Filtra y ordena los enlaces según los criterios actuales
- */
-function filterAndSortUrls() {
-    const { urls, searchTerm, sortBy } = appState;
-    
-    // 1. Filtrar
-    let filtered = urls.filter(url => {
-        const searchLower = searchTerm.toLowerCase();
-        return url.key.toLowerCase().includes(searchLower) || 
-               url.target_url.toLowerCase().includes(searchLower);
-    });
-
-    // 2. Ordenar
-    filtered.sort((a, b) => {
-        switch (sortBy) {
-            case SORT_OPTIONS.DATE_ASC:
-                // Más antiguos primero (nota: usando fallback de fecha mínima)
-                const dateA = new Date(a.created_at || '1970-01-01').getTime();
-                const dateB = new Date(b.created_at || '1970-01-01').getTime();
-                return dateA - dateB;
-                
-            case SORT_OPTIONS.DATE_DESC:
-                // Más recientes primero
-                const dateC = new Date(b.created_at || '1970-01-01').getTime();
-                const dateD = new Date(a.created_at || '1970-01-01').getTime();
-                return dateC - dateD;
-                
-            case SORT_OPTIONS.CLICKS_ASC:
-                return (a.clicks || 0) - (b.clicks || 0);
-                
-            case SORT_OPTIONS.CLICKS_DESC:
-                return (b.clicks || 0) - (a.clicks || 0);
-                
-            case SORT_OPTIONS.ALPHA_ASC:
-                return (a.key || '').localeCompare(b.key || '');
-                
-            default:
-                return 0;
-        }
-    });
-
-    appState.filteredUrls = filtered;
-    renderTable();
-}
-
 /**
  * Aplica filtros (llamado desde eventos)
  */
 function applyFilters() {
-    appState.searchTerm = DOM.searchInput.value;
+    appState.searchTerm = DOM.searchInput.value.trim();
     appState.sortBy = DOM.sortSelect.value;
-    filterAndSortUrls();
+    loadUrls(); // El filtrado y la ordenación se hacen en el servidor
 }
 
 /* =============================================
@@ -317,13 +358,13 @@ function applyFilters() {
    ============================================= */
 
 /**
- * Renderiza la tabla con los enlaces filtrados
+ * Renderiza la tabla con los enlaces cargados
  */
 function renderTable() {
-    const { filteredUrls } = appState;
+    const { urls } = appState;
     const tableBody = DOM.tableBody;
 
-    if (filteredUrls.length === 0) {
+    if (urls.length === 0) {
         tableBody.innerHTML = `
             <tr>
                 <td colspan="6" class="text-center">
@@ -334,15 +375,25 @@ function renderTable() {
                 </td>
             </tr>
         `;
+        updateLoadMore();
         return;
     }
 
     tableBody.innerHTML = '';
+    appendRows(urls);
+    updateLoadMore();
+}
+
+/**
+ * Añade filas al final de la tabla (sin volver a pintar las existentes)
+ */
+function appendRows(urls) {
+    const tableBody = DOM.tableBody;
 
-    filteredUrls.forEach((url, index) => {
+    urls.forEach((url, index) => {
         const row = document.createElement('tr');
         
-        // Animación escalonada
+        // Animación escalonada (solo dentro de la página recién cargada)
         row.className = 'animate-row';
         row.style.animationDelay = `${index * 0.03}s`;
 
@@ -403,6 +454,15 @@ function renderTable() {
     });
 }
 
+/**
+ * Muestra el botón "Cargar más" solo si el servidor indicó que hay más páginas
+ */
+function updateLoadMore() {
+    if (DOM.loadMore) {
+        DOM.loadMore.hidden = !appState.nextCursor;
+    }
+}
+
 /**
  * Trunca texto muy largo
  */
@@ -606,8 +666,19 @@ function initApp() {
         DOM.editUrlInput.classList.remove('invalid');
     });
 
+    // Scroll infinito: al acercarse al final de la tabla se pide la siguiente página
+    if (DOM.loadMore && 'IntersectionObserver' in window) {
+        const observer = new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMoreUrls();
+            }
+        }, { root: DOM.loadMore.closest('.table-wrapper'), rootMargin: '200px' });
+        observer.observe(DOM.loadMore);
+    }
+
     // Cargar datos iniciales
     loadUrls();
+    loadSummary();
 }
 
 /**
@@ -631,6 +702,7 @@ function debounce(func, wait) {
 // Solo exponer las funciones necesarias para eventos HTML
 window.abrirModalCrear = openCreateModal;
 window.aplicarFiltros = applyFilters;
+window.cargarMas = loadMoreUrls;
 window.cerrarModal = closeModal;
 window.guardarCambios = saveChanges;
 window.prepararEdicion = prepareEdit;
@@ -0,0 +1,110 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+# httpx se importa al crear el cliente (en el arranque o en la primera
+# comprobación), no al importar el módulo: así arrancar la app es más rápido
+if TYPE_CHECKING:
+    import httpx
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Tiempo máximo de cada comprobación de accesibilidad (segundos)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+
+# Límites del pool de conexiones compartido
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Máximo de peticiones simultáneas contra un mismo host, para no saturar
+# a un tercero cuando llega un lote con miles de enlaces al mismo dominio.
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "10"))
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# ==============================================================================
+# 2. CLIENTE HTTP COMPARTIDO
+# ==============================================================================
+
+class ClienteHTTP:
+    """
+    Cliente httpx único para toda la vida de la aplicación.
+
+    Reutiliza conexiones (keep-alive) entre validaciones, así que comprobar
+    varios enlaces del mismo dominio solo paga el handshake TCP/TLS una vez.
+    Se crea en el arranque (lifespan) y se cierra al apagar.
+    """
+
+    def __init__(self):
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._hosts: dict[str, tuple[asyncio.Semaphore, int]] = {}
+
+    def _crear_cliente(self) -> "httpx.AsyncClient":
+        import httpx
+
+        return httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            verify=False,  # Para testing, en producción debería ser True
+            headers=HTTP_HEADERS,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    async def start(self) -> None:
+        """Crea el cliente compartido (se llama al iniciar la aplicación)."""
+        if self._client is None:
+            self._client = self._crear_cliente()
+
+    async def close(self) -> None:
+        """Cierra el cliente y todas sus conexiones abiertas."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def usar(self, host: Optional[str] = None) -> AsyncIterator["httpx.AsyncClient"]:
+        """
+        Entrega el cliente para hacer peticiones, respetando el límite por host.
+
+        Si la aplicación no pasó por el lifespan (ej: scripts o tests sin
+        'with TestClient'), se usa un cliente temporal como antes.
+        """
+        async with self._limitar_host(host):
+            if self._client is not None:
+                yield self._client
+            else:
+                async with self._crear_cliente() as temporal:
+                    yield temporal
+
+    @asynccontextmanager
+    async def _limitar_host(self, host: Optional[str]) -> AsyncIterator[None]:
+        """Semáforo por host; se elimina cuando nadie lo usa para no crecer sin límite."""
+        if not host or HTTP_PER_HOST_LIMIT <= 0:
+            yield
+            return
+
+        semaforo, usuarios = self._hosts.get(host) or (asyncio.Semaphore(HTTP_PER_HOST_LIMIT), 0)
+        self._hosts[host] = (semaforo, usuarios + 1)
+        try:
+            async with semaforo:
+                yield
+        finally:
+            semaforo, usuarios = self._hosts[host]
+            if usuarios <= 1:
+                del self._hosts[host]
+            else:
+                self._hosts[host] = (semaforo, usuarios - 1)
+
+
+# Instancia compartida por toda la aplicación
+cliente_http = ClienteHTTP()
@@ -0,0 +1,452 @@
+"""
+Importación masiva de enlaces desde CSV o NDJSON (ej: migrar otro acortador).
+
+Cada registro tiene 'target_url' y, opcionalmente, 'key', 'clicks',
+'created_at' y 'expires_at' (ISO 8601), 'max_clicks' e 'is_active'. En CSV la primera línea es la
+cabecera; en NDJSON cada línea es un objeto JSON (o una URL entre comillas).
+
+El fichero se lee en streaming y se inserta por lotes: un INSERT
+executemany y un commit por lote. El progreso (import_jobs) se guarda en
+la misma transacción que cada lote, así que si el proceso se cae, volver a
+lanzar la misma importación continúa justo después del último lote
+guardado.
+
+Las claves que ya existen (en la BD o repetidas en el fichero) se saltan y
+se informan, o detienen la importación con --on-conflict fail. Los
+registros sin clave reciben una del generador. Con --defer-check los
+destinos quedan 'pending' y el servidor comprueba su accesibilidad en
+segundo plano (los va reservando por lotes, ver reachability); si no, solo
+se valida el formato (sin red).
+
+Si el servidor está en marcha con un solo worker, reinícialo al terminar
+(o arráncalo con KEY_FILTER_MODE=shared) para que su filtro de claves vea
+los enlaces importados. POST /api/admin/imports no lo necesita.
+
+Uso (desde backend/):
+    python importer.py enlaces.csv
+    python importer.py enlaces.ndjson --job migracion --on-conflict fail --defer-check
+    python importer.py enlaces.csv --errors errores.ndjson   # detalle de lo no importado
+"""
+import os
+import argparse
+import csv
+import json
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import BinaryIO, Callable, Iterator, Optional, TextIO
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import crud
+import keygen
+import models
+from database import SessionLocal
+from reachability import ESTADO_PENDIENTE
+from validation import validate_many, huella_destino
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Registros por lote (y por transacción). Lotes más grandes van más rápido
+# pero se repite más trabajo al reanudar tras un fallo.
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# Dónde guarda POST /api/admin/imports los ficheros subidos. Se conservan
+# hasta que la importación termina, para poder reanudarla.
+IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "url_shortener_imports"))
+
+# Nombres válidos de importación (se usan como nombre de fichero)
+PATRON_TRABAJO = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}")
+
+# Cuántos conflictos/errores se incluyen como muestra en el informe
+IMPORT_MAX_REPORTED = int(os.getenv("IMPORT_MAX_REPORTED", "100"))
+
+# Claves que se pueden importar: caracteres no reservados de una URL, y
+# ninguna que coincida con una ruta de la aplicación
+PATRON_CLAVE = re.compile(r"[A-Za-z0-9_.~-]{1,64}")
+CLAVES_RESERVADAS = frozenset({
+    "admin", "api", "docs", "metrics", "openapi.json", "redoc", "static", "url", "urls",
+})
+
+FORMATOS = ("csv", "ndjson")
+
+# ==============================================================================
+# 2. LECTURA EN STREAMING
+# ==============================================================================
+
+def leer_registros(fichero: BinaryIO, formato: str, offset: int = 0) -> Iterator[tuple[int, Optional[dict]]]:
+    """
+    Recorre el fichero desde 'offset' (bytes) y produce (offset tras el
+    registro, registro). El registro es None si la línea no se pudo leer.
+    """
+    posicion = 0
+    if formato == "csv":
+        cabecera = fichero.readline()
+        posicion = len(cabecera)
+        campos = [c.strip() for c in next(csv.reader([cabecera.decode("utf-8-sig")]))]
+    if offset > posicion:
+        fichero.seek(offset)
+        posicion = offset
+
+    def lineas():
+        nonlocal posicion
+        for linea in fichero:
+            posicion += len(linea)
+            yield linea.decode("utf-8")
+
+    if formato == "csv":
+        # El lector pide las líneas según las necesita: al devolver una fila,
+        # 'posicion' es justo el final de esa fila (aunque ocupe varias líneas)
+        for fila in csv.DictReader(lineas(), fieldnames=campos):
+            yield posicion, fila
+        return
+
+    for linea in lineas():
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            registro = json.loads(linea)
+        except ValueError:
+            yield posicion, None
+            continue
+        if isinstance(registro, str):
+            registro = {"target_url": registro}
+        yield posicion, registro if isinstance(registro, dict) else None
+
+
+def _texto(valor) -> Optional[str]:
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    return valor or None
+
+
+def _fecha(valor) -> Optional[datetime]:
+    valor = _texto(valor)
+    if valor is None:
+        return None
+    fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return fecha
+
+
+def _booleano(valor) -> bool:
+    if isinstance(valor, bool):
+        return valor
+    texto = _texto(valor)
+    if texto is None:
+        return True
+    if texto.lower() in ("true", "1", "yes", "si", "sí"):
+        return True
+    if texto.lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"is_active no válido: {texto}")
+
+
+def normalizar(registro: Optional[dict]) -> tuple[Optional[dict], str]:
+    """Convierte un registro leído en una fila (sin validar la URL) o un error."""
+    if registro is None:
+        return None, "Registro ilegible"
+    target_url = _texto(registro.get("target_url"))
+    if target_url is None:
+        return None, "Falta target_url"
+
+    key = _texto(registro.get("key"))
+    if key is not None and (not PATRON_CLAVE.fullmatch(key) or key in CLAVES_RESERVADAS):
+        return None, f"Clave no válida: {key}"
+
+    try:
+        clicks = int(_texto(registro.get("clicks")) or 0)
+        max_clicks = int(_texto(registro.get("max_clicks")) or 0)
+        if clicks < 0 or max_clicks < 0:
+            raise ValueError("clicks o max_clicks negativo")
+        fila = {
+            "key": key,
+            "target_url": target_url,
+            "clicks": clicks,
+            "is_active": _booleano(registro.get("is_active")),
+            "created_at": _fecha(registro.get("created_at")),
+            "expires_at": _fecha(registro.get("expires_at")),
+            "max_clicks": max_clicks or None,
+        }
+    except (TypeError, ValueError) as e:
+        return None, f"Valor no válido: {e}"
+    return fila, ""
+
+# ==============================================================================
+# 3. CARGA POR LOTES
+# ==============================================================================
+
+class ConflictoImportacion(Exception):
+    """Una clave ya existía y la importación se lanzó con on_conflict='fail'."""
+
+
+# Importaciones en curso en este proceso (no se puede lanzar dos veces la misma)
+_en_curso: set[str] = set()
+_lock = threading.Lock()
+
+
+def en_curso(nombre: str) -> bool:
+    with _lock:
+        return nombre in _en_curso
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _procesar_lote(db: Session, trabajo: models.ImportJob, lote: list[tuple[int, Optional[dict]]],
+                   on_conflict: str, defer_check: bool,
+                   descartar: Callable[[int, Optional[str], str], None]) -> list[tuple[str, str]]:
+    """
+    Valida e inserta un lote y avanza el progreso, en una transacción.
+    Devuelve (key, target_url) de los enlaces insertados.
+    """
+    numero_base = trabajo.records
+    filas: list[tuple[int, dict]] = []
+    invalidos = conflictos = 0
+
+    for i, (_, registro) in enumerate(lote):
+        fila, error = normalizar(registro)
+        if fila is None:
+            invalidos += 1
+            descartar(numero_base + i + 1, None, error)
+        else:
+            filas.append((numero_base + i + 1, fila))
+
+    # Validación de formato y dominio (sin red); las URLs repetidas se validan una vez
+    validas = []
+    for (numero, fila), (ok, resultado) in zip(filas, validate_many([f["target_url"] for _, f in filas])):
+        if ok:
+            fila["target_url"] = resultado
+            validas.append((numero, fila))
+        else:
+            invalidos += 1
+            descartar(numero, fila["key"], resultado)
+
+    # Conflictos: claves que ya están en la BD o repetidas en el propio fichero
+    existentes = crud.get_existing_keys(db, [f["key"] for _, f in validas if f["key"]])
+    vistas: set[str] = set()
+    filas = []
+    for numero, fila in validas:
+        key = fila["key"]
+        if key is not None and (key in existentes or key in vistas):
+            if on_conflict == "fail":
+                raise ConflictoImportacion(f"La clave '{key}' ya existe (registro {numero})")
+            conflictos += 1
+            descartar(numero, key, "La clave ya existe")
+            continue
+        if key is not None:
+            vistas.add(key)
+        filas.append(fila)
+
+    # Claves nuevas para los registros que no traen una. Las del generador
+    # podrían coincidir con claves importadas antes: se descartan y se piden otras.
+    sin_clave = [fila for fila in filas if fila["key"] is None]
+    while sin_clave:
+        nuevas = keygen.generador_claves.claves(db, len(sin_clave))
+        ocupadas = crud.get_existing_keys(db, nuevas) | (vistas & set(nuevas))
+        pendientes = []
+        for fila, key in zip(sin_clave, nuevas):
+            if key in ocupadas:
+                pendientes.append(fila)
+            else:
+                fila["key"] = key
+                vistas.add(key)
+        sin_clave = pendientes
+
+    ahora = _ahora()
+    for fila in filas:
+        fila["created_at"] = fila["created_at"] or ahora
+        fila["updated_at"] = fila["created_at"]
+        fila["check_status"] = ESTADO_PENDIENTE if defer_check else None
+        fila["target_hash"] = huella_destino(fila["target_url"])
+    if filas:
+        db.execute(insert(models.URLItem.__table__), filas)
+        crud.adjust_summary(
+            db, links=len(filas), active_links=sum(f["is_active"] for f in filas),
+            clicks=sum(f["clicks"] for f in filas),
+        )
+
+    trabajo.offset = lote[-1][0]
+    trabajo.records += len(lote)
+    trabajo.imported += len(filas)
+    trabajo.conflicts += conflictos
+    trabajo.invalid += invalidos
+    trabajo.updated_at = ahora
+    db.commit()
+    return [(fila["key"], fila["target_url"]) for fila in filas]
+
+
+def _memoria_pico_mb() -> Optional[float]:
+    """Memoria residente máxima del proceso (MB), si el sistema lo permite."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def importar(
+    ruta: str,
+    formato: Optional[str] = None,
+    nombre: Optional[str] = None,
+    on_conflict: str = "skip",
+    defer_check: bool = False,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    reiniciar: bool = False,
+    session_factory: Callable[[], Session] = SessionLocal,
+    al_insertar: Optional[Callable[[list[tuple[str, str]]], None]] = None,
+    errores: Optional[TextIO] = None,
+) -> dict:
+    """
+    Importa (o reanuda) el fichero 'ruta' y devuelve un informe con los
+    totales, la velocidad, la memoria y una muestra de lo descartado.
+
+    'al_insertar' se llama con (key, target_url) de cada lote ya guardado
+    (ej: para añadirlas al filtro de claves del servidor). 'errores' recibe una
+    línea NDJSON por cada registro descartado.
+    """
+    formato = formato or ("csv" if ruta.lower().endswith(".csv") else "ndjson")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+    if on_conflict not in ("skip", "fail"):
+        raise ValueError("on_conflict debe ser 'skip' o 'fail'")
+    nombre = nombre or os.path.basename(ruta)
+
+    with _lock:
+        if nombre in _en_curso:
+            raise RuntimeError(f"La importación '{nombre}' ya está en curso")
+        _en_curso.add(nombre)
+
+    muestra: list[dict] = []
+
+    def descartar(numero: int, key: Optional[str], motivo: str) -> None:
+        detalle = {"record": numero, "key": key, "reason": motivo}
+        if len(muestra) < IMPORT_MAX_REPORTED:
+            muestra.append(detalle)
+        if errores is not None:
+            errores.write(json.dumps(detalle, ensure_ascii=False) + "\n")
+
+    db = session_factory()
+    try:
+        trabajo = db.get(models.ImportJob, nombre)
+        if trabajo is not None and trabajo.status == "done" and not reiniciar:
+            return {**informe_trabajo(trabajo), "resumed": False, "rows_per_second": 0.0,
+                    "elapsed_seconds": 0.0, "peak_memory_mb": _memoria_pico_mb(), "sample": []}
+        reanudada = trabajo is not None and not reiniciar and trabajo.records > 0
+        if trabajo is None:
+            trabajo = models.ImportJob(name=nombre)
+            db.add(trabajo)
+        if not reanudada:
+            trabajo.offset = trabajo.records = trabajo.imported = trabajo.conflicts = trabajo.invalid = 0
+            trabajo.started_at = _ahora()
+        trabajo.source, trabajo.format = ruta, formato
+        trabajo.status, trabajo.error, trabajo.updated_at = "running", None, _ahora()
+        db.commit()
+
+        registros_previos = trabajo.records
+        inicio = time.perf_counter()
+        try:
+            with open(ruta, "rb") as fichero:
+                lote = []
+                for elemento in leer_registros(fichero, formato, trabajo.offset):
+                    lote.append(elemento)
+                    if len(lote) >= chunk_size:
+                        insertadas = _procesar_lote(db, trabajo, lote, on_conflict, defer_check, descartar)
+                        lote = []
+                        if al_insertar and insertadas:
+                            al_insertar(insertadas)
+                if lote:
+                    insertadas = _procesar_lote(db, trabajo, lote, on_conflict, defer_check, descartar)
+                    if al_insertar and insertadas:
+                        al_insertar(insertadas)
+            trabajo.status = "done"
+        except Exception as e:
+            db.rollback()
+            trabajo.status, trabajo.error = "failed", str(e)
+            raise
+        finally:
+            trabajo.updated_at = _ahora()
+            db.commit()
+
+        duracion = time.perf_counter() - inicio
+        return {
+            **informe_trabajo(trabajo),
+            "resumed": reanudada,
+            "elapsed_seconds": round(duracion, 3),
+            "rows_per_second": round((trabajo.records - registros_previos) / duracion, 1) if duracion else 0.0,
+            "peak_memory_mb": _memoria_pico_mb(),
+            "sample": muestra,
+        }
+    finally:
+        db.close()
+        with _lock:
+            _en_curso.discard(nombre)
+
+
+def informe_trabajo(trabajo: models.ImportJob) -> dict:
+    """Estado guardado de una importación."""
+    return {
+        "job": trabajo.name,
+        "source": trabajo.source,
+        "format": trabajo.format,
+        "status": trabajo.status,
+        "records": trabajo.records,
+        "imported": trabajo.imported,
+        "conflicts": trabajo.conflicts,
+        "invalid": trabajo.invalid,
+        "offset": trabajo.offset,
+        "error": trabajo.error,
+        "started_at": trabajo.started_at.isoformat() if trabajo.started_at else None,
+        "updated_at": trabajo.updated_at.isoformat() if trabajo.updated_at else None,
+    }
+
+# ==============================================================================
+# 4. LÍNEA DE COMANDOS
+# ==============================================================================
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fichero")
+    parser.add_argument("--format", choices=FORMATOS, help="Por defecto, según la extensión")
+    parser.add_argument("--job", help="Nombre de la importación (por defecto, el del fichero)")
+    parser.add_argument("--on-conflict", choices=("skip", "fail"), default="skip")
+    parser.add_argument("--defer-check", action="store_true", help="Comprobar la accesibilidad en segundo plano")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true", help="Empezar de cero aunque haya progreso guardado")
+    parser.add_argument("--errors", help="Fichero NDJSON con cada registro descartado")
+    args = parser.parse_args()
+
+    from database import actualizar_esquema, engine
+    actualizar_esquema(engine)
+
+    errores = open(args.errors, "a", encoding="utf-8") if args.errors else None
+    try:
+        informe = importar(
+            args.fichero, args.format, args.job, args.on_conflict, args.defer_check,
+            args.chunk_size, args.restart, errores=errores,
+        )
+    except Exception as e:
+        print(f"Importación interrumpida: {e}. Vuelve a lanzarla para continuar.", file=sys.stderr)
+        return 1
+    finally:
+        if errores is not None:
+            errores.close()
+
+    informe.pop("sample")
+    print(json.dumps(informe, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import os
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import models
+from database import AsyncSessionLocal
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Cada cuántos segundos consulta cada worker si hay claves que invalidar.
+# Es el retraso máximo con el que un cambio llega a las cachés de los demás
+# procesos. 0 desactiva el sondeo (modo de un solo proceso).
+INVALIDATION_POLL_INTERVAL = float(os.getenv("INVALIDATION_POLL_INTERVAL", "1"))
+
+# Cuánto se conservan las filas de cache_invalidations (segundos). Debe ser
+# mucho mayor que el intervalo de sondeo; lo que se pierda por un worker
+# bloqueado más tiempo lo acota igualmente el TTL de la caché.
+INVALIDATION_RETENTION = float(os.getenv("INVALIDATION_RETENTION", "3600"))
+
+# ==============================================================================
+# 2. CANAL DE INVALIDACIÓN (BASADO EN LA BASE DE DATOS)
+# ==============================================================================
+
+class CanalInvalidacion:
+    """
+    Propaga las invalidaciones de caché entre workers usando la propia BD.
+
+    Al editar o borrar un enlace se añade una fila a cache_invalidations
+    dentro de la misma transacción (anotar). Cada proceso sondea la tabla
+    cada 'interval' segundos pidiendo solo las filas con id mayor que la
+    última que vio, y llama a los suscriptores (ej: cache_resolucion.invalidate)
+    con cada clave. No necesita servicios externos y funciona igual con
+    SQLite que con PostgreSQL.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        interval: float = INVALIDATION_POLL_INTERVAL,
+        retention: float = INVALIDATION_RETENTION,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.retention = retention
+        self.ultimo_id = 0
+        self._suscriptores: list[Callable[[str], None]] = []
+        self._tarea: Optional[asyncio.Task] = None
+        self._ultima_purga = 0.0
+        self.recibidas = 0
+
+    def suscribir(self, callback: Callable[[str], None]) -> None:
+        """Registra una función que se llamará con cada clave invalidada."""
+        self._suscriptores.append(callback)
+
+    def anotar(self, db: AsyncSession, key: str) -> None:
+        """
+        Añade la invalidación a la sesión 'db', sin hacer commit: se guarda
+        en la misma transacción que el cambio del enlace.
+        """
+        db.add(models.CacheInvalidation(key=key, created_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+
+    async def start(self) -> None:
+        """Empieza a sondear desde la última invalidación existente."""
+        async with self.session_factory() as db:
+            self.ultimo_id = await crud.get_last_invalidation_id_async(db)
+        if self.interval > 0:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def stop(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def sondear(self) -> int:
+        """Aplica las invalidaciones nuevas. Devuelve cuántas se recibieron."""
+        async with self.session_factory() as db:
+            filas = await crud.get_invalidations_async(db, self.ultimo_id)
+
+            if time.monotonic() - self._ultima_purga > self.retention / 10:
+                self._ultima_purga = time.monotonic()
+                limite = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.retention)
+                await crud.purge_invalidations_async(db, limite)
+
+        for id_, key in filas:
+            for callback in self._suscriptores:
+                callback(key)
+            self.ultimo_id = id_
+        self.recibidas += len(filas)
+        return len(filas)
+
+    async def _bucle(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sondear()
+            except Exception as e:
+                print(f"Error leyendo invalidaciones de caché: {e}")
+
+    def estadisticas(self) -> dict:
+        """Resumen para el endpoint de diagnóstico."""
+        return {
+            "poll_interval_seconds": self.interval,
+            "last_id": self.ultimo_id,
+            "received": self.recibidas,
+        }
+
+
+# Instancia compartida por toda la aplicación
+canal_invalidacion = CanalInvalidacion()
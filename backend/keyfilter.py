@@ -0,0 +1,276 @@
+import os
+import asyncio
+import hashlib
+import math
+from typing import Optional
+
+from sqlalchemy import select, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import models
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Filtro de Bloom con todas las claves existentes: las claves que seguro no
+# existen (escáneres, bots, enlaces mal copiados) se responden con 404 sin
+# consultar la base de datos.
+KEY_FILTER_ENABLED = os.getenv("KEY_FILTER_ENABLED", "True").lower() == "true"
+
+# Dimensionado: número de claves previsto y tasa de falsos positivos
+# deseada. Memoria ≈ -n·ln(p)/ln(2)² bits: 1 millón de claves al 1 % son
+# ~1,2 MB. Al cargar se usa como mínimo el doble de las filas existentes.
+KEY_FILTER_CAPACITY = int(os.getenv("KEY_FILTER_CAPACITY", "1000000"))
+KEY_FILTER_FP_RATE = float(os.getenv("KEY_FILTER_FP_RATE", "0.01"))
+
+# Filas leídas por consulta al construir el filtro (se recorre la tabla por
+# id, sin cargarla entera en memoria)
+KEY_FILTER_BATCH_SIZE = int(os.getenv("KEY_FILTER_BATCH_SIZE", "10000"))
+
+# 'exclusive': este proceso es el único que crea enlaces, así que el filtro
+# está siempre al día y un "no está" es definitivo.
+# 'shared': otros procesos (workers, scripts) también crean enlaces; ante un
+# "no está" se leen primero las filas nuevas (una consulta por id, compartida
+# por todas las peticiones que fallan a la vez).
+# 'auto': 'exclusive' con un solo worker (WEB_CONCURRENCY=1), si no 'shared'.
+KEY_FILTER_MODE = os.getenv("KEY_FILTER_MODE", "auto").lower()
+
+if KEY_FILTER_MODE == "auto":
+    KEY_FILTER_MODE = "exclusive" if os.getenv("WEB_CONCURRENCY", "1").strip() in ("", "1") else "shared"
+if KEY_FILTER_MODE not in ("exclusive", "shared"):
+    raise ValueError("KEY_FILTER_MODE debe ser 'auto', 'exclusive' o 'shared'")
+
+# ==============================================================================
+# 2. FILTRO DE BLOOM
+# ==============================================================================
+
+class FiltroBloom:
+    """
+    Filtro de Bloom sobre un bytearray.
+
+    Las k posiciones de cada clave salen de un solo hash (blake2b de 128
+    bits partido en dos mitades, h1 + i·h2), así que consultar una clave
+    cuesta un hash y k accesos a memoria. No admite borrados: una clave
+    borrada sigue dando "puede existir" (un falso positivo más) hasta la
+    siguiente reconstrucción.
+    """
+
+    def __init__(self, capacidad: int, tasa_fp: float):
+        capacidad = max(1, capacidad)
+        self.capacidad = capacidad
+        self.tasa_fp = tasa_fp
+        self.bits = max(8, math.ceil(-capacidad * math.log(tasa_fp) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacidad * math.log(2)))
+        self._tabla = bytearray((self.bits + 7) // 8)
+        self.elementos = 0
+
+    def _posiciones(self, key: str):
+        resumen = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(resumen[:8], "little")
+        h2 = int.from_bytes(resumen[8:], "little") | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def agregar(self, key: str) -> None:
+        tabla = self._tabla
+        for p in self._posiciones(key):
+            tabla[p >> 3] |= 1 << (p & 7)
+        self.elementos += 1
+
+    def __contains__(self, key: str) -> bool:
+        tabla = self._tabla
+        for p in self._posiciones(key):
+            if not tabla[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def ocupacion(self) -> float:
+        """Fracción de bits a 1 (cuenta también las claves ya borradas)."""
+        return int.from_bytes(self._tabla, "little").bit_count() / self.bits
+
+    def tasa_fp_estimada(self) -> float:
+        """Probabilidad de falso positivo con la ocupación actual."""
+        return self.ocupacion() ** self.hashes
+
+# ==============================================================================
+# 3. FILTRO DE CLAVES DE LA APLICACIÓN
+# ==============================================================================
+
+class FiltroClaves:
+    """
+    Mantiene el filtro de Bloom de la tabla 'urls' y responde si una clave
+    puede existir.
+
+    Se construye al arrancar (cargar) recorriendo la tabla por lotes, y se
+    actualiza al crear enlaces en este proceso. Hasta que se carga, todas
+    las claves "pueden existir" (se consulta la BD como siempre), así que
+    la carga va en segundo plano (iniciar_carga) y no retrasa el arranque.
+    """
+
+    def __init__(self, capacidad: int = KEY_FILTER_CAPACITY, tasa_fp: float = KEY_FILTER_FP_RATE,
+                 modo: str = KEY_FILTER_MODE, lote: int = KEY_FILTER_BATCH_SIZE):
+        self.capacidad = capacidad
+        self.tasa_fp = tasa_fp
+        self.modo = modo
+        self.lote = lote
+        self.filtro: Optional[FiltroBloom] = None
+        # Mayor id de 'urls' incluido en el filtro (para leer solo las nuevas)
+        self.ultimo_id = 0
+        self._tarea: Optional[asyncio.Task] = None
+        self._carga: Optional[asyncio.Task] = None
+        # Claves creadas mientras se carga el filtro (se añaden al activarlo)
+        self._durante_carga: Optional[list[str]] = None
+        self._iniciadas = 0
+        self._terminadas = 0
+        # Contadores para el informe de falsos positivos
+        self.consultas = 0
+        self.descartadas = 0
+        self.falsos_positivos = 0
+        self.borradas = 0
+        self.actualizaciones = 0
+
+    async def _leer_desde(self, engine: AsyncEngine, filtro: FiltroBloom, desde_id: int) -> int:
+        """Añade al filtro las claves con id > desde_id. Devuelve el último id leído."""
+        tabla = models.URLItem.__table__
+        consulta = (
+            select(tabla.c.id, tabla.c.key)
+            .where(tabla.c.id > bindparam("desde"))
+            .order_by(tabla.c.id)
+            .limit(self.lote)
+        )
+        async with engine.connect() as conn:
+            while True:
+                filas = (await conn.execute(consulta, {"desde": desde_id})).all()
+                for id_, key in filas:
+                    filtro.agregar(key)
+                if filas:
+                    desde_id = filas[-1][0]
+                if len(filas) < self.lote:
+                    return desde_id
+
+    async def cargar(self, engine: AsyncEngine) -> None:
+        """(Re)construye el filtro con todas las claves y lo activa al terminar."""
+        if self._durante_carga is None:
+            self._durante_carga = []
+        try:
+            async with engine.connect() as conn:
+                filas = (await conn.execute(select(func.count()).select_from(models.URLItem))).scalar_one()
+            filtro = FiltroBloom(max(self.capacidad, 2 * filas), self.tasa_fp)
+            ultimo_id = await self._leer_desde(engine, filtro, 0)
+            # Sin 'await' desde aquí: ninguna alta se cuela entre estas claves y la activación
+            for key in self._durante_carga:
+                filtro.agregar(key)
+            self.filtro, self.ultimo_id, self.borradas = filtro, ultimo_id, 0
+        finally:
+            self._durante_carga = None
+
+    def iniciar_carga(self, engine: AsyncEngine) -> None:
+        """Lanza 'cargar' en segundo plano (se llama al iniciar la aplicación)."""
+        async def cargar_en_fondo():
+            try:
+                await self.cargar(engine)
+            except Exception as e:
+                print(f"Error cargando el filtro de claves: {e}")
+
+        self._durante_carga = []
+        self._carga = asyncio.create_task(cargar_en_fondo())
+
+    async def detener(self) -> None:
+        """Cancela la carga si aún no ha terminado (se llama al apagar)."""
+        if self._carga is not None:
+            self._carga.cancel()
+            try:
+                await self._carga
+            except asyncio.CancelledError:
+                pass
+            self._carga = None
+
+    def agregar(self, key: str) -> None:
+        """Se llama al crear un enlace en este proceso."""
+        if self.filtro is not None:
+            self.filtro.agregar(key)
+        elif self._durante_carga is not None:
+            self._durante_carga.append(key)
+
+    def eliminar(self, key: str) -> None:
+        """Se llama al borrar un enlace (sus bits se quedan: solo se cuenta)."""
+        if self.filtro is not None:
+            self.borradas += 1
+
+    async def _ponerse_al_dia(self, engine: AsyncEngine) -> None:
+        """
+        Espera a una lectura de filas nuevas que empiece después de la
+        llamada, así que ve todo lo que ya estaba guardado. Las peticiones
+        que llegan mientras tanto comparten la siguiente lectura.
+        """
+        objetivo = self._iniciadas + 1
+        while self._terminadas < objetivo:
+            if self._tarea is None or self._tarea.done():
+                self._iniciadas += 1
+                self._tarea = asyncio.ensure_future(self._leer_nuevas(engine))
+            await asyncio.shield(self._tarea)
+
+    async def _leer_nuevas(self, engine: AsyncEngine) -> None:
+        try:
+            filtro = self.filtro
+            ultimo = await self._leer_desde(engine, filtro, self.ultimo_id)
+            if filtro is self.filtro:
+                self.ultimo_id = max(self.ultimo_id, ultimo)
+            self.actualizaciones += 1
+        finally:
+            self._terminadas += 1
+
+    async def puede_existir(self, key: str, engine: AsyncEngine) -> bool:
+        """False solo si la clave seguro que no está en la BD."""
+        filtro = self.filtro
+        if not KEY_FILTER_ENABLED or filtro is None:
+            return True
+        self.consultas += 1
+        if key in filtro:
+            return True
+        if self.modo == "shared":
+            try:
+                await self._ponerse_al_dia(engine)
+            except Exception as e:
+                print(f"Error actualizando el filtro de claves: {e}")
+                return True
+            if key in self.filtro:
+                return True
+        self.descartadas += 1
+        return False
+
+    def registrar_falso_positivo(self) -> None:
+        """El filtro dijo "puede existir" y la BD no la tenía."""
+        if self.filtro is not None:
+            self.falsos_positivos += 1
+
+    def estadisticas(self) -> dict:
+        """Dimensionado e informe de falsos positivos para /api/health."""
+        filtro = self.filtro
+        if filtro is None:
+            return {"enabled": KEY_FILTER_ENABLED, "loaded": False, "mode": self.modo}
+        inexistentes = self.descartadas + self.falsos_positivos
+        return {
+            "enabled": KEY_FILTER_ENABLED,
+            "loaded": True,
+            "mode": self.modo,
+            "capacity": filtro.capacidad,
+            "keys": filtro.elementos,
+            "deleted_since_load": self.borradas,
+            "memory_bytes": len(filtro._tabla),
+            "hashes": filtro.hashes,
+            "fill_ratio": round(filtro.ocupacion(), 4),
+            "target_fp_rate": filtro.tasa_fp,
+            "estimated_fp_rate": round(filtro.tasa_fp_estimada(), 6),
+            # Entre las claves inexistentes consultadas, cuántas dejó pasar
+            "observed_fp_rate": round(self.falsos_positivos / inexistentes, 6) if inexistentes else 0.0,
+            "lookups": self.consultas,
+            "definite_misses": self.descartadas,
+            "false_positives": self.falsos_positivos,
+            "refreshes": self.actualizaciones,
+        }
+
+
+# Instancia compartida por toda la aplicación
+filtro_claves = FiltroClaves()
@@ -0,0 +1,328 @@
+import os
+import hashlib
+import secrets
+import string
+import threading
+from collections import deque
+
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Estrategia de generación de claves: 'sequential' (contador por bloques)
+# o 'random' (la original: clave aleatoria + comprobación en la BD)
+KEY_GENERATOR = os.getenv("KEY_GENERATOR", "sequential").lower()
+
+# Cuántos números reserva cada proceso de una vez. Un bloque cuesta un
+# único UPDATE; los números que no se usen se pierden al reiniciar (huecos).
+KEY_BLOCK_SIZE = int(os.getenv("KEY_BLOCK_SIZE", "1000"))
+
+# Longitud inicial de las claves secuenciales. Es 6 para no compartir espacio
+# con las claves aleatorias de 5 caracteres ya existentes. Cuando se agotan
+# las combinaciones de una longitud se pasa automáticamente a la siguiente.
+KEY_MIN_LENGTH = int(os.getenv("KEY_MIN_LENGTH", "6"))
+
+# Desordena los números con una permutación secreta para que las claves no
+# sean consecutivas ni adivinables. No debe cambiarse con datos existentes.
+KEY_SCRAMBLE = os.getenv("KEY_SCRAMBLE", "true").lower() == "true"
+
+# Longitud de las claves de la estrategia aleatoria
+RANDOM_KEY_LENGTH = 5
+
+ALFABETO = string.digits + string.ascii_lowercase + string.ascii_uppercase
+BASE = len(ALFABETO)
+
+# Máximo de parámetros por consulta IN (SQLite limita el número de variables)
+_TAMANO_BLOQUE_IN = 500
+
+# ==============================================================================
+# 2. CODIFICACIÓN
+# ==============================================================================
+
+def clave_aleatoria(length: int = RANDOM_KEY_LENGTH) -> str:
+    """Cadena alfanumérica aleatoria (usa 'secrets', no 'random')."""
+    return "".join(secrets.choice(ALFABETO) for _ in range(length))
+
+
+def codificar_base62(numero: int, longitud: int) -> str:
+    """Representa 'numero' en base 62 con exactamente 'longitud' caracteres."""
+    caracteres = []
+    for _ in range(longitud):
+        numero, resto = divmod(numero, BASE)
+        caracteres.append(ALFABETO[resto])
+    return "".join(reversed(caracteres))
+
+
+class Permutacion:
+    """
+    Biyección secreta de [0, 62^longitud) sobre sí mismo.
+
+    Es una red de Feistel de 4 rondas (con blake2b como función de ronda)
+    sobre el menor número par de bits que cubre el rango; si el resultado
+    cae fuera del rango se vuelve a aplicar ('cycle walking'). Al ser una
+    permutación, números distintos dan siempre claves distintas.
+    """
+
+    RONDAS = 4
+
+    def __init__(self, secreto: str, longitud: int):
+        self.longitud = longitud
+        self.dominio = BASE ** longitud
+        bits = (self.dominio - 1).bit_length()
+        self._mitad = (bits + 1) // 2
+        self._mascara = (1 << self._mitad) - 1
+        self._secreto = secreto.encode()
+
+    def _ronda(self, valor: int, ronda: int) -> int:
+        datos = f"{self.longitud}:{ronda}:{valor}".encode()
+        resumen = hashlib.blake2b(datos, key=self._secreto, digest_size=8).digest()
+        return int.from_bytes(resumen, "big") & self._mascara
+
+    def _feistel(self, x: int) -> int:
+        izquierda, derecha = x >> self._mitad, x & self._mascara
+        for ronda in range(self.RONDAS):
+            izquierda, derecha = derecha, izquierda ^ self._ronda(derecha, ronda)
+        return (izquierda << self._mitad) | derecha
+
+    def aplicar(self, numero: int) -> int:
+        x = self._feistel(numero)
+        while x >= self.dominio:
+            x = self._feistel(x)
+        return x
+
+# ==============================================================================
+# 3. ESTRATEGIAS
+# ==============================================================================
+
+class GeneradorAleatorio:
+    """
+    Estrategia original: claves aleatorias comprobadas contra la BD.
+
+    Comprueba el lote entero con consultas 'key IN (...)' y solo regenera
+    las que colisionan; cuanto más lleno el espacio de claves, más vueltas.
+    """
+
+    nombre = "random"
+
+    def __init__(self, length: int = RANDOM_KEY_LENGTH):
+        self.length = length
+
+    def _candidatas(self, n: int, usadas: set[str]) -> list[str]:
+        candidatas: set[str] = set()
+        while len(candidatas) < n:
+            clave = clave_aleatoria(self.length)
+            if clave not in usadas:
+                candidatas.add(clave)
+        return list(candidatas)
+
+    @staticmethod
+    def _consulta(bloque: list[str]):
+        return select(models.URLItem.key).where(models.URLItem.key.in_(bloque))
+
+    def claves(self, db: Session, n: int = 1) -> list[str]:
+        libres: set[str] = set()
+        while len(libres) < n:
+            candidatas = set(self._candidatas(n - len(libres), libres))
+            lista = list(candidatas)
+            for i in range(0, len(lista), _TAMANO_BLOQUE_IN):
+                candidatas.difference_update(db.scalars(self._consulta(lista[i:i + _TAMANO_BLOQUE_IN])).all())
+            libres.update(candidatas)
+        return list(libres)
+
+    async def claves_async(self, db: AsyncSession, n: int = 1) -> list[str]:
+        libres: set[str] = set()
+        while len(libres) < n:
+            candidatas = set(self._candidatas(n - len(libres), libres))
+            lista = list(candidatas)
+            for i in range(0, len(lista), _TAMANO_BLOQUE_IN):
+                result = await db.scalars(self._consulta(lista[i:i + _TAMANO_BLOQUE_IN]))
+                candidatas.difference_update(result.all())
+            libres.update(candidatas)
+        return list(libres)
+
+    def estadisticas(self) -> dict:
+        return {"strategy": self.nombre, "length": self.length}
+
+
+class GeneradorSecuencial:
+    """
+    Claves a partir de un contador global reservado por bloques.
+
+    Cada proceso reserva 'block_size' números con un solo
+    UPDATE key_sequences SET next_value = next_value + :n ... RETURNING,
+    y los reparte desde memoria. Como dos reservas nunca se solapan, las
+    claves no colisionan entre workers y crear un enlace no necesita
+    consultar si la clave está libre. El número se pasa por la permutación
+    secreta (si KEY_SCRAMBLE) y se codifica en base 62; la longitud crece
+    sola al agotar todas las combinaciones de la actual.
+    """
+
+    nombre = "sequential"
+
+    def __init__(self, block_size: int = KEY_BLOCK_SIZE, min_length: int = KEY_MIN_LENGTH,
+                 scramble: bool = KEY_SCRAMBLE, secuencia: str = "urls"):
+        self.block_size = block_size
+        self.min_length = min_length
+        self.scramble = scramble
+        self.secuencia = secuencia
+        # Bloques pendientes y secreto por base de datos (clave: URL del engine)
+        self._bloques: dict[str, deque] = {}
+        self._secretos: dict[str, str] = {}
+        self._permutaciones: dict[tuple[str, int], Permutacion] = {}
+        self._lock = threading.Lock()
+        self.bloques_reservados = 0
+        self.claves_generadas = 0
+
+    # --- Conversión número -> clave ---
+
+    def clave(self, numero: int, secreto: str = "") -> str:
+        longitud = self.min_length
+        while numero >= BASE ** longitud:
+            numero -= BASE ** longitud
+            longitud += 1
+
+        if self.scramble:
+            permutacion = self._permutaciones.get((secreto, longitud))
+            if permutacion is None:
+                permutacion = self._permutaciones[(secreto, longitud)] = Permutacion(secreto, longitud)
+            numero = permutacion.aplicar(numero)
+
+        return codificar_base62(numero, longitud)
+
+    # --- Bloques en memoria ---
+
+    def _tomar(self, bd: str, n: int) -> list[int]:
+        numeros: list[int] = []
+        with self._lock:
+            bloques = self._bloques.get(bd)
+            while bloques and len(numeros) < n:
+                inicio, fin = bloques[0]
+                cuantos = min(fin - inicio, n - len(numeros))
+                numeros.extend(range(inicio, inicio + cuantos))
+                if inicio + cuantos >= fin:
+                    bloques.popleft()
+                else:
+                    bloques[0] = (inicio + cuantos, fin)
+        return numeros
+
+    def _guardar(self, bd: str, inicio: int, tamano: int, secreto: str) -> None:
+        with self._lock:
+            self._bloques.setdefault(bd, deque()).append((inicio, inicio + tamano))
+            self._secretos[bd] = secreto
+            self.bloques_reservados += 1
+
+    def _codificar(self, bd: str, numeros: list[int]) -> list[str]:
+        secreto = self._secretos.get(bd, "")
+        self.claves_generadas += len(numeros)
+        return [self.clave(numero, secreto) for numero in numeros]
+
+    # --- Reserva en la base de datos ---
+
+    def _sentencia_reserva(self, tamano: int):
+        tabla = models.KeySequence
+        return (
+            update(tabla)
+            .where(tabla.name == self.secuencia)
+            .values(next_value=tabla.next_value + tamano)
+            .returning(tabla.next_value, tabla.secret)
+        )
+
+    def _sentencia_alta(self, tamano: int, secreto: str):
+        return insert(models.KeySequence).values(name=self.secuencia, next_value=tamano, secret=secreto)
+
+    def _reservar(self, engine, tamano: int) -> tuple[int, str]:
+        """Reserva [inicio, inicio + tamano) en una transacción propia."""
+        try:
+            with engine.begin() as conn:
+                fila = conn.execute(self._sentencia_reserva(tamano)).first()
+                if fila is not None:
+                    return fila.next_value - tamano, fila.secret
+                secreto = secrets.token_hex(16)
+                conn.execute(self._sentencia_alta(tamano, secreto))
+                return 0, secreto
+        except IntegrityError:
+            # Otro worker creó la fila a la vez: ya existe, basta con el UPDATE
+            with engine.begin() as conn:
+                fila = conn.execute(self._sentencia_reserva(tamano)).one()
+                return fila.next_value - tamano, fila.secret
+
+    async def _reservar_async(self, engine, tamano: int) -> tuple[int, str]:
+        try:
+            async with engine.begin() as conn:
+                fila = (await conn.execute(self._sentencia_reserva(tamano))).first()
+                if fila is not None:
+                    return fila.next_value - tamano, fila.secret
+                secreto = secrets.token_hex(16)
+                await conn.execute(self._sentencia_alta(tamano, secreto))
+                return 0, secreto
+        except IntegrityError:
+            async with engine.begin() as conn:
+                fila = (await conn.execute(self._sentencia_reserva(tamano))).one()
+                return fila.next_value - tamano, fila.secret
+
+    # --- API ---
+
+    def claves(self, db: Session, n: int = 1) -> list[str]:
+        """
+        Devuelve 'n' claves nuevas. La reserva usa su propia conexión para
+        que un rollback de la sesión 'db' no devuelva números ya repartidos.
+        """
+        engine = db.get_bind()
+        bd = str(engine.url)
+        numeros = self._tomar(bd, n)
+        while len(numeros) < n:
+            tamano = max(self.block_size, n - len(numeros))
+            inicio, secreto = self._reservar(engine, tamano)
+            self._guardar(bd, inicio, tamano, secreto)
+            numeros.extend(self._tomar(bd, n - len(numeros)))
+        return self._codificar(bd, numeros)
+
+    async def claves_async(self, db: AsyncSession, n: int = 1) -> list[str]:
+        """Versión asíncrona de claves()."""
+        engine = db.bind
+        bd = str(engine.url)
+        numeros = self._tomar(bd, n)
+        while len(numeros) < n:
+            tamano = max(self.block_size, n - len(numeros))
+            inicio, secreto = await self._reservar_async(engine, tamano)
+            self._guardar(bd, inicio, tamano, secreto)
+            numeros.extend(self._tomar(bd, n - len(numeros)))
+        return self._codificar(bd, numeros)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            disponibles = sum(fin - inicio for bloques in self._bloques.values() for inicio, fin in bloques)
+        return {
+            "strategy": self.nombre,
+            "block_size": self.block_size,
+            "min_length": self.min_length,
+            "scramble": self.scramble,
+            "blocks_reserved": self.bloques_reservados,
+            "keys_generated": self.claves_generadas,
+            "keys_available": disponibles,
+        }
+
+
+GENERADORES = {
+    GeneradorAleatorio.nombre: GeneradorAleatorio,
+    GeneradorSecuencial.nombre: GeneradorSecuencial,
+}
+
+
+def crear_generador(nombre: str = KEY_GENERATOR):
+    """Instancia la estrategia configurada en KEY_GENERATOR."""
+    try:
+        return GENERADORES[nombre]()
+    except KeyError:
+        raise ValueError(f"KEY_GENERATOR desconocido: '{nombre}' (opciones: {', '.join(GENERADORES)})")
+
+
+# Instancia compartida por toda la aplicación
+generador_claves = crear_generador()
@@ -1,38 +1,98 @@
 import os
+import json
+import math
 import secrets
-import re
 import asyncio
-import httpx
 import socket
-from typing import Optional
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Literal
+from pydantic import ValidationError
+from contextlib import asynccontextmanager
 from urllib.parse import urlparse
-import validators
-from fastapi import FastAPI, Depends, HTTPException, Request, status
-from fastapi.responses import RedirectResponse, HTMLResponse, FileResponse
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import RedirectResponse, HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Importaciones locales
-import models, schemas, crud
-from database import SessionLocal, engine
+import models, schemas, crud, importer
+from database import SessionLocal, AsyncSessionLocal, engine, async_engine, actualizar_esquema
+from cache import cache_resolucion, cache_dns, cache_validacion, URLResuelta
+from clicks import acumulador_clicks
+from analytics import registro_eventos, ANALYTICS_ENABLED
+from keygen import generador_claves
+from invalidation import canal_invalidacion
+from keyfilter import filtro_claves
+from export import exportar_urls, nombre_fichero, TIPOS_CONTENIDO
+from redirect import RedireccionRapida, pagina_error, registrar_visita, politica, no_modificada, instante, caducado
+from ratelimit import LimitarPeticiones, limitador, cobrar_lote
+from purge import purga_enlaces, PURGE_ENABLED
+from metrics import (
+    METRICS_ENABLED, MedirPeticiones, IndicadorFuncion, instrumentar_engine, medir_etapa,
+    exportar as exportar_metricas,
+)
+from http_client import cliente_http, HTTP_TIMEOUT
+from reachability import verificador_diferido, ESTADO_PENDIENTE, ESTADO_OK, ESTADO_INACCESIBLE
+from validation import MAX_URL_LENGTH, validar_url_sintaxis, validate_many
 
 # ==============================================================================
 # 1. CONFIGURACIÓN INICIAL
 # ==============================================================================
 
-# Crear tablas en la BD
-models.Base.metadata.create_all(bind=engine)
+# Crear tablas en la BD (y añadir columnas nuevas a una BD existente) al
+# arrancar, no al importar: importar main (tests, scripts, cada worker) no
+# toca la base de datos. server.py migra una vez antes de lanzar los workers
+# y lo desactiva en ellos con AUTO_MIGRATE=false.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "True").lower() == "true"
+
+# Con varios workers, las ediciones hechas en otro proceso llegan por el canal
+canal_invalidacion.suscribir(cache_resolucion.invalidate)
 
 # Definir rutas de carpetas
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca y detiene las tareas de fondo de la aplicación."""
+    if AUTO_MIGRATE:
+        actualizar_esquema(engine)
+        with SessionLocal() as db:
+            crud.fill_missing_target_hashes(db)
+    # Inicializa los contadores del resumen si la BD aún no los tiene
+    async with AsyncSessionLocal() as db:
+        await crud.get_summary_async(db)
+    acumulador_clicks.start()
+    if ANALYTICS_ENABLED:
+        registro_eventos.start()
+    await cliente_http.start()
+    await verificador_diferido.start(comprobar_destino)
+    await canal_invalidacion.start()
+    filtro_claves.iniciar_carga(async_engine)
+    if PURGE_ENABLED:
+        purga_enlaces.start()
+    yield
+    await filtro_claves.detener()
+    purga_enlaces.stop()
+    await canal_invalidacion.stop()
+    await verificador_diferido.stop()
+    await cliente_http.close()
+    # Último volcado de visitas antes de apagar; el motor se cierra aunque falle
+    try:
+        acumulador_clicks.stop()
+        registro_eventos.stop()
+    finally:
+        await async_engine.dispose()
+
 app = FastAPI(
     title="URL Shortener",
     description="API para acortar URLs (Rama Prueba-Internet)",
-    version="1.2.0"
+    version="1.2.0",
+    lifespan=lifespan
 )
 
 # ==============================================================================
@@ -41,185 +101,39 @@ app = FastAPI(
 
 # Configuración para verificación de URLs
 VALIDATE_URLS = os.getenv("VALIDATE_URLS", "True").lower() == "true"
-VALIDATION_TIMEOUT = 5  # segundos
-MAX_URL_LENGTH = 2048
-
-# Lista de TLDs válidos (se puede expandir)
-VALID_TLDS = {
-    'com', 'org', 'net', 'edu', 'gov', 'mil', 'int', 
-    'arpa', 'ac', 'ad', 'ae', 'af', 'ag', 'ai', 'al', 
-    'am', 'ao', 'aq', 'ar', 'as', 'at', 'au', 'aw', 
-    'ax', 'az', 'ba', 'bb', 'bd', 'be', 'bf', 'bg', 
-    'bh', 'bi', 'bj', 'bm', 'bn', 'bo', 'br', 'bs', 
-    'bt', 'bv', 'bw', 'by', 'bz', 'ca', 'cc', 'cd', 
-    'cf', 'cg', 'ch', 'ci', 'ck', 'cl', 'cm', 'cn', 
-    'co', 'cr', 'cu', 'cv', 'cx', 'cy', 'cz', 'de', 
-    'dj', 'dk', 'dm', 'do', 'dz', 'ec', 'ee', 'eg', 
-    'eh', 'er', 'es', 'et', 'eu', 'fi', 'fj', 'fk', 
-    'fm', 'fo', 'fr', 'ga', 'gb', 'gd', 'ge', 'gf', 
-    'gg', 'gh', 'gi', 'gl', 'gm', 'gn', 'gp', 'gq', 
-    'gr', 'gs', 'gt', 'gu', 'gw', 'gy', 'hk', 'hm', 
-    'hn', 'hr', 'ht', 'hu', 'id', 'ie', 'il', 'im', 
-    'in', 'io', 'iq', 'ir', 'is', 'it', 'je', 'jm', 
-    'jo', 'jp', 'ke', 'kg', 'kh', 'ki', 'km', 'kn', 
-    'kp', 'kr', 'kw', 'ky', 'kz', 'la', 'lb', 'lc', 
-    'li', 'lk', 'lr', 'ls', 'lt', 'lu', 'lv', 'ly', 
-    'ma', 'mc', 'md', 'me', 'mg', 'mh', 'mk', 'ml', 
-    'mm', 'mn', 'mo', 'mp', 'mq', 'mr', 'ms', 'mt', 
-    'mu', 'mv', 'mw', 'mx', 'my', 'mz', 'na', 'nc', 
-    'ne', 'nf', 'ng', 'ni', 'nl', 'no', 'np', 'nr', 
-    'nu', 'nz', 'om', 'pa', 'pe', 'pf', 'pg', 'ph', 
-    'pk', 'pl', 'pm', 'pn', 'pr', 'ps', 'pt', 'pw', 
-    'py', 'qa', 're', 'ro', 'rs', 'ru', 'rw', 'sa', 
-    'sb', 'sc', 'sd', 'se', 'sg', 'sh', 'si', 'sj', 
-    'sk', 'sl', 'sm', 'sn', 'so', 'sr', 'ss', 'st', 
-    'sv', 'sx', 'sy', 'sz', 'tc', 'td', 'tf', 'tg', 
-    'th', 'tj', 'tk', 'tl', 'tm', 'tn', 'to', 'tr', 
-    'tt', 'tv', 'tw', 'tz', 'ua', 'ug', 'uk', 'us', 
-    'uy', 'uz', 'va', 'vc', 've', 'vg', 'vi', 'vn', 
-    'vu', 'wf', 'ws', 'ye', 'yt', 'za', 'zm', 'zw'
-}
-
-# Dominios bloqueados (ejemplos comunes)
-BLOCKED_DOMAINS = [
-    "localhost",
-    "127.0.0.1",
-    "0.0.0.0",
-    "::1",
-    "192.168.",
-    "10.",
-    "172.16.",
-    "172.17.",
-    "172.18.",
-    "172.19.",
-    "172.20.",
-    "172.21.",
-    "172.22.",
-    "172.23.",
-    "172.24.",
-    "172.25.",
-    "172.26.",
-    "172.27.",
-    "172.28.",
-    "172.29.",
-    "172.30.",
-    "172.31.",
-]
+# Si está activo, la comprobación de DNS/HTTP se hace en segundo plano
+# y POST /url responde en cuanto pasan las validaciones de formato.
+DEFERRED_VALIDATION = os.getenv("DEFERRED_VALIDATION", "False").lower() == "true"
+VALIDATION_TIMEOUT = HTTP_TIMEOUT  # segundos (configurable con HTTP_TIMEOUT)
+
+# Creación masiva: tamaño máximo del lote y validaciones simultáneas
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+BULK_VALIDATION_CONCURRENCY = int(os.getenv("BULK_VALIDATION_CONCURRENCY", "50"))
+
+# Deduplicación: si el destino (normalizado) ya tiene un enlace activo con la
+# misma política, POST /url devuelve ese enlace sin validar ni insertar nada
+DEDUP_TARGETS = os.getenv("DEDUP_TARGETS", "False").lower() == "true"
+
+# Estadísticas: máximo de intervalos (horas o días) por consulta
+STATS_MAX_BUCKETS = int(os.getenv("STATS_MAX_BUCKETS", "10000"))
+
+# Las reglas de formato y dominio (TLDs válidos, redes bloqueadas, patrones
+# precompilados) viven en validation.py
 
 # ==============================================================================
 # 1.2 FUNCIONES DE VALIDACIÓN MEJORADAS
 # ==============================================================================
 
-def validar_formato_url(url: str) -> tuple[bool, str]:
-    """Valida el formato básico de una URL de manera estricta"""
-    # Validación de longitud
-    if len(url) > MAX_URL_LENGTH:
-        return False, f"La URL es demasiado larga (máximo {MAX_URL_LENGTH} caracteres)"
-    
-    # Eliminar protocolo si existe para analizar el dominio
-    clean_url = url.lower()
-    if clean_url.startswith(('http://', 'https://')):
-        clean_url = clean_url.split('://', 1)[1]
-    
-    # Eliminar ruta y parámetros si existen
-    domain_part = clean_url.split('/')[0]
-    
-    # Verificar que tenga al menos un punto
-    if '.' not in domain_part:
-        return False, "El dominio debe contener un punto (ej: ejemplo.com)"
-    
-    # Dividir dominio para analizar
-    domain_parts = domain_part.split('.')
-    
-    # Verificar que haya al menos 2 partes después del último punto
-    if len(domain_parts) < 2:
-        return False, "Dominio incompleto (ej: ejemplo.com)"
-    
-    # Verificar cada parte del dominio
-    for part in domain_parts:
-        if not part:
-            return False, "Parte del dominio vacía"
-        if len(part) < 1:  # No permitir partes de dominio vacías
-            return False, "Parte del dominio demasiado corta"
-        if not re.match(r'^[a-z0-9]([a-z0-9-]*[a-z0-9])?$', part):
-            return False, f"Parte del dominio inválida: '{part}'"
-    
-    # Verificar el TLD (extensión del dominio)
-    tld = domain_parts[-1].lower()
-    if tld not in VALID_TLDS:
-        return False, f"Extensión de dominio no válida: '.{tld}'"
-    
-    # Verificar que el dominio principal (sin TLD) no sea demasiado corto
-    main_domain = domain_parts[-2] if len(domain_parts) >= 2 else ''
-    if len(main_domain) < 2 and main_domain not in {'co', 'ac', 'go', 'or', 'ne', 'com'}:
-        return False, "Nombre de dominio principal demasiado corto"
-    
-    # Patrón regex más estricto para URL completa
-    patron_url = re.compile(
-        r'^(https?://)?'  # http:// o https:// (opcional)
-        r'([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+'  # dominio
-        r'[A-Za-z]{2,}'  # extensión de dominio (al menos 2 caracteres)
-        r'(:[0-9]{1,5})?'  # puerto opcional
-        r'(/.*)?$',  # ruta opcional
-        re.IGNORECASE
-    )
-    
-    if not patron_url.match(url):
-        return False, "Formato de URL inválido"
-    
-    return True, ""
-
-def validar_dominio(url: str) -> tuple[bool, str]:
-    """Valida que el dominio no sea local, privado o sospechoso"""
-    try:
-        parsed = urlparse(url)
-        if not parsed.hostname:
-            return False, "URL sin dominio válido"
-        
-        hostname = parsed.hostname.lower()
-        
-        # Verificar dominios bloqueados
-        for blocked in BLOCKED_DOMAINS:
-            if hostname.startswith(blocked):
-                return False, f"Dominio no permitido: {hostname}"
-        
-        # Verificar si es IP
-        if re.match(r'^\d+\.\d+\.\d+\.\d+$', hostname):
-            octetos = list(map(int, hostname.split('.')))
-            # IPs privadas
-            if octetos[0] == 10:
-                return False, "IP privada (10.x.x.x) no permitida"
-            elif octetos[0] == 172 and 16 <= octetos[1] <= 31:
-                return False, "IP privada (172.16-31.x.x) no permitida"
-            elif octetos[0] == 192 and octetos[1] == 168:
-                return False, "IP privada (192.168.x.x) no permitida"
-        
-        # Verificar que el dominio tenga al menos 2 partes separadas por punto
-        if hostname.count('.') < 1:
-            return False, "Dominio debe tener al menos un punto separador"
-        
-        # Verificar que no sea solo un TLD (como "com" o "org")
-        domain_parts = hostname.split('.')
-        if len(domain_parts) < 2:
-            return False, "Dominio incompleto"
-        
-        # Verificar que el último segmento (TLD) tenga al menos 2 caracteres
-        tld = domain_parts[-1]
-        if len(tld) < 2:
-            return False, "Extensión de dominio demasiado corta"
-        
-        # Verificar dominio principal
-        main_domain = domain_parts[-2]
-        if len(main_domain) < 2:
-            return False, "Nombre de dominio principal demasiado corto"
-        
-        return True, ""
-        
-    except Exception as e:
-        return False, f"Error validando dominio: {str(e)}"
-
 async def verificar_resolucion_dns(hostname: str) -> tuple[bool, str]:
-    """Verifica que el dominio se pueda resolver a través de DNS"""
+    """
+    Verifica que el dominio se pueda resolver a través de DNS.
+    Pasa por la caché DNS, así que un mismo dominio solo se resuelve una vez
+    por TTL aunque lo consulten varias validaciones (o varias a la vez).
+    """
+    return await cache_dns.resolver(hostname, _resolver_dns)
+
+async def _resolver_dns(hostname: str) -> tuple[bool, str]:
+    """Resolución DNS real (sin caché) usando getaddrinfo del event loop."""
     try:
         # Usar asyncio para resolver DNS
         loop = asyncio.get_event_loop()
@@ -241,7 +155,10 @@ async def verificar_url_accesible(url: str) -> tuple[bool, str]:
     """Verifica que la URL sea accesible haciendo una petición HEAD"""
     if not VALIDATE_URLS:
         return True, ""
-    
+
+    # Importación diferida: httpx solo se carga al hacer la primera comprobación
+    import httpx
+
     try:
         # Primero verificar DNS
         parsed = urlparse(url)
@@ -249,18 +166,12 @@ async def verificar_url_accesible(url: str) -> tuple[bool, str]:
         if not dns_ok:
             return False, dns_msg
         
-        async with httpx.AsyncClient(
-            timeout=VALIDATION_TIMEOUT,
-            follow_redirects=True,
-            verify=False,  # Para testing, en producción debería ser True
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-        ) as client:
+        # Cliente compartido (pool + keep-alive) con límite de peticiones por host
+        async with cliente_http.usar(parsed.hostname) as client:
             
             # Intentar con HEAD primero (más liviano)
             try:
-                response = await client.head(url, allow_redirects=True)
+                response = await client.head(url)
                 if response.status_code < 400:
                     return True, ""
                 elif response.status_code == 405:
@@ -294,50 +205,73 @@ async def verificar_url_accesible(url: str) -> tuple[bool, str]:
     except Exception as e:
         return False, f"Error verificando URL: {str(e)}"
 
-async def validar_url_completa(url: str) -> tuple[bool, str]:
-    """Valida una URL completamente: formato, dominio y accesibilidad"""
-    
-    # Paso 1: Verificar formato básico
-    if not url:
-        return False, "La URL no puede estar vacía"
-    
-    # Eliminar espacios
-    url = url.strip()
-    
-    # Paso 2: Asegurar que tenga protocolo
-    if not url.startswith(('http://', 'https://')):
-        url = 'https://' + url
-    
-    # Paso 3: Validar con validators (biblioteca existente)
-    if not validators.url(url):
-        return False, "Formato de URL inválido. Ejemplo: https://ejemplo.com"
-    
-    # Paso 4: Validar formato con nuestra función más estricta
-    formato_ok, formato_msg = validar_formato_url(url)
-    if not formato_ok:
-        return False, formato_msg
+async def comprobar_accesibilidad(url: str) -> tuple[bool, str]:
+    """verificar_url_accesible con caché por URL destino (un sondeo por TTL)."""
+    resultado = cache_validacion.get(url)
+    if resultado is None:
+        resultado = await verificar_url_accesible(url)
+        cache_validacion.set(url, resultado)
+    return resultado
+
+async def comprobar_destino(url: str) -> tuple[bool, str]:
+    """DNS + accesibilidad. Es lo que ejecuta el verificador en segundo plano."""
+    dns_ok, dns_msg = await verificar_resolucion_dns(urlparse(url).hostname)
+    if not dns_ok:
+        return False, f"El dominio no existe o no se puede resolver: {dns_msg}"
+    return await comprobar_accesibilidad(url)
+
+async def _validar_url_completa(url: str) -> tuple[bool, str, Optional[str]]:
+    """validar_url_completa que además devuelve el check_status a guardar."""
     
-    # Paso 5: Validar dominio
-    dominio_valido, mensaje_dominio = validar_dominio(url)
-    if not dominio_valido:
-        return False, mensaje_dominio
+    # Pasos 1-5: formato y dominio
+    valida, resultado = validar_url_sintaxis(url)
+    if not valida:
+        return False, resultado, None
+    return await _validar_red(resultado)
+
+async def _validar_red(url: str) -> tuple[bool, str, Optional[str]]:
+    """Pasos de red (DNS y accesibilidad) sobre una URL ya normalizada."""
     
     # Paso 6: Verificar DNS (esto es crítico para saber si el dominio existe)
     parsed = urlparse(url)
+    inicio = time.perf_counter()
     dns_ok, dns_msg = await verificar_resolucion_dns(parsed.hostname)
+    medir_etapa("dns", inicio, dns_ok)
     if not dns_ok:
-        return False, f"El dominio no existe o no se puede resolver: {dns_msg}"
+        return False, f"El dominio no existe o no se puede resolver: {dns_msg}", None
     
     # Paso 7: Verificar que sea accesible (opcional pero recomendado)
+    estado = None
     if VALIDATE_URLS:
-        accesible, mensaje_acceso = await verificar_url_accesible(url)
+        inicio = time.perf_counter()
+        accesible, mensaje_acceso = await comprobar_accesibilidad(url)
+        medir_etapa("http", inicio, accesible)
+        estado = ESTADO_OK if accesible else ESTADO_INACCESIBLE
         if not accesible:
             # No rechazamos inmediatamente, damos una advertencia
             print(f"Advertencia: {mensaje_acceso}")
             # Podemos decidir si rechazar o aceptar con advertencia
             # Por ahora aceptamos pero registramos la advertencia
     
-    return True, url
+    return True, url, estado
+
+async def validar_url_completa(url: str) -> tuple[bool, str]:
+    """Valida una URL completamente: formato, dominio y accesibilidad"""
+    valida, resultado, _ = await _validar_url_completa(url)
+    return valida, resultado
+
+async def validar_para_guardar(url: str) -> tuple[bool, str, Optional[str]]:
+    """
+    Validación usada al crear o editar enlaces.
+
+    Con DEFERRED_VALIDATION solo se hacen los pasos baratos y el enlace
+    queda 'pending' hasta que el verificador en segundo plano lo compruebe.
+    Devuelve (valida, url_normalizada | mensaje_error, check_status).
+    """
+    if DEFERRED_VALIDATION:
+        valida, resultado = validar_url_sintaxis(url)
+        return valida, resultado, ESTADO_PENDIENTE if valida else None
+    return await _validar_url_completa(url)
 
 # ==============================================================================
 # 2. ARCHIVOS ESTÁTICOS
@@ -348,14 +282,40 @@ if not os.path.exists(FRONTEND_DIR):
 
 app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
 
+# Camino rápido para GET /{url_key} (ver redirect.py); se añade antes que
+# CORS y métricas para quedar por dentro de ambos
+app.add_middleware(RedireccionRapida)
+
+# Límite de peticiones por cliente (ver ratelimit.py): por fuera del camino
+# rápido, para cubrir también las redirecciones, y por dentro de CORS
+app.add_middleware(LimitarPeticiones)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Métricas: latencia por ruta y peticiones en curso (middleware más externo)
+# y duración de cada consulta SQL en ambos motores
+if METRICS_ENABLED:
+    app.add_middleware(MedirPeticiones)
+    instrumentar_engine(engine, "sync")
+    instrumentar_engine(async_engine.sync_engine, "async")
+
+# Estado de las estructuras en memoria, calculado al pedir /metrics
+IndicadorFuncion("resolution_cache_entries", "Claves en la caché de resolución",
+                 lambda: cache_resolucion.estadisticas()["size"])
+IndicadorFuncion("resolution_cache_hit_ratio", "Proporción de aciertos de la caché de resolución",
+                 lambda: cache_resolucion.estadisticas()["hit_ratio"])
+IndicadorFuncion("click_events_buffered", "Visitas en el buffer pendientes de escribir",
+                 lambda: registro_eventos.pendientes())
+IndicadorFuncion("deferred_checks_queued", "Comprobaciones de accesibilidad en cola",
+                 lambda: verificador_diferido.estadisticas()["queued"])
+
 # ==============================================================================
 # 3. FUNCIONES DE AYUDA (DEPENDENCIAS)
 # ==============================================================================
@@ -368,6 +328,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Gestiona la sesión asíncrona (usada por las rutas 'async def')."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 security = HTTPBasic()
 
 def verificar_admin(credentials: HTTPBasicCredentials = Depends(security)):
@@ -412,9 +377,31 @@ def read_admin(username: str = Depends(verificar_admin)):
 # ==============================================================================
 
 @app.get("/urls", response_model=list[schemas.URLInfo])
-def read_urls(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), request: Request = None):
-    """Devuelve el historial de URLs."""
-    urls = crud.get_urls(db, skip=skip, limit=limit)
+async def read_urls(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    sort: Literal["date_desc", "date_asc", "clicks_desc", "clicks_asc", "alpha_asc"] = "date_desc",
+    q: Optional[str] = Query(None, description="Buscar por inicio del código o parte de la URL de destino"),
+    db: AsyncSession = Depends(get_async_db),
+    request: Request = None,
+):
+    """
+    Devuelve el historial de URLs, filtrado y ordenado en el servidor.
+
+    Paginación por cursor: si hay más resultados, la respuesta incluye la
+    cabecera X-Next-Cursor, que se pasa como ?cursor= para pedir la
+    siguiente página. 'skip' se mantiene por compatibilidad.
+    """
+    try:
+        urls, siguiente = await crud.get_urls_page_async(db, limit=limit, cursor=cursor, sort=sort, q=q, skip=skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if siguiente:
+        response.headers["X-Next-Cursor"] = siguiente
+
     base_url = obtener_base_url(request)
     
     for url in urls:
@@ -422,16 +409,60 @@ def read_urls(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), re
         
     return urls
 
+@app.get("/urls/export")
+async def export_urls(
+    request: Request,
+    format: Literal["csv", "ndjson"] = "csv",
+    created_from: Optional[datetime] = Query(None, description="Creadas desde (incluido)"),
+    created_to: Optional[datetime] = Query(None, description="Creadas hasta (excluido)"),
+    active: Optional[bool] = Query(None, description="Solo activas (true) o desactivadas (false)"),
+    min_clicks: Optional[int] = Query(None, ge=0, description="Mínimo de visitas"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Exporta todos los enlaces (con sus visitas) en CSV o NDJSON.
+
+    La respuesta se genera por lotes mientras se envía, con memoria
+    constante aunque la tabla tenga millones de filas. Si el cliente
+    acepta gzip (Accept-Encoding), se comprime sobre la marcha.
+    """
+    comprimir = "gzip" in request.headers.get("accept-encoding", "").lower()
+    cabeceras = {"Content-Disposition": f'attachment; filename="{nombre_fichero(format)}"', "Vary": "Accept-Encoding"}
+    if comprimir:
+        cabeceras["Content-Encoding"] = "gzip"
+
+    flujo = exportar_urls(
+        db.bind, format, obtener_base_url(request), comprimir,
+        created_from=schemas.a_utc(created_from) if created_from else None,
+        created_to=schemas.a_utc(created_to) if created_to else None,
+        active=active,
+        min_clicks=min_clicks,
+    )
+    return StreamingResponse(flujo, media_type=TIPOS_CONTENIDO[format], headers=cabeceras)
+
 @app.post("/url", response_model=schemas.URLInfo)
-async def create_url(url: schemas.URLCreate, request: Request, db: Session = Depends(get_db)):
+async def create_url(url: schemas.URLCreate, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Crea un nuevo enlace corto con validación mejorada."""
     
     # Validación mejorada
     if not url.target_url or url.target_url.strip() == "":
         raise HTTPException(status_code=400, detail="La URL no puede estar vacía")
+
+    base_url = obtener_base_url(request)
+
+    if url.expires_at is not None and url.expires_at <= datetime.now(timezone.utc).replace(tzinfo=None):
+        raise HTTPException(status_code=400, detail="La fecha de caducidad ya ha pasado")
+
+    # Destino ya acortado: se reutiliza su enlace (ya se validó al crearlo).
+    # Los enlaces que caducan no se comparten.
+    if DEDUP_TARGETS and url.expires_at is None and url.max_clicks is None:
+        existente = await crud.find_url_by_target_async(db, url.target_url, url.redirect_type)
+        if existente is not None:
+            existente.url_completa = f"{base_url}{existente.key}"
+            return existente
     
-    # Validar URL completamente
-    valida, resultado = await validar_url_completa(url.target_url)
+    # Validar URL completamente (o solo el formato, en modo diferido)
+    valida, resultado, estado = await validar_para_guardar(url.target_url)
     
     if not valida:
         raise HTTPException(status_code=400, detail=resultado)
@@ -441,22 +472,271 @@ async def create_url(url: schemas.URLCreate, request: Request, db: Session = Dep
         url.target_url = resultado
     
     # Guardar en BD
-    db_url = crud.create_url(db=db, url=url)
+    db_url = await crud.create_url_async(db=db, url=url, check_status=estado)
+    filtro_claves.agregar(db_url.key)
+    if estado == ESTADO_PENDIENTE:
+        verificador_diferido.avisar()
     
     # Respuesta con URL completa
-    base_url = obtener_base_url(request)
     db_url.url_completa = f"{base_url}{db_url.key}"
     
     return db_url
 
+async def leer_ndjson(request: Request) -> list[str]:
+    """
+    Lee un cuerpo NDJSON en streaming (sin cargarlo entero de golpe).
+    Cada línea puede ser una URL en texto JSON ("https://...") o un
+    objeto {"target_url": "https://..."}.
+    """
+    targets: list[str] = []
+    resto = b""
+
+    def procesar(linea: bytes):
+        linea = linea.strip()
+        if not linea:
+            return
+        try:
+            dato = json.loads(linea)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Línea NDJSON inválida ({len(targets) + 1})")
+        if isinstance(dato, dict):
+            dato = dato.get("target_url", "")
+        if not isinstance(dato, str):
+            raise HTTPException(status_code=400, detail=f"Línea NDJSON inválida ({len(targets) + 1})")
+        targets.append(dato)
+        if len(targets) > BULK_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ITEMS} URLs por lote")
+
+    async for chunk in request.stream():
+        resto += chunk
+        *lineas, resto = resto.split(b"\n")
+        for linea in lineas:
+            procesar(linea)
+    procesar(resto)
+
+    return targets
+
+@app.post(
+    "/urls/bulk",
+    response_model=schemas.URLBulkResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": schemas.URLBulkCreate.model_json_schema()},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def create_urls_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Crea muchos enlaces cortos de una vez.
+
+    Las URLs se validan en paralelo (con un máximo de validaciones simultáneas)
+    y las válidas se insertan en una sola transacción. Devuelve el resultado
+    de cada URL en el mismo orden en que se enviaron.
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        targets = await leer_ndjson(request)
+    else:
+        try:
+            targets = schemas.URLBulkCreate.model_validate_json(await request.body()).target_urls
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+    if len(targets) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ITEMS} URLs por lote")
+
+    # Cada URL del lote gasta una ficha de la regla "bulk" del límite de peticiones
+    espera = await cobrar_lote(request.scope, len(targets))
+    if espera > 0:
+        segundos = max(1, math.ceil(espera))
+        raise HTTPException(
+            status_code=429, detail=f"Demasiadas peticiones. Vuelve a intentarlo en {segundos} s.",
+            headers={"Retry-After": str(segundos)},
+        )
+
+    # Paso 1: validación sintáctica de todo el lote (sin red, URLs repetidas una sola vez)
+    sintaxis = validate_many(targets)
+
+    # Paso 2: comprobaciones de red en paralelo, acotando cuántas corren a la vez
+    semaforo = asyncio.Semaphore(BULK_VALIDATION_CONCURRENCY)
+
+    async def validar(target: str, valida: bool, resultado: str) -> tuple[bool, str, Optional[str]]:
+        if not target or target.strip() == "":
+            return False, "La URL no puede estar vacía", None
+        if not valida:
+            return False, resultado, None
+        if DEFERRED_VALIDATION:
+            return True, resultado, ESTADO_PENDIENTE
+        async with semaforo:
+            return await _validar_red(resultado)
+
+    validaciones = await asyncio.gather(
+        *(validar(t, valida, resultado) for t, (valida, resultado) in zip(targets, sintaxis)),
+        return_exceptions=True,
+    )
+
+    results: list[schemas.URLBulkItemResult] = []
+    validas: list[tuple[int, str, Optional[str]]] = []
+    for index, (target, validacion) in enumerate(zip(targets, validaciones)):
+        if isinstance(validacion, Exception):
+            validacion = (False, f"Error validando URL: {validacion}", None)
+        valida, resultado, estado = validacion
+        if valida:
+            validas.append((index, resultado, estado))
+        results.append(schemas.URLBulkItemResult(index=index, target_url=target, ok=False, error=None if valida else resultado))
+
+    # Paso 3: generar claves e insertar todas las válidas en una transacción
+    creadas = await crud.create_urls_bulk_async(
+        db, [url for _, url, _ in validas], [estado for _, _, estado in validas]
+    )
+    base_url = obtener_base_url(request)
+    for (index, url, estado), db_url in zip(validas, creadas):
+        filtro_claves.agregar(db_url.key)
+        if estado == ESTADO_PENDIENTE:
+            verificador_diferido.avisar()
+        item = results[index]
+        item.ok = True
+        item.target_url = url
+        item.key = db_url.key
+        item.url_completa = f"{base_url}{db_url.key}"
+
+    return schemas.URLBulkResponse(
+        created=len(creadas),
+        failed=len(results) - len(creadas),
+        results=results,
+    )
+
+# ==============================================================================
+# 5.1 IMPORTACIÓN MASIVA (ADMIN)
+# ==============================================================================
+
+def _ejecutar_importacion(ruta: str, **opciones) -> None:
+    """Tarea de fondo: importa el fichero subido y lo borra si termina bien."""
+    try:
+        importer.importar(ruta, **opciones)
+    except Exception as e:
+        print(f"Importación '{opciones['nombre']}' interrumpida: {e}")
+    else:
+        os.remove(ruta)
+
+@app.post("/api/admin/imports", status_code=202)
+async def start_import(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    format: Literal["csv", "ndjson"] = "csv",
+    job: Optional[str] = Query(None, description="Nombre de la importación (para consultarla o reanudarla)"),
+    on_conflict: Literal["skip", "fail"] = "skip",
+    defer_check: bool = Query(False, description="Comprobar la accesibilidad de los destinos en segundo plano"),
+    restart: bool = Query(False, description="Empezar de cero aunque haya progreso guardado"),
+    db: Session = Depends(get_db),
+    username: str = Depends(verificar_admin),
+):
+    """
+    Importa un fichero CSV/NDJSON enviado como cuerpo (ver importer.py).
+
+    El cuerpo se guarda en disco mientras llega y la importación sigue en
+    segundo plano; su progreso se consulta en GET /api/admin/imports/{job}.
+    Si se interrumpe, repetir la petición con el mismo 'job' (con el
+    fichero, o sin cuerpo para usar el ya subido) continúa donde se quedó.
+    """
+    nombre = job or f"import-{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    if not importer.PATRON_TRABAJO.fullmatch(nombre):
+        raise HTTPException(status_code=400, detail="Nombre de importación no válido")
+    if importer.en_curso(nombre):
+        raise HTTPException(status_code=409, detail="Esa importación ya está en curso")
+
+    os.makedirs(importer.IMPORT_UPLOAD_DIR, exist_ok=True)
+    ruta = os.path.join(importer.IMPORT_UPLOAD_DIR, f"{nombre}.{format}")
+    recibidos = 0
+    with open(ruta + ".part", "wb") as fichero:
+        async for trozo in request.stream():
+            fichero.write(trozo)
+            recibidos += len(trozo)
+    if recibidos:
+        os.replace(ruta + ".part", ruta)
+    else:
+        os.remove(ruta + ".part")
+        if not os.path.exists(ruta):
+            raise HTTPException(status_code=400, detail="Falta el fichero a importar")
+
+    # Los lotes se guardan desde un hilo; el filtro de claves y el aviso al
+    # verificador diferido se tocan desde el event loop
+    loop = asyncio.get_running_loop()
+
+    def registrar(insertadas: list[tuple[str, str]]) -> None:
+        for key, _ in insertadas:
+            filtro_claves.agregar(key)
+        if defer_check:
+            verificador_diferido.avisar()
+
+    motor = db.get_bind()
+    background_tasks.add_task(
+        _ejecutar_importacion, ruta,
+        formato=format, nombre=nombre, on_conflict=on_conflict, defer_check=defer_check, reiniciar=restart,
+        session_factory=lambda: Session(motor),
+        al_insertar=lambda insertadas: loop.call_soon_threadsafe(registrar, insertadas),
+    )
+    return {"job": nombre, "status": "accepted", "status_url": f"/api/admin/imports/{nombre}"}
+
+@app.get("/api/admin/summary", response_model=schemas.AdminSummary)
+async def admin_summary(
+    request: Request,
+    top: int = Query(10, ge=1, le=100, description="Tamaño del ranking de más visitados"),
+    refresh: bool = Query(False, description="Recalcular los contadores recorriendo la tabla"),
+    db: AsyncSession = Depends(get_async_db),
+    username: str = Depends(verificar_admin),
+):
+    """
+    Totales y ranking del panel de administración.
+
+    No depende del número de enlaces: lee tres contadores y las 'top'
+    primeras entradas del índice por visitas. 'refresh' los recalcula
+    (solo hace falta si se tocó la BD a mano).
+    """
+    contadores = await crud.get_summary_async(db, recompute=refresh)
+    base_url = obtener_base_url(request)
+    return schemas.AdminSummary(
+        total_links=contadores["links"],
+        active_links=contadores["active_links"],
+        inactive_links=contadores["links"] - contadores["active_links"],
+        total_clicks=contadores["clicks"],
+        top_links=[
+            schemas.AdminTopLink(
+                key=url.key, target_url=url.target_url, clicks=url.clicks or 0,
+                is_active=url.is_active is not False, url_completa=f"{base_url}{url.key}",
+            )
+            for url in await crud.get_top_urls_async(db, top)
+        ],
+    )
+
+@app.post("/api/admin/purge")
+def run_purge(db: Session = Depends(get_db), username: str = Depends(verificar_admin)):
+    """
+    Purga ahora los enlaces caducados (ver purge.py) y devuelve el informe:
+    enlaces purgados, tiempo de cada lote y de la compactación.
+    """
+    motor = db.get_bind()
+    return purga_enlaces.ejecutar(session_factory=lambda: Session(motor))
+
+@app.get("/api/admin/imports/{job}")
+def import_status(job: str, db: Session = Depends(get_db), username: str = Depends(verificar_admin)):
+    """Progreso guardado de una importación."""
+    trabajo = db.get(models.ImportJob, job)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Importación no encontrada")
+    return importer.informe_trabajo(trabajo)
+
 # ==============================================================================
 # 6. REDIRECCIÓN Y OPERACIONES CRUD
 # ==============================================================================
 
 @app.put("/urls/{url_key}", response_model=schemas.URLInfo)
-async def update_url_endpoint(url_key: str, updates: schemas.URLUpdate, db: Session = Depends(get_db)):
+async def update_url_endpoint(url_key: str, updates: schemas.URLUpdate, db: AsyncSession = Depends(get_async_db)):
     """Edita una URL existente con validación mejorada."""
-    db_url = crud.get_url_by_key(db, url_key)
+    db_url = await crud.get_url_by_key_async(db, url_key)
     if not db_url:
         raise HTTPException(status_code=404, detail="URL no encontrada")
     
@@ -465,8 +745,8 @@ async def update_url_endpoint(url_key: str, updates: schemas.URLUpdate, db: Sess
         if not updates.target_url or updates.target_url.strip() == "":
             raise HTTPException(status_code=400, detail="La URL no puede estar vacía")
         
-        # Validar URL completamente
-        valida, resultado = await validar_url_completa(updates.target_url)
+        # Validar URL completamente (o solo el formato, en modo diferido)
+        valida, resultado, estado = await validar_para_guardar(updates.target_url)
         
         if not valida:
             raise HTTPException(status_code=400, detail=resultado)
@@ -474,52 +754,121 @@ async def update_url_endpoint(url_key: str, updates: schemas.URLUpdate, db: Sess
         # Si la validación devolvió la URL con protocolo, la actualizamos
         if isinstance(resultado, str) and resultado.startswith(('http://', 'https://')):
             updates.target_url = resultado
+        db_url.check_status = estado
 
-    return crud.update_url(db, db_url, updates)
+    canal_invalidacion.anotar(db, url_key)
+    db_url = await crud.update_url_async(db, db_url, updates)
+    cache_resolucion.invalidate(url_key)
+    if updates.target_url and db_url.check_status == ESTADO_PENDIENTE:
+        verificador_diferido.avisar()
+    return db_url
 
 @app.delete("/urls/{url_key}")
-def delete_url_endpoint(url_key: str, db: Session = Depends(get_db)):
+async def delete_url_endpoint(url_key: str, db: AsyncSession = Depends(get_async_db)):
     """Elimina una URL."""
-    db_url = crud.get_url_by_key(db, url_key)
+    db_url = await crud.get_url_by_key_async(db, url_key)
     if not db_url:
         raise HTTPException(status_code=404, detail="URL no encontrada")
     
-    crud.delete_url(db, db_url)
+    canal_invalidacion.anotar(db, url_key)
+    await crud.delete_url_async(db, db_url)
+    filtro_claves.eliminar(url_key)
+    cache_resolucion.invalidate(url_key)
     return {"detail": "URL eliminada correctamente"}
 
+@app.get("/urls/{url_key}/stats", response_model=schemas.URLStats)
+async def url_stats(
+    url_key: str,
+    desde: Optional[datetime] = Query(None, alias="from", description="Inicio del rango (por defecto, 30 días antes de 'to')"),
+    hasta: Optional[datetime] = Query(None, alias="to", description="Fin del rango, excluido (por defecto, ahora)"),
+    granularity: Literal["hour", "day"] = "day",
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Visitas de una URL por hora o por día, con reparto por referrer, navegador y país.
+
+    Solo lee las tablas de agregados, nunca los eventos individuales, así que
+    el coste no depende de cuántas visitas acumule el enlace.
+    """
+    if not await crud.get_url_by_key_async(db, url_key):
+        raise HTTPException(status_code=404, detail="URL no encontrada")
+
+    hasta = schemas.a_utc(hasta) if hasta else datetime.now(timezone.utc).replace(tzinfo=None)
+    desde = schemas.a_utc(desde) if desde else hasta - timedelta(days=30)
+    if desde >= hasta:
+        raise HTTPException(status_code=400, detail="'from' debe ser anterior a 'to'")
+
+    paso = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    if (hasta - desde) / paso > STATS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"El rango supera {STATS_MAX_BUCKETS} intervalos; usa granularity=day o acórtalo")
+
+    serie = await crud.get_click_series_async(db, url_key, desde, hasta, granularity)
+    reparto = await crud.get_click_breakdown_async(db, url_key, desde, hasta)
+
+    return schemas.URLStats(
+        key=url_key,
+        granularity=granularity,
+        start=desde,
+        end=hasta,
+        total=sum(clicks for _, clicks in serie),
+        series=[schemas.URLStatsBucket(bucket=bucket, clicks=clicks) for bucket, clicks in serie],
+        referrers=reparto["referrer"],
+        browsers=reparto["browser"],
+        countries=reparto["country"],
+    )
+
+# Debe declararse antes de /{url_key}, que si no capturaría "/metrics"
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(exportar_metricas(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/{url_key}")
-def forward_to_target_url(url_key: str, db: Session = Depends(get_db)):
-    """Redirige al enlace original."""
+async def forward_to_target_url(url_key: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Redirige al enlace original.
+
+    Normalmente estas peticiones las atiende antes el middleware
+    RedireccionRapida (redirect.py); esta ruta documenta el endpoint en
+    OpenAPI y lo sirve si REDIRECT_FAST_PATH=false, con el mismo resultado.
+    """
     if url_key == "static":
         return HTMLResponse(status_code=404)
 
-    db_url = crud.get_url_by_key(db, url_key)
+    # Camino rápido: las claves populares se resuelven desde memoria
+    resuelta = cache_resolucion.get(url_key)
+    if resuelta is None and await filtro_claves.puede_existir(url_key, db.bind):
+        db_url = await crud.get_url_by_key_async(db, url_key)
+        if db_url is None:
+            filtro_claves.registrar_falso_positivo()
+        else:
+            resuelta = URLResuelta(
+                db_url.target_url, db_url.is_active is not False,
+                db_url.redirect_type, db_url.updated_at or db_url.created_at,
+                instante(db_url.expires_at), db_url.max_clicks, db_url.clicks or 0,
+            )
+            cache_resolucion.set(url_key, *resuelta)
+
+    expirado = bool(resuelta and resuelta.is_active and caducado(url_key, resuelta))
+    if resuelta and resuelta.is_active and not expirado:
+        # La visita se acumula en memoria y se escribe por lotes en segundo plano
+        registrar_visita(
+            url_key,
+            request.headers.get("referer"),
+            request.headers.get("user-agent"),
+            request.client.host if request.client else None,
+        )
+        estado, cabeceras = politica(resuelta)
+        condicional = no_modificada(
+            resuelta, cabeceras, request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+        )
+        cabeceras = {nombre.decode(): valor.decode() for nombre, valor in cabeceras}
+        if condicional:
+            return Response(status_code=304, headers=cabeceras)
+        return RedirectResponse(resuelta.target_url, status_code=estado, headers=cabeceras)
 
-    if db_url:
-        db_url.clicks += 1
-        db.commit()
-        return RedirectResponse(db_url.target_url)
-    else:
-        # Error 404 Personalizado
-        html_error = f"""
-        <html>
-            <head>
-                <title>No encontrado</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <style>
-                    body {{ font-family: sans-serif; text-align: center; padding-top: 50px; background: #f9f9f9; }}
-                    h1 {{ color: #e74c3c; }}
-                    .btn {{ display: inline-block; margin-top: 20px; padding: 10px 20px; background: #6366f1; color: white; text-decoration: none; border-radius: 5px; }}
-                </style>
-            </head>
-            <body>
-                <h1>⚠️ Enlace no encontrado</h1>
-                <p>El código <strong>{url_key}</strong> no existe.</p>
-                <a href="/" class="btn">Crear nuevo</a>
-            </body>
-        </html>
-        """
-        return HTMLResponse(content=html_error, status_code=404)
+    # Enlace inexistente, desactivado o caducado: página de error pre-renderizada
+    return HTMLResponse(content=pagina_error(url_key, resuelta is None, expirado), status_code=410 if expirado else 404)
 
 # ==============================================================================
 # 7. ENDPOINTS DE DIAGNÓSTICO
@@ -533,8 +882,19 @@ def health_check():
         "version": "1.2.0",
         "features": {
             "url_validation": VALIDATE_URLS,
+            "dedup_targets": DEDUP_TARGETS,
             "max_url_length": MAX_URL_LENGTH
-        }
+        },
+        "cache": cache_resolucion.estadisticas(),
+        "dns_cache": cache_dns.estadisticas(),
+        "validation_cache": cache_validacion.estadisticas(),
+        "deferred_validation": {"enabled": DEFERRED_VALIDATION, **verificador_diferido.estadisticas()},
+        "key_generator": generador_claves.estadisticas(),
+        "analytics": registro_eventos.estadisticas(),
+        "invalidation": canal_invalidacion.estadisticas(),
+        "key_filter": filtro_claves.estadisticas(),
+        "rate_limit": limitador.estadisticas(),
+        "purge": purga_enlaces.estadisticas()
     }
 
 @app.post("/api/validate-url")
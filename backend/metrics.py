@@ -0,0 +1,246 @@
+import os
+import time
+from bisect import bisect_left
+from typing import Callable
+
+from sqlalchemy import event
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Permite desactivar toda la instrumentación (middleware y eventos de BD)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+
+# Las métricas son de cada proceso: con varios workers, cada petición a
+# /metrics la responde uno de ellos con sus propias cuentas. Esta opción
+# añade a todas las series la etiqueta worker="<pid>" para que el
+# recolector no mezcle las de procesos distintos (sumarlas con
+# 'sum without (worker)'). server.py la activa al lanzar más de un worker.
+METRICS_WORKER_LABEL = os.getenv("METRICS_WORKER_LABEL", "False").lower() == "true"
+
+# Límites de los histogramas de latencia (segundos). Fijos de antemano:
+# observar un valor es una búsqueda binaria y un incremento.
+BUCKETS_HTTP = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_DB = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BUCKETS_VALIDACION = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0)
+
+# ==============================================================================
+# 2. TIPOS DE MÉTRICA
+# ==============================================================================
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres: tuple[str, ...], valores: tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if METRICS_WORKER_LABEL:
+        # Al exportar y no al importar: con fork, el pid aún sería el del padre
+        partes.append(f'worker="{os.getpid()}"')
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series: dict[tuple, object] = {}
+        REGISTRO.append(self)
+
+    def _cabecera(self) -> list[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    """
+    Contador monótono por combinación de etiquetas.
+
+    Sin locks: en CPython un incremento concurrente desde otro hilo puede,
+    muy rara vez, perder una unidad. Es aceptable para métricas y evita
+    que la instrumentación compita con las peticiones.
+    """
+    tipo = "counter"
+
+    def inc(self, *valores, n: float = 1) -> None:
+        self._series[valores] = self._series.get(valores, 0) + n
+
+    def exportar(self) -> list[str]:
+        return self._cabecera() + [
+            f"{self.nombre}{_etiquetas(self.etiquetas, v)} {n}" for v, n in list(self._series.items())
+        ]
+
+
+class Indicador(Contador):
+    """Valor que sube y baja (ej: peticiones en curso)."""
+    tipo = "gauge"
+
+    def dec(self, *valores, n: float = 1) -> None:
+        self._series[valores] = self._series.get(valores, 0) - n
+
+
+class IndicadorFuncion(_Metrica):
+    """Indicador cuyo valor se calcula al exportar (ej: tamaño de una caché)."""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, funcion: Callable[[], float]):
+        super().__init__(nombre, ayuda)
+        self.funcion = funcion
+
+    def exportar(self) -> list[str]:
+        return self._cabecera() + [f"{self.nombre}{_etiquetas((), ())} {self.funcion()}"]
+
+
+class Histograma(_Metrica):
+    """
+    Histograma con límites fijos. Cada serie es una lista de contadores
+    (uno por intervalo más +Inf) y la suma al final; al exportar se
+    acumulan como exige el formato de Prometheus.
+    """
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = (), buckets: tuple = BUCKETS_HTTP):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor: float, *valores) -> None:
+        serie = self._series.get(valores)
+        if serie is None:
+            serie = self._series.setdefault(valores, [0] * (len(self.buckets) + 1) + [0.0])
+        serie[bisect_left(self.buckets, valor)] += 1
+        serie[-1] += valor
+
+    def exportar(self) -> list[str]:
+        lineas = self._cabecera()
+        for valores, serie in list(self._series.items()):
+            acumulado = 0
+            for limite, n in zip(self.buckets + (float("inf"),), serie[:-1]):
+                acumulado += n
+                le = "+Inf" if limite == float("inf") else repr(limite)
+                etiquetas = _etiquetas(self.etiquetas, valores, 'le="' + le + '"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {serie[-1]}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {acumulado}")
+        return lineas
+
+
+REGISTRO: list[_Metrica] = []
+
+
+def exportar() -> str:
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+    lineas: list[str] = []
+    for metrica in REGISTRO:
+        lineas.extend(metrica.exportar())
+    return "\n".join(lineas) + "\n"
+
+# ==============================================================================
+# 3. MÉTRICAS DE LA APLICACIÓN
+# ==============================================================================
+
+http_duracion = Histograma(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    ("method", "route", "status"), BUCKETS_HTTP,
+)
+http_en_curso = Indicador(
+    "http_requests_in_flight", "Peticiones HTTP en curso", ("method",),
+)
+db_duracion = Histograma(
+    "db_query_duration_seconds", "Duración de las consultas a la base de datos por tipo de sentencia",
+    ("engine", "statement"), BUCKETS_DB,
+)
+validacion_duracion = Histograma(
+    "url_validation_stage_seconds", "Duración de cada etapa de validación de URLs",
+    ("stage",), BUCKETS_VALIDACION,
+)
+validacion_fallos = Contador(
+    "url_validation_failures_total", "URLs rechazadas (o con advertencia) por etapa",
+    ("stage",),
+)
+peticiones_limitadas = Contador(
+    "http_requests_rate_limited_total", "Peticiones rechazadas con 429 por regla de límite",
+    ("rule",),
+)
+
+# ==============================================================================
+# 4. INSTRUMENTACIÓN
+# ==============================================================================
+
+class MedirPeticiones:
+    """
+    Middleware ASGI que mide cada petición HTTP.
+
+    Se escribe como ASGI puro (no BaseHTTPMiddleware) para no añadir tareas
+    ni copias del cuerpo. La ruta se etiqueta con su plantilla
+    ('/{url_key}', no '/abc12'), que FastAPI deja en scope['route'] al
+    enrutar, así que el número de series está acotado.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metodo = scope["method"]
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        http_en_curso.inc(metodo)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            http_en_curso.dec(metodo)
+            ruta = getattr(scope.get("route"), "path", None) or "<sin ruta>"
+            http_duracion.observe(time.perf_counter() - inicio, metodo, ruta, f"{estado // 100}xx")
+
+
+def _tipo_sentencia(sql: str) -> str:
+    palabra = sql.lstrip()[:6].upper()
+    return palabra if palabra in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+def instrumentar_engine(motor, nombre: str) -> None:
+    """
+    Mide la duración de cada sentencia con los eventos de SQLAlchemy.
+
+    Para el motor asíncrono se pasa async_engine.sync_engine. El inicio se
+    guarda en conn.info (una pila, por si hay sentencias anidadas).
+    """
+    @event.listens_for(motor, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+    @event.listens_for(motor, "after_cursor_execute")
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        inicio = conn.info["metricas_inicio"].pop()
+        db_duracion.observe(time.perf_counter() - inicio, nombre, _tipo_sentencia(statement))
+
+    @event.listens_for(motor, "handle_error")
+    def _error(contexto):
+        pila = contexto.connection.info.get("metricas_inicio") if contexto.connection is not None else None
+        if pila:
+            inicio = pila.pop()
+            db_duracion.observe(time.perf_counter() - inicio, nombre, "ERROR")
+
+
+def medir_etapa(etapa: str, inicio: float, ok: bool = True) -> None:
+    """Registra la duración de una etapa de validación iniciada en 'inicio' (perf_counter)."""
+    if not METRICS_ENABLED:
+        return
+    validacion_duracion.observe(time.perf_counter() - inicio, etapa)
+    if not ok:
+        validacion_fallos.inc(etapa)
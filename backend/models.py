@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, Index, PrimaryKeyConstraint, literal_column
 from sqlalchemy.sql import func
 from database import Base
 
@@ -13,26 +13,241 @@ class URLItem(Base):
     """
     __tablename__ = "urls"
 
+    # Índice compuesto para la paginación por cursor ordenando por fecha
+    # (el 'id' desempata y hace que el orden sea estable)
+    __table_args__ = (
+        Index("ix_urls_created_at_id", "created_at", "id"),
+        # Para que el verificador diferido reserve los pendientes por orden de id
+        Index("ix_urls_check_status_id", "check_status", "id"),
+    )
+
     # Identificador único
     id = Column(Integer, primary_key=True, index=True)
 
     # Datos principales
     # nullable=False asegura integridad a nivel de base de datos
-    target_url = Column(String, index=True, nullable=False) 
+    target_url = Column(String, nullable=False)
     key = Column(String, unique=True, index=True, nullable=False)
 
+    # Resumen del destino normalizado (validation.huella_destino): 32
+    # caracteres fijos. Es lo que se indexa para encontrar enlaces con el
+    # mismo destino, en vez de la URL entera (sin límite de longitud).
+    target_hash = Column(String(32), nullable=True, index=True)
+
     # Analytics y Control
     clicks = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)  # Permite desactivar links sin borrarlos
 
+    # Política de redirección: 'permanent' (301/308, cacheable mucho tiempo),
+    # 'temporary' (302/307, TTL corto) o NULL para usar la global
+    redirect_type = Column(String, nullable=True)
+
+    # Resultado de la comprobación de accesibilidad del destino:
+    # 'pending' (por comprobar), 'checking' (reservada por un worker), 'ok',
+    # 'unreachable' o NULL (no comprobado)
+    check_status = Column(String, nullable=True)
+    # Cuándo la reservó el worker (UTC); pasado un tiempo, otro la puede retomar
+    check_started_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Caducidad opcional: el enlace deja de redirigir (410) al llegar a
+    # 'expires_at' (UTC) o a 'max_clicks' visitas, y la purga lo borra después.
+    # Indexadas para que la purga encuentre los caducados sin recorrer la tabla.
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    max_clicks = Column(Integer, nullable=True, index=True)
+
     # Auditoría (Timestamps)
     # server_default=func.now() delega la hora a la DB, no a la aplicación,
     # lo cual es más preciso y evita problemas de zona horaria del servidor de Python.
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Última edición hecha por el usuario (destino, estado o política). No
+    # cambia con las visitas: es la base de ETag y Last-Modified de la redirección
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
 
     def __repr__(self):
         """
         Representación en string del objeto para depuración.
         Ayuda mucho cuando haces print(mi_objeto) en la consola.
         """
-        return f"<URLItem(key='{self.key}', target='{self.target_url}', active={self.is_active})>"
\ No newline at end of file
+        return f"<URLItem(key='{self.key}', target='{self.target_url}', active={self.is_active})>"
+
+
+# Visitas de un enlace para ordenar: las filas de versiones anteriores pueden
+# tener clicks NULL, que cuentan como 0 (un NULL no cumple ninguna comparación
+# del cursor y esas filas se saltarían). El 0 va literal, no como parámetro,
+# para que la consulta coincida con la expresión del índice.
+VISITAS = func.coalesce(URLItem.clicks, literal_column("0"))
+
+# Índice compuesto para la paginación por cursor ordenando por visitas
+# (el 'id' desempata y hace que el orden sea estable)
+Index("ix_urls_visitas_id", VISITAS, URLItem.id)
+
+
+class KeySequence(Base):
+    """
+    Contador persistente para generar claves cortas secuenciales.
+
+    Cada worker reserva un bloque de números de una vez (un UPDATE por
+    bloque) y los va consumiendo en memoria, así que crear un enlace no
+    necesita consultar la BD para buscar una clave libre.
+    """
+    __tablename__ = "key_sequences"
+
+    name = Column(String, primary_key=True)
+    next_value = Column(Integer, nullable=False, default=0)
+
+    # Clave de la permutación que desordena los números (se genera una vez
+    # al crear la fila; cambiarla con datos existentes provocaría colisiones)
+    secret = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f"<KeySequence(name='{self.name}', next_value={self.next_value})>"
+
+
+
+class ClickEvent(Base):
+    """
+    Registro de cada visita (tabla de solo inserción).
+
+    Se escribe por lotes desde analytics.py; las estadísticas no se leen
+    de aquí sino de las tablas de agregados, así que puede crecer sin
+    que las consultas de /urls/{key}/stats se vuelvan más lentas.
+    """
+    __tablename__ = "click_events"
+
+    __table_args__ = (
+        Index("ix_click_events_key_ts", "key", "ts"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)
+    ts = Column(DateTime, nullable=False)  # UTC
+    referrer = Column(String, nullable=True)
+    ua_family = Column(String, nullable=True)
+    country = Column(String, nullable=True)  # ISO 3166-1 alpha-2, si hay base GeoIP
+
+
+class ClickStatHourly(Base):
+    """Visitas por clave y hora (UTC), mantenidas por el escritor de eventos."""
+    __tablename__ = "click_stats_hourly"
+
+    __table_args__ = (
+        PrimaryKeyConstraint("key", "bucket"),
+    )
+
+    key = Column(String, nullable=False)
+    bucket = Column(DateTime, nullable=False)  # inicio de la hora
+    clicks = Column(Integer, nullable=False, default=0)
+
+
+class ClickStatDaily(Base):
+    """
+    Visitas por clave y día (UTC), desglosadas por dimensión.
+
+    dimension='total' (value='') guarda el total del día; 'referrer',
+    'browser' y 'country' guardan el reparto por dominio de origen,
+    familia de navegador y país.
+    """
+    __tablename__ = "click_stats_daily"
+
+    __table_args__ = (
+        PrimaryKeyConstraint("key", "bucket", "dimension", "value"),
+    )
+
+    key = Column(String, nullable=False)
+    bucket = Column(DateTime, nullable=False)  # inicio del día
+    dimension = Column(String, nullable=False)
+    value = Column(String, nullable=False, default="")
+    clicks = Column(Integer, nullable=False, default=0)
+
+
+
+class CacheInvalidation(Base):
+    """
+    Registro de claves modificadas o borradas, para avisar a los demás workers.
+
+    Cada proceso lee periódicamente las filas con id mayor que la última que
+    vio e invalida esas claves en su caché local (ver invalidation.py).
+    """
+    __tablename__ = "cache_invalidations"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)  # UTC
+
+
+class ImportJob(Base):
+    """
+    Progreso de una importación masiva (ver importer.py).
+
+    Se actualiza en la misma transacción que cada lote insertado, así que
+    'offset' apunta siempre al primer registro que aún no está en la BD y
+    una importación interrumpida se reanuda desde ahí.
+    """
+    __tablename__ = "import_jobs"
+
+    name = Column(String, primary_key=True)
+    source = Column(String, nullable=False)
+    format = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="running")  # running, done, failed
+    offset = Column(Integer, nullable=False, default=0)  # bytes leídos del fichero
+    records = Column(Integer, nullable=False, default=0)  # registros procesados
+    imported = Column(Integer, nullable=False, default=0)
+    conflicts = Column(Integer, nullable=False, default=0)
+    invalid = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=False)  # UTC
+    updated_at = Column(DateTime, nullable=False)  # UTC
+
+
+class SummaryCounter(Base):
+    """
+    Contadores globales del panel de administración ('links',
+    'active_links', 'clicks').
+
+    Se actualizan con 'value = value + :delta' en la misma transacción que
+    cada alta, edición, borrado o volcado de visitas, así que el resumen
+    no necesita recorrer la tabla 'urls'.
+    """
+    __tablename__ = "summary_counters"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class RateLimitBucket(Base):
+    """
+    Cubo de fichas de un cliente en una regla de límite de peticiones.
+
+    Solo se usa con RATE_LIMIT_BACKEND=database, para que todos los workers
+    compartan los mismos cubos (ver ratelimit.py). 'updated_at' es un
+    instante Unix en segundos.
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)
+
+
+class URLArchive(Base):
+    """
+    Enlaces caducados que la purga ha sacado de 'urls' (PURGE_ACTION=archive).
+
+    Conserva las columnas del enlace y su id original; la tabla 'urls' y
+    sus índices se mantienen pequeños.
+    """
+    __tablename__ = "urls_archive"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False, index=True)
+    target_url = Column(String, nullable=False)
+    target_hash = Column(String(32), nullable=True)
+    clicks = Column(Integer, nullable=True)
+    is_active = Column(Boolean, nullable=True)
+    redirect_type = Column(String, nullable=True)
+    check_status = Column(String, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    max_clicks = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime, nullable=False)  # UTC
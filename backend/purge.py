@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import crud
+from cache import cache_resolucion
+from database import SessionLocal
+from invalidation import canal_invalidacion
+from keyfilter import filtro_claves
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Activa la purga periódica de enlaces caducados (expires_at / max_clicks)
+PURGE_ENABLED = os.getenv("PURGE_ENABLED", "True").lower() == "true"
+
+# Cada cuántos segundos se ejecuta la purga
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "3600"))
+
+# Enlaces por lote. Cada lote es una transacción corta: en SQLite el
+# bloqueo de escritura se suelta entre lotes y las visitas y altas no esperan
+# a que termine toda la purga.
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+
+# Pausa entre lotes (segundos), para que otras escrituras tomen el bloqueo
+PURGE_BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE", "0.05"))
+
+# Máximo de lotes por ejecución; lo que quede se purga en la siguiente
+PURGE_MAX_BATCHES = int(os.getenv("PURGE_MAX_BATCHES", "1000"))
+
+# 'delete' borra los enlaces caducados; 'archive' los mueve a urls_archive
+PURGE_ACTION = os.getenv("PURGE_ACTION", "delete").lower()
+
+# Páginas libres que devuelve al disco cada ejecución en SQLite (0 = todas)
+PURGE_VACUUM_PAGES = int(os.getenv("PURGE_VACUUM_PAGES", "0"))
+
+if PURGE_ACTION not in ("delete", "archive"):
+    raise ValueError(f"PURGE_ACTION no válido: {PURGE_ACTION!r} (use 'delete' o 'archive')")
+
+# ==============================================================================
+# 2. COMPACTACIÓN
+# ==============================================================================
+
+def compactar(engine: Engine, paginas: int = PURGE_VACUUM_PAGES) -> dict:
+    """
+    Devuelve al disco el espacio liberado y actualiza las estadísticas del
+    planificador de la tabla de enlaces.
+
+    SQLite: 'PRAGMA incremental_vacuum' solo libera páginas si la base de
+    datos se creó con auto_vacuum=INCREMENTAL (database.actualizar_esquema
+    lo activa en las nuevas; en una existente hace falta un VACUUM manual
+    una vez). Es incremental: no reescribe el fichero entero como VACUUM.
+    ANALYZE se limita con analysis_limit para que sea rápido en tablas grandes.
+    PostgreSQL: VACUUM (ANALYZE), que no bloquea lecturas ni escrituras.
+    """
+    informe = {"freed_pages": None, "vacuum_ms": 0.0, "analyze_ms": 0.0}
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "sqlite":
+            inicio = time.perf_counter()
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+                libres = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+                # Cada paso del pragma libera una página y execute() solo da
+                # uno; executescript lo ejecuta hasta el final
+                conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(paginas)})")
+                informe["freed_pages"] = libres - conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            informe["vacuum_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+
+            inicio = time.perf_counter()
+            conn.exec_driver_sql("PRAGMA analysis_limit=1000")
+            conn.exec_driver_sql("ANALYZE urls")
+            informe["analyze_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+        elif engine.dialect.name == "postgresql":
+            inicio = time.perf_counter()
+            conn.exec_driver_sql("VACUUM (ANALYZE) urls")
+            informe["vacuum_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+    return informe
+
+# ==============================================================================
+# 3. PURGA POR LOTES
+# ==============================================================================
+
+class PurgaEnlaces:
+    """
+    Borra (o archiva) periódicamente los enlaces caducados, por lotes.
+
+    Cada lote borra hasta 'batch_size' enlaces y anota sus invalidaciones en
+    una misma transacción; después se quitan de la caché y del filtro de
+    claves de este proceso. Entre lote y lote hay una pausa para no acaparar
+    la base de datos. Al terminar, si se borró algo, se compacta (ver
+    compactar). Cada ejecución deja un informe con los enlaces purgados y el
+    tiempo de cada lote.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        interval: float = PURGE_INTERVAL,
+        batch_size: int = PURGE_BATCH_SIZE,
+        pause: float = PURGE_BATCH_PAUSE,
+        max_batches: int = PURGE_MAX_BATCHES,
+        action: str = PURGE_ACTION,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_batches = max_batches
+        self.action = action
+        self.ejecuciones = 0
+        self.total_purgados = 0
+        self.ultimo_informe: Optional[dict] = None
+        # Una sola ejecución a la vez (hilo de fondo o endpoint de admin)
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def ejecutar(self, session_factory: Optional[Callable[[], Session]] = None) -> dict:
+        """Purga los enlaces caducados hasta ahora, compacta y devuelve el informe."""
+        with self._lock:
+            inicio = time.perf_counter()
+            # UTC sin zona, como se guardan las fechas (schemas.FechaUTC)
+            ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+            tiempos: list[float] = []
+            purgados = 0
+            compactacion = {}
+
+            db = (session_factory or self.session_factory)()
+            try:
+                for _ in range(self.max_batches):
+                    t0 = time.perf_counter()
+                    claves = crud.purge_expired_urls(db, ahora, limit=self.batch_size,
+                                                     archive=self.action == "archive")
+                    for key in claves:
+                        canal_invalidacion.anotar(db, key)
+                    db.commit()
+                    if not claves:
+                        break
+                    tiempos.append(round((time.perf_counter() - t0) * 1000, 2))
+                    purgados += len(claves)
+                    for key in claves:
+                        cache_resolucion.invalidate(key)
+                        filtro_claves.eliminar(key)
+                    if len(claves) < self.batch_size or self._parar.is_set():
+                        break
+                    time.sleep(self.pause)
+
+                if purgados:
+                    compactacion = compactar(db.get_bind())
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            informe = {
+                "started_at": ahora.isoformat(),
+                "action": self.action,
+                "purged": purgados,
+                "batches": len(tiempos),
+                "batch_ms": tiempos,
+                "batch_ms_avg": round(sum(tiempos) / len(tiempos), 2) if tiempos else 0.0,
+                "batch_ms_max": max(tiempos, default=0.0),
+                **compactacion,
+                "total_ms": round((time.perf_counter() - inicio) * 1000, 2),
+            }
+            self.ejecuciones += 1
+            self.total_purgados += purgados
+            self.ultimo_informe = informe
+
+        if purgados:
+            print(f"Purga: {purgados} enlaces ({self.action}) en {len(tiempos)} lotes, "
+                  f"{informe['batch_ms_avg']} ms/lote de media, máx. {informe['batch_ms_max']} ms, "
+                  f"total {informe['total_ms']} ms")
+        return informe
+
+    def _bucle(self) -> None:
+        """Hilo de fondo: una ejecución cada 'interval' segundos."""
+        while not self._parar.wait(self.interval):
+            try:
+                self.ejecutar()
+            except Exception as e:
+                print(f"Error purgando enlaces caducados: {e}")
+
+    def start(self) -> None:
+        """Arranca el hilo de purga (se llama al iniciar la aplicación)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="link-purger", daemon=True)
+        self._hilo.start()
+
+    def stop(self) -> None:
+        """Detiene el hilo; una ejecución en curso termina tras su lote actual."""
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join(timeout=30)
+            self._hilo = None
+
+    def estadisticas(self) -> dict:
+        return {
+            "enabled": PURGE_ENABLED,
+            "action": self.action,
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "runs": self.ejecuciones,
+            "purged_total": self.total_purgados,
+            "last_run": None if self.ultimo_informe is None else {
+                k: v for k, v in self.ultimo_informe.items() if k != "batch_ms"
+            },
+        }
+
+
+# Instancia compartida por toda la aplicación
+purga_enlaces = PurgaEnlaces()
@@ -0,0 +1,416 @@
+import os
+import json
+import math
+import time
+from abc import ABC, abstractmethod
+from itertools import islice
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy import select, update, insert, delete, case, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import models
+from database import async_engine
+from metrics import METRICS_ENABLED, peticiones_limitadas
+from redirect import segmentos_reservados
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Límite de peticiones por IP de cliente (responde 429 con Retry-After).
+# Desactivado por defecto: detrás de un proxy todas las peticiones llegan con
+# la IP del proxy y compartirían un solo cubo; en ese caso actívelo junto con
+# RATE_LIMIT_TRUST_FORWARDED.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "False").lower() == "true"
+
+# Límite de cada grupo de rutas como "peticiones/segundos": un cubo de
+# 'peticiones' fichas por cliente que se rellena entero en 'segundos'.
+# Admite ráfagas de ese tamaño y, sostenido, peticiones/segundos por segundo.
+# "0" desactiva el grupo.
+#   create:   POST /url y /api/validate-url (consultas DNS y HTTP salientes).
+#   bulk:     POST /urls/bulk, una ficha por URL del lote. Va en un cubo aparte
+#             para que un lote no deje al cliente sin poder crear enlaces sueltos.
+#   redirect: GET/HEAD /{url_key}
+RATE_LIMIT_CREATE = os.getenv("RATE_LIMIT_CREATE", "30/60")
+RATE_LIMIT_BULK = os.getenv("RATE_LIMIT_BULK", "20000/3600")
+RATE_LIMIT_REDIRECT = os.getenv("RATE_LIMIT_REDIRECT", "600/60")
+
+# Dónde se guardan los cubos:
+# 'memory': en este proceso (con varios workers, cada uno lleva su cuenta).
+# 'database': en la tabla rate_limit_buckets, compartidos por todos los
+# workers. Cuesta una escritura en la BD por petición limitada.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+
+# Máximo de cubos en memoria (~200 bytes cada uno). Al llegar al máximo se
+# olvidan los clientes que llevan más tiempo sin pedir nada.
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+# Cada cuántos segundos se borran los cubos que ya se han rellenado (un
+# cubo lleno equivale a no tenerlo)
+RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60"))
+
+# Tomar la IP del cliente de X-Forwarded-For. Solo detrás de un proxy que
+# fije esa cabecera: si no, cada cliente podría elegir su propia IP.
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "False").lower() == "true"
+
+if RATE_LIMIT_BACKEND not in ("memory", "database"):
+    raise ValueError("RATE_LIMIT_BACKEND debe ser 'memory' o 'database'")
+
+# Rutas POST que disparan la validación de URLs
+RUTAS_CREACION = frozenset({"/url", "/api/validate-url"})
+RUTA_LOTES = "/urls/bulk"
+
+
+class Regla(NamedTuple):
+    """Cubo de 'capacidad' fichas que recupera 'tasa' fichas por segundo."""
+    capacidad: float
+    tasa: float
+
+    @classmethod
+    def desde_texto(cls, texto: str) -> Optional["Regla"]:
+        """'30/60' -> 30 peticiones cada 60 segundos; '0' o '' -> sin límite."""
+        texto = texto.strip()
+        if texto in ("", "0"):
+            return None
+        peticiones, _, segundos = texto.partition("/")
+        peticiones, segundos = float(peticiones), float(segundos or 1)
+        if peticiones < 1 or segundos <= 0:
+            raise ValueError(f"Límite no válido: {texto!r} (formato 'peticiones/segundos')")
+        return cls(peticiones, peticiones / segundos)
+
+# ==============================================================================
+# 2. ALMACENES DE CUBOS
+# ==============================================================================
+
+class AlmacenCubos(ABC):
+    """
+    Interfaz de los almacenes de cubos.
+
+    Para compartir los límites entre workers con otro servicio (ej: Redis)
+    basta con implementar 'consumir' y asignar la instancia a
+    limitador.almacen.
+    """
+    nombre = ""
+
+    @abstractmethod
+    async def consumir(self, regla: str, cliente: str, capacidad: float, tasa: float, coste: float = 1) -> float:
+        """
+        Gasta 'coste' fichas del cubo (regla, cliente). Devuelve 0 si había
+        al menos una, o los segundos que faltan para la siguiente.
+
+        Basta una ficha para pasar aunque el coste sea mayor: el cubo queda
+        en negativo y el cliente espera a saldar la deuda. Así un lote más
+        grande que el cubo no se rechaza siempre. La deuda no pasa de
+        'capacidad' fichas: como mucho se espera lo que tardan en rellenarse
+        dos cubos.
+        """
+        raise NotImplementedError
+
+    def estadisticas(self) -> dict:
+        return {}
+
+
+class AlmacenMemoria(AlmacenCubos):
+    """
+    Cubos en un dict por regla: IP -> [fichas, instante de la última petición].
+
+    El dict se mantiene en orden de uso (cada petición mueve su cliente al
+    final), así que cuando no caben más se descartan los primeros. El
+    barrido periódico quita los cubos que ya estarían llenos, que son casi
+    todos los de clientes que no abusan.
+    """
+    nombre = "memory"
+
+    def __init__(self, max_cubos: int = RATE_LIMIT_MAX_CLIENTS,
+                 intervalo_barrido: float = RATE_LIMIT_SWEEP_INTERVAL,
+                 reloj: Callable[[], float] = time.monotonic):
+        self.max_cubos = max_cubos
+        self.intervalo_barrido = intervalo_barrido
+        self.reloj = reloj
+        self._cubos: dict[str, dict[str, list]] = {}
+        self._limites: dict[str, tuple[float, float]] = {}
+        self._proximo_barrido = reloj() + intervalo_barrido
+        self.barridos = 0
+        self.descartados = 0
+
+    def __len__(self) -> int:
+        return sum(len(cubos) for cubos in self._cubos.values())
+
+    async def consumir(self, regla: str, cliente: str, capacidad: float, tasa: float, coste: float = 1) -> float:
+        ahora = self.reloj()
+        if ahora >= self._proximo_barrido:
+            self.barrer(ahora)
+
+        cubos = self._cubos.get(regla)
+        if cubos is None:
+            cubos = self._cubos[regla] = {}
+            self._limites[regla] = (capacidad, tasa)
+
+        cubo = cubos.pop(cliente, None)
+        if cubo is None:
+            if len(self) >= self.max_cubos:
+                self._hacer_sitio(ahora)
+            cubos[cliente] = [max(capacidad - coste, -capacidad), ahora]
+            return 0.0
+        cubos[cliente] = cubo
+
+        fichas = min(capacidad, cubo[0] + (ahora - cubo[1]) * tasa)
+        cubo[1] = ahora
+        if fichas >= 1:
+            cubo[0] = max(fichas - coste, -capacidad)
+            return 0.0
+        cubo[0] = fichas
+        return (1 - fichas) / tasa
+
+    def barrer(self, ahora: Optional[float] = None) -> int:
+        """Borra los cubos que ya se han rellenado. Devuelve cuántos."""
+        ahora = self.reloj() if ahora is None else ahora
+        borrados = 0
+        for regla, cubos in self._cubos.items():
+            capacidad, tasa = self._limites[regla]
+            llenos = [cliente for cliente, (fichas, instante) in cubos.items()
+                      if instante + (capacidad - fichas) / tasa <= ahora]
+            for cliente in llenos:
+                del cubos[cliente]
+            borrados += len(llenos)
+        self._proximo_barrido = ahora + self.intervalo_barrido
+        self.barridos += 1
+        return borrados
+
+    def _hacer_sitio(self, ahora: float) -> None:
+        self.barrer(ahora)
+        exceso = len(self) - self.max_cubos + max(1, self.max_cubos // 10)
+        if exceso <= 0:
+            return
+        # Los que llevan más tiempo sin pedir nada, de la regla con más cubos
+        cubos = max(self._cubos.values(), key=len)
+        viejos = list(islice(cubos, exceso))
+        for cliente in viejos:
+            del cubos[cliente]
+        self.descartados += len(viejos)
+
+    def estadisticas(self) -> dict:
+        return {
+            "clients": len(self),
+            "max_clients": self.max_cubos,
+            "sweeps": self.barridos,
+            "evicted": self.descartados,
+        }
+
+
+_tabla_cubos = models.RateLimitBucket.__table__
+_fichas_ahora = _tabla_cubos.c.tokens + (bindparam("ahora") - _tabla_cubos.c.updated_at) * bindparam("tasa")
+_fichas_disponibles = case((_fichas_ahora > bindparam("capacidad"), bindparam("capacidad")), else_=_fichas_ahora)
+_fichas_restantes = case(
+    (_fichas_disponibles - bindparam("coste") < -bindparam("capacidad"), -bindparam("capacidad")),
+    else_=_fichas_disponibles - bindparam("coste"),
+)
+
+# Gasta 'coste' fichas solo si queda alguna: la comprobación y la escritura
+# son una única sentencia, así que dos workers no pueden gastar la misma ficha
+_GASTAR = (
+    update(_tabla_cubos)
+    .where(_tabla_cubos.c.key == bindparam("clave"), _fichas_disponibles >= 1)
+    .values(tokens=_fichas_restantes, updated_at=bindparam("ahora"))
+)
+_LEER = select(_tabla_cubos.c.tokens, _tabla_cubos.c.updated_at).where(_tabla_cubos.c.key == bindparam("clave"))
+
+
+class AlmacenBD(AlmacenCubos):
+    """
+    Cubos en la tabla rate_limit_buckets, compartidos por todos los workers.
+
+    Usa el reloj del sistema (time.time), común a todos los procesos. Las
+    filas que no se tocan en 'retencion' segundos (el cubo ya estaría
+    lleno) se borran cada 'intervalo_barrido'.
+    """
+    nombre = "database"
+
+    def __init__(self, engine: AsyncEngine = async_engine, retencion: float = 3600,
+                 intervalo_barrido: float = RATE_LIMIT_SWEEP_INTERVAL):
+        self.engine = engine
+        self.retencion = retencion
+        self.intervalo_barrido = intervalo_barrido
+        self._proximo_barrido = time.time() + intervalo_barrido
+        self.barridos = 0
+
+    async def consumir(self, regla: str, cliente: str, capacidad: float, tasa: float, coste: float = 1) -> float:
+        ahora = time.time()
+        if ahora >= self._proximo_barrido:
+            await self.barrer(ahora)
+
+        clave = f"{regla}:{cliente}"
+        try:
+            async with self.engine.begin() as conn:
+                gastada = await conn.execute(_GASTAR, {
+                    "clave": clave, "ahora": ahora, "tasa": tasa, "capacidad": capacidad, "coste": coste,
+                })
+                if gastada.rowcount:
+                    return 0.0
+                fila = (await conn.execute(_LEER, {"clave": clave})).first()
+                if fila is None:
+                    await conn.execute(insert(_tabla_cubos).values(
+                        key=clave, tokens=max(capacidad - coste, -capacidad), updated_at=ahora,
+                    ))
+                    return 0.0
+        except IntegrityError:
+            # Otro worker creó el mismo cubo a la vez: esta petición pasa
+            return 0.0
+
+        fichas = min(capacidad, fila.tokens + (ahora - fila.updated_at) * tasa)
+        return max(0.0, (1 - fichas) / tasa)
+
+    async def barrer(self, ahora: Optional[float] = None) -> None:
+        ahora = time.time() if ahora is None else ahora
+        self._proximo_barrido = ahora + self.intervalo_barrido
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(_tabla_cubos).where(_tabla_cubos.c.updated_at < ahora - self.retencion))
+        self.barridos += 1
+
+    def estadisticas(self) -> dict:
+        return {"retention_seconds": self.retencion, "sweeps": self.barridos}
+
+# ==============================================================================
+# 3. LIMITADOR Y MIDDLEWARE ASGI
+# ==============================================================================
+
+class LimitadorPeticiones:
+    """
+    Aplica las reglas a cada cliente con el almacén configurado.
+
+    Si el almacén falla (ej: la BD no responde) la petición pasa: el
+    límite protege el servicio, no debe tumbarlo.
+    """
+
+    def __init__(self, reglas: dict[str, Optional[Regla]], almacen: AlmacenCubos):
+        self.reglas = {nombre: regla for nombre, regla in reglas.items() if regla is not None}
+        self.almacen = almacen
+        self.rechazadas = dict.fromkeys(self.reglas, 0)
+        self.errores = 0
+
+    async def comprobar(self, regla: str, cliente: str, coste: float = 1) -> float:
+        """0 si la petición puede pasar (y gasta 'coste' fichas); si no, segundos hasta que pueda."""
+        limite = self.reglas.get(regla)
+        if limite is None:
+            return 0.0
+        try:
+            espera = await self.almacen.consumir(regla, cliente, limite.capacidad, limite.tasa, coste)
+        except Exception as e:
+            self.errores += 1
+            print(f"Error en el límite de peticiones: {e}")
+            return 0.0
+        if espera > 0:
+            self.rechazadas[regla] += 1
+            if METRICS_ENABLED:
+                peticiones_limitadas.inc(regla)
+        return espera
+
+    def estadisticas(self) -> dict:
+        """Reglas, rechazos y estado del almacén para /api/health."""
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "backend": self.almacen.nombre,
+            "rules": {
+                nombre: {"requests": regla.capacidad, "per_seconds": round(regla.capacidad / regla.tasa, 3)}
+                for nombre, regla in self.reglas.items()
+            },
+            "rejected": dict(self.rechazadas),
+            "errors": self.errores,
+            **self.almacen.estadisticas(),
+        }
+
+
+def ip_cliente(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for nombre, valor in scope["headers"]:
+            if nombre == b"x-forwarded-for":
+                return valor.decode("latin-1").split(",")[0].strip()
+    cliente = scope.get("client")
+    return cliente[0] if cliente else "-"
+
+
+class LimitarPeticiones:
+    """
+    Middleware ASGI que limita la creación de enlaces y las redirecciones
+    por IP de cliente.
+
+    Va por fuera del camino rápido de redirección (RedireccionRapida) y por
+    dentro de CORS, para que el navegador pueda leer el 429. El resto de
+    rutas pasa sin consultar el almacén.
+
+    /urls/bulk gasta aquí una ficha de la regla 'bulk'; el resto del lote
+    lo cobra create_urls_bulk cuando sabe cuántas URLs trae (ver cobrar_lote).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._reservadas: Optional[frozenset] = None
+
+    def _regla(self, scope) -> Optional[str]:
+        metodo = scope["method"]
+        if metodo == "POST":
+            if scope["path"] == RUTA_LOTES:
+                return "bulk"
+            return "create" if scope["path"] in RUTAS_CREACION else None
+        if metodo in ("GET", "HEAD"):
+            if self._reservadas is None:
+                self._reservadas = segmentos_reservados(scope["app"].routes)
+            url_key = scope["path"][1:]
+            if url_key and "/" not in url_key and url_key not in self._reservadas:
+                return "redirect"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not RATE_LIMIT_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        regla = self._regla(scope)
+        espera = await limitador.comprobar(regla, ip_cliente(scope)) if regla else 0.0
+        if espera <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        segundos = max(1, math.ceil(espera))
+        cuerpo = json.dumps({"detail": f"Demasiadas peticiones. Vuelve a intentarlo en {segundos} s."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(cuerpo)).encode()),
+                (b"retry-after", str(segundos).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": cuerpo})
+
+
+async def cobrar_lote(scope, urls: int) -> float:
+    """
+    Cobra a un lote de 'urls' URLs las fichas que faltan: el middleware
+    ya gastó una al recibir la petición. 0 si puede seguir; si no,
+    segundos hasta que pueda.
+    """
+    if not RATE_LIMIT_ENABLED or urls <= 1:
+        return 0.0
+    return await limitador.comprobar("bulk", ip_cliente(scope), coste=urls - 1)
+
+
+def _crear_limitador() -> LimitadorPeticiones:
+    reglas = {
+        "create": Regla.desde_texto(RATE_LIMIT_CREATE),
+        "bulk": Regla.desde_texto(RATE_LIMIT_BULK),
+        "redirect": Regla.desde_texto(RATE_LIMIT_REDIRECT),
+    }
+    if RATE_LIMIT_BACKEND == "database":
+        # Una fila sin tocar en lo que tarda en rellenarse el cubo más lento
+        # (con la deuda máxima, dos cubos) ya no hace falta
+        retencion = max((2 * r.capacidad / r.tasa for r in reglas.values() if r is not None), default=3600)
+        return LimitadorPeticiones(reglas, AlmacenBD(retencion=retencion))
+    return LimitadorPeticiones(reglas, AlmacenMemoria())
+
+
+# Instancia compartida por toda la aplicación
+limitador = _crear_limitador()
@@ -0,0 +1,186 @@
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+from database import AsyncSessionLocal
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Número de tareas que comprueban destinos en paralelo
+DEFERRED_WORKERS = int(os.getenv("DEFERRED_WORKERS", "4"))
+
+# Enlaces pendientes que reserva cada worker de una vez (por orden de id)
+DEFERRED_BATCH_SIZE = int(os.getenv("DEFERRED_BATCH_SIZE", "100"))
+
+# Cada cuántos segundos se buscan pendientes sin que nadie avise (ej: los
+# que deja el importador con --defer-check o los que creó otro worker)
+DEFERRED_POLL_INTERVAL = float(os.getenv("DEFERRED_POLL_INTERVAL", "30"))
+
+# Segundos tras los que una comprobación reservada y sin terminar (worker
+# caído) se puede volver a reservar
+DEFERRED_CLAIM_TIMEOUT = float(os.getenv("DEFERRED_CLAIM_TIMEOUT", "600"))
+
+# Valores de la columna URLItem.check_status
+ESTADO_PENDIENTE = "pending"
+ESTADO_COMPROBANDO = "checking"
+ESTADO_OK = "ok"
+ESTADO_INACCESIBLE = "unreachable"
+
+Comprobador = Callable[[str], Awaitable[tuple[bool, str]]]
+
+# ==============================================================================
+# 2. VERIFICADOR EN SEGUNDO PLANO
+# ==============================================================================
+
+class VerificadorDiferido:
+    """
+    Comprobaciones de accesibilidad que se ejecutan fuera de la petición.
+
+    Al crear un enlace en modo diferido solo se hacen las validaciones baratas
+    (formato y dominio) y el enlace se guarda con check_status='pending'.
+    La base de datos es la cola: una tarea de fondo reserva pendientes por
+    lotes (crud.claim_pending_checks_async, que los pasa a 'checking') y unas
+    pocas tareas comprueban DNS y HEAD/GET y guardan 'ok' o 'unreachable'.
+    Como cada fila la reserva un solo worker, con varios procesos ningún
+    destino se comprueba dos veces, y una importación grande se termina de
+    comprobar por lotes aunque no quepa en memoria.
+
+    Quien crea un pendiente llama a avisar() para que se reserve sin esperar
+    al siguiente sondeo.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        workers: int = DEFERRED_WORKERS,
+        batch_size: int = DEFERRED_BATCH_SIZE,
+        poll_interval: float = DEFERRED_POLL_INTERVAL,
+        claim_timeout: float = DEFERRED_CLAIM_TIMEOUT,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.comprobar: Optional[Comprobador] = None
+        self._cola: Optional[asyncio.Queue] = None
+        self._aviso: Optional[asyncio.Event] = None
+        self._tareas: list[asyncio.Task] = []
+        # Claves que un trabajador está comprobando ahora mismo
+        self._en_curso: set[str] = set()
+        self.reservadas = 0
+        self.procesadas = 0
+
+    async def start(self, comprobar: Comprobador) -> None:
+        """Arranca las tareas de fondo; la primera reserva recoge lo que quedó pendiente."""
+        self.comprobar = comprobar
+        self._cola = asyncio.Queue()
+        self._aviso = asyncio.Event()
+        self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.workers)]
+        self._tareas.append(asyncio.create_task(self._reservar_en_bucle()))
+
+    async def stop(self) -> None:
+        """Detiene las tareas y devuelve a 'pending' lo reservado que no se comprobó."""
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+        # Las interrumpidas a medias también (si ya se guardó su resultado
+        # han dejado de estar en 'checking' y no se tocan)
+        sin_hacer = list(self._en_curso)
+        self._en_curso.clear()
+        while self._cola is not None and not self._cola.empty():
+            sin_hacer.append(self._cola.get_nowait()[0])
+        self._cola = None
+        self._aviso = None
+        if sin_hacer:
+            try:
+                async with self.session_factory() as db:
+                    await crud.release_checks_async(db, sin_hacer)
+            except Exception as e:
+                # Las retomará otro worker pasado DEFERRED_CLAIM_TIMEOUT
+                print(f"Error liberando comprobaciones pendientes: {e}")
+
+    def avisar(self) -> None:
+        """Hay pendientes nuevos en la BD: reservarlos sin esperar al sondeo."""
+        if self._aviso is not None:
+            self._aviso.set()
+
+    async def reservar(self) -> int:
+        """Reserva un lote de pendientes y lo pone en la cola. Devuelve cuántos."""
+        ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with self.session_factory() as db:
+            filas = await crud.claim_pending_checks_async(
+                db, self.batch_size, ahora, ahora - timedelta(seconds=self.claim_timeout)
+            )
+        for fila in filas:
+            self._cola.put_nowait(fila)
+        self.reservadas += len(filas)
+        return len(filas)
+
+    async def _reservar_en_bucle(self) -> None:
+        """
+        Mantiene la cola con trabajo: reserva otro lote cuando queda menos de
+        uno, y si no hay pendientes espera un aviso o el siguiente sondeo.
+        Lo reservado y aún en cola no pasa de dos lotes, así que se comprueba
+        mucho antes de que otro worker lo pueda retomar.
+        """
+        while True:
+            self._aviso.clear()
+            reservadas = 0
+            if self._cola.qsize() < self.batch_size:
+                try:
+                    reservadas = await self.reservar()
+                except Exception as e:
+                    print(f"Error reservando comprobaciones pendientes: {e}")
+            if reservadas < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._aviso.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def procesar(self, key: str, target_url: str) -> str:
+        """Comprueba un destino y guarda el estado resultante. Devuelve el estado."""
+        accesible, mensaje = await self.comprobar(target_url)
+        estado = ESTADO_OK if accesible else ESTADO_INACCESIBLE
+        if not accesible:
+            print(f"Advertencia ({key}): {mensaje}")
+
+        async with self.session_factory() as db:
+            await crud.set_check_status_async(db, key, target_url, estado)
+        self.procesadas += 1
+        return estado
+
+    async def _trabajador(self) -> None:
+        while True:
+            key, target_url = await self._cola.get()
+            if self._cola.empty():
+                # Queda poco trabajo: que se reserve el siguiente lote
+                self._aviso.set()
+            self._en_curso.add(key)
+            try:
+                await self.procesar(key, target_url)
+            except Exception as e:
+                print(f"Error comprobando {target_url}: {e}")
+            finally:
+                self._en_curso.discard(key)
+                self._cola.task_done()
+
+    def estadisticas(self) -> dict:
+        """Resumen para el endpoint de diagnóstico."""
+        return {
+            "queued": self._cola.qsize() if self._cola is not None else 0,
+            "claimed": self.reservadas,
+            "processed": self.procesadas,
+        }
+
+
+# Instancia compartida por toda la aplicación
+verificador_diferido = VerificadorDiferido()
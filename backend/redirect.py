@@ -0,0 +1,338 @@
+import os
+import html
+import hashlib
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import quote
+
+from sqlalchemy import select, bindparam, func
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import models
+from analytics import registro_eventos, ANALYTICS_ENABLED
+from cache import cache_resolucion, URLResuelta
+from clicks import acumulador_clicks
+from database import async_engine
+from keyfilter import filtro_claves
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+# Desactiva el camino rápido (las redirecciones vuelven a pasar por la ruta
+# FastAPI /{url_key}, con el mismo comportamiento pero más lenta)
+REDIRECT_FAST_PATH = os.getenv("REDIRECT_FAST_PATH", "True").lower() == "true"
+
+# Política por defecto para los enlaces sin una propia (redirect_type NULL):
+# 'temporary' (editable, TTL corto) o 'permanent' (inmutable, cacheable)
+REDIRECT_DEFAULT_TYPE = os.getenv("REDIRECT_DEFAULT_TYPE", "temporary").lower()
+
+# Código HTTP de cada política: 301 o 308 para permanentes, 302 o 307 para
+# temporales (308/307 conservan el método y el cuerpo de la petición)
+REDIRECT_PERMANENT_STATUS = int(os.getenv("REDIRECT_PERMANENT_STATUS", "301"))
+REDIRECT_TEMPORARY_STATUS = int(os.getenv("REDIRECT_TEMPORARY_STATUS", "307"))
+
+# Cuánto pueden cachear navegadores y CDN cada tipo de redirección (segundos).
+# Un 301 cacheado no vuelve a pasar por aquí: sus visitas repetidas no se cuentan.
+REDIRECT_PERMANENT_MAX_AGE = int(os.getenv("REDIRECT_PERMANENT_MAX_AGE", "86400"))
+REDIRECT_TEMPORARY_MAX_AGE = int(os.getenv("REDIRECT_TEMPORARY_MAX_AGE", "60"))
+
+# Modo para analítica exacta: las respuestas se marcan 'private, no-cache',
+# así que el navegador revalida cada visita (ETag) y todas se cuentan; la
+# respuesta sigue siendo un 304 vacío si el enlace no cambió
+REDIRECT_TRACK_ALL_CLICKS = os.getenv("REDIRECT_TRACK_ALL_CLICKS", "False").lower() == "true"
+
+if REDIRECT_DEFAULT_TYPE not in ("permanent", "temporary"):
+    raise ValueError("REDIRECT_DEFAULT_TYPE debe ser 'permanent' o 'temporary'")
+if REDIRECT_PERMANENT_STATUS not in (301, 308) or REDIRECT_TEMPORARY_STATUS not in (302, 307):
+    raise ValueError("REDIRECT_PERMANENT_STATUS debe ser 301/308 y REDIRECT_TEMPORARY_STATUS 302/307")
+
+# Mismos caracteres seguros que usa Starlette en RedirectResponse
+_SEGUROS_LOCATION = ":/%#?=@[]!$&'()*+,;"
+
+# ==============================================================================
+# 2. RESPUESTAS PRE-RENDERIZADAS
+# ==============================================================================
+
+_PLANTILLA_ERROR = """
+        <html>
+            <head>
+                <title>{titulo}</title>
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <style>
+                    body {{ font-family: sans-serif; text-align: center; padding-top: 50px; background: #f9f9f9; }}
+                    h1 {{ color: #e74c3c; }}
+                    .btn {{ display: inline-block; margin-top: 20px; padding: 10px 20px; background: #6366f1; color: white; text-decoration: none; border-radius: 5px; }}
+                </style>
+            </head>
+            <body>
+                <h1>⚠️ {cabecera}</h1>
+                <p>El código <strong>\x00</strong> {motivo}.</p>
+                <a href="/" class="btn">Crear nuevo</a>
+            </body>
+        </html>
+        """
+
+
+def _partir(titulo: str, cabecera: str, motivo: str) -> tuple[bytes, bytes]:
+    """Renderiza la página una vez y la parte en dos alrededor del hueco de la clave."""
+    pagina = _PLANTILLA_ERROR.format(titulo=titulo, cabecera=cabecera, motivo=motivo).encode("utf-8")
+    antes, despues = pagina.split(b"\x00")
+    return antes, despues
+
+
+_NO_ENCONTRADO = _partir("No encontrado", "Enlace no encontrado", "no existe")
+_DESACTIVADO = _partir("Enlace desactivado", "Enlace desactivado", "está desactivado")
+_CADUCADO = _partir("Enlace caducado", "Enlace caducado", "ha caducado")
+
+
+def pagina_error(url_key: str, inexistente: bool = True, caducado: bool = False) -> bytes:
+    """
+    Página de error para una clave: 'no existe', 'está desactivado' o 'ha caducado'.
+    Solo se escapa y concatena la clave (antes se renderizaba la f-string
+    entera en cada petición y la clave se insertaba sin escapar).
+    """
+    antes, despues = _CADUCADO if caducado else _NO_ENCONTRADO if inexistente else _DESACTIVADO
+    return antes + html.escape(url_key).encode("utf-8") + despues
+
+
+# Cabeceras fijas ya codificadas
+_CABECERAS_HTML = [(b"content-type", b"text/html; charset=utf-8")]
+_CABECERAS_REDIRECCION = [(b"content-length", b"0")]
+
+# ==============================================================================
+# 3. POLÍTICA DE CACHÉ HTTP
+# ==============================================================================
+
+@lru_cache(maxsize=4096)
+def politica(resuelta: URLResuelta) -> tuple[int, list[tuple[bytes, bytes]]]:
+    """
+    Código de estado y cabeceras de caché (Cache-Control, ETag,
+    Last-Modified) de la redirección de un enlace. Se memoriza por
+    URLResuelta, que cambia en cuanto se edita el enlace.
+    """
+    permanente = (resuelta.redirect_type or REDIRECT_DEFAULT_TYPE) == "permanent"
+    estado = REDIRECT_PERMANENT_STATUS if permanente else REDIRECT_TEMPORARY_STATUS
+    max_age = REDIRECT_PERMANENT_MAX_AGE if permanente else REDIRECT_TEMPORARY_MAX_AGE
+
+    if REDIRECT_TRACK_ALL_CLICKS or resuelta.expires_at is not None or resuelta.max_clicks is not None:
+        # Los enlaces que caducan no se cachean: el navegador tiene que
+        # volver a preguntar para que se compruebe la caducidad
+        cache_control = b"private, no-cache"
+    elif max_age > 0:
+        cache_control = f"public, max-age={max_age}".encode()
+    else:
+        cache_control = b"no-cache"
+
+    huella = f"{estado}|{resuelta.target_url}|{resuelta.updated_at}".encode("utf-8")
+    etag = b'"' + hashlib.blake2b(huella, digest_size=8).hexdigest().encode() + b'"'
+    cabeceras = [(b"cache-control", cache_control), (b"etag", etag)]
+    if resuelta.updated_at is not None:
+        cabeceras.append((b"last-modified", formatdate(_a_utc(resuelta.updated_at).timestamp(), usegmt=True).encode()))
+    return estado, cabeceras
+
+
+def _a_utc(fecha: datetime) -> datetime:
+    # SQLite devuelve las fechas sin zona (CURRENT_TIMESTAMP está en UTC)
+    return fecha.replace(tzinfo=timezone.utc) if fecha.tzinfo is None else fecha
+
+
+def no_modificada(resuelta: URLResuelta, cabeceras: list[tuple[bytes, bytes]],
+                  if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """
+    Peticiones condicionales: True si la copia del cliente sigue valiendo
+    (responder 304). If-None-Match tiene prioridad sobre If-Modified-Since.
+    """
+    if if_none_match is not None:
+        etag = dict(cabeceras)[b"etag"].decode()
+        candidatas = {c.strip().removeprefix("W/") for c in if_none_match.split(",")}
+        return "*" in candidatas or etag in candidatas
+
+    if if_modified_since is not None and resuelta.updated_at is not None:
+        try:
+            desde = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if desde.tzinfo is None:
+            return False
+        return _a_utc(resuelta.updated_at).replace(microsecond=0) <= desde
+    return False
+
+# ==============================================================================
+# 4. RESOLUCIÓN DE CLAVES
+# ==============================================================================
+
+# Solo las columnas necesarias, sin hidratar objetos ORM. La sentencia se
+# construye una vez y SQLAlchemy reutiliza su forma compilada.
+_CONSULTA = (
+    select(
+        models.URLItem.target_url,
+        models.URLItem.is_active,
+        models.URLItem.redirect_type,
+        # Filas anteriores a la columna: su última edición es la creación
+        func.coalesce(models.URLItem.updated_at, models.URLItem.created_at).label("updated_at"),
+        models.URLItem.expires_at,
+        models.URLItem.max_clicks,
+        models.URLItem.clicks,
+    )
+    .where(models.URLItem.key == bindparam("key"))
+)
+
+
+def instante(fecha: Optional[datetime]) -> Optional[float]:
+    """Fecha de la BD (UTC, con o sin zona) como instante Unix."""
+    return None if fecha is None else _a_utc(fecha).timestamp()
+
+
+def caducado(url_key: str, resuelta: URLResuelta) -> bool:
+    """
+    True si el enlace pasó su fecha de caducidad o agotó sus visitas.
+
+    Las visitas son las de la BD más las que este proceso aún no ha volcado;
+    con varios workers, el límite se puede superar en las visitas pendientes
+    de los demás (como mucho, las de un intervalo de volcado).
+    """
+    if resuelta.expires_at is not None and time.time() >= resuelta.expires_at:
+        return True
+    return (resuelta.max_clicks is not None
+            and resuelta.clicks + acumulador_clicks.pendientes(url_key) >= resuelta.max_clicks)
+
+
+async def resolver_clave(url_key: str, engine: AsyncEngine) -> Optional[URLResuelta]:
+    """Busca la clave en la caché y, si no está y puede existir, en la BD (y la cachea)."""
+    resuelta = cache_resolucion.get(url_key)
+    if resuelta is not None:
+        return resuelta
+
+    # Las claves que seguro no existen se descartan sin ir a la BD
+    if not await filtro_claves.puede_existir(url_key, engine):
+        return None
+
+    async with engine.connect() as conn:
+        fila = (await conn.execute(_CONSULTA, {"key": url_key})).first()
+    if fila is None:
+        filtro_claves.registrar_falso_positivo()
+        return None
+
+    # is_active NULL (filas antiguas) cuenta como activo
+    resuelta = URLResuelta(
+        fila.target_url, fila.is_active is not False, fila.redirect_type, fila.updated_at,
+        instante(fila.expires_at), fila.max_clicks, fila.clicks or 0,
+    )
+    cache_resolucion.set(url_key, *resuelta)
+    return resuelta
+
+
+def registrar_visita(url_key: str, referrer: Optional[str], user_agent: Optional[str], ip: Optional[str]) -> None:
+    """Suma la visita al acumulador y, si está activo, al registro de eventos."""
+    acumulador_clicks.registrar(url_key)
+    if ANALYTICS_ENABLED:
+        registro_eventos.registrar(url_key, referrer, user_agent, ip)
+
+
+def location(target_url: str) -> bytes:
+    return quote(target_url, safe=_SEGUROS_LOCATION).encode("latin-1")
+
+# ==============================================================================
+# 5. MIDDLEWARE ASGI
+# ==============================================================================
+
+def segmentos_reservados(rutas) -> frozenset:
+    """Rutas fijas de un segmento ('admin', 'urls', 'metrics'...): no son claves."""
+    reservadas = {"static"}
+    for ruta in rutas:
+        path = getattr(ruta, "path", "")
+        if path.count("/") == 1 and "{" not in path:
+            reservadas.add(path[1:])
+    return frozenset(reservadas)
+
+
+class RedireccionRapida:
+    """
+    Atiende GET/HEAD /{url_key} sin pasar por el enrutador de FastAPI.
+
+    Se salta la inyección de dependencias, la validación de parámetros, la
+    sesión ORM y la construcción de Response: consulta la caché (o unas
+    pocas columnas en la BD), y escribe directamente los mensajes ASGI con las
+    cabeceras ya codificadas. Las rutas declaradas de un solo segmento
+    ('/admin', '/urls', '/metrics', '/docs'...) se detectan al recibir la
+    primera petición y siguen yendo a FastAPI.
+    """
+
+    # Motor con el que se resuelven las claves (los tests lo sustituyen)
+    engine: AsyncEngine = async_engine
+
+    def __init__(self, app):
+        self.app = app
+        self._reservadas: Optional[frozenset] = None
+        self._ruta = None
+
+    def _preparar(self, scope) -> None:
+        """Recoge las rutas fijas de un segmento y la ruta /{url_key} (para métricas)."""
+        rutas = scope["app"].routes
+        self._ruta = next((ruta for ruta in rutas if getattr(ruta, "path", "") == "/{url_key}"), None)
+        self._reservadas = segmentos_reservados(rutas)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not REDIRECT_FAST_PATH
+            or scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        url_key = path[1:]
+        if self._reservadas is None:
+            self._preparar(scope)
+        if not url_key or "/" in url_key or url_key in self._reservadas:
+            await self.app(scope, receive, send)
+            return
+
+        if self._ruta is not None:
+            scope["route"] = self._ruta  # etiqueta de las métricas
+
+        resuelta = await resolver_clave(url_key, self.engine)
+
+        expirado = resuelta is not None and resuelta.is_active and caducado(url_key, resuelta)
+        if resuelta is not None and resuelta.is_active and not expirado:
+            referrer = user_agent = if_none_match = if_modified_since = None
+            for nombre, valor in scope["headers"]:
+                if nombre == b"referer":
+                    referrer = valor.decode("latin-1")
+                elif nombre == b"user-agent":
+                    user_agent = valor.decode("latin-1")
+                elif nombre == b"if-none-match":
+                    if_none_match = valor.decode("latin-1")
+                elif nombre == b"if-modified-since":
+                    if_modified_since = valor.decode("latin-1")
+            # Una revalidación (304) también es una visita: el navegador
+            # sigue la redirección que tiene guardada
+            cliente = scope.get("client")
+            registrar_visita(url_key, referrer, user_agent, cliente[0] if cliente else None)
+
+            estado, cabeceras = politica(resuelta)
+            if (if_none_match or if_modified_since) and no_modificada(
+                resuelta, cabeceras, if_none_match, if_modified_since
+            ):
+                await send({"type": "http.response.start", "status": 304, "headers": cabeceras})
+            else:
+                await send({
+                    "type": "http.response.start",
+                    "status": estado,
+                    "headers": [(b"location", location(resuelta.target_url))] + cabeceras + _CABECERAS_REDIRECCION,
+                })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cuerpo = pagina_error(url_key, resuelta is None, expirado)
+        await send({
+            "type": "http.response.start",
+            "status": 410 if expirado else 404,
+            "headers": _CABECERAS_HTML + [(b"content-length", str(len(cuerpo)).encode())],
+        })
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else cuerpo})
@@ -1,5 +1,23 @@
-from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from pydantic import AfterValidator, BaseModel, Field, ConfigDict
+from datetime import datetime, timezone
+from typing import Annotated, Optional, Literal
+
+# Política de redirección de un enlace (ver redirect.py)
+RedirectType = Literal["permanent", "temporary"]
+
+
+def a_utc(fecha: datetime) -> datetime:
+    """
+    Con zona -> UTC sin zona, como se guardan en la BD (enlaces y agregados
+    de visitas). Sin zona se asume UTC.
+    """
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return fecha
+
+
+# Fecha de entrada normalizada a UTC sin zona
+FechaUTC = Annotated[datetime, AfterValidator(a_utc)]
 
 # ==============================================================================
 # 1. ESQUEMA BASE (SHARED)
@@ -27,7 +45,11 @@ class URLCreate(URLBase):
     Datos necesarios para CREAR una nueva URL corta.
     Hereda de URLBase, por lo que solo exige 'target_url'.
     """
-    pass
+    redirect_type: Optional[RedirectType] = Field(
+        None, description="'permanent' (301/308, cacheable) o 'temporary' (302/307); por defecto la global"
+    )
+    expires_at: Optional[FechaUTC] = Field(None, description="Deja de redirigir a partir de esta fecha (UTC si no lleva zona)")
+    max_clicks: Optional[int] = Field(None, ge=1, description="Deja de redirigir al llegar a este número de visitas")
 
 class URLUpdate(BaseModel):
     """
@@ -37,6 +59,9 @@ class URLUpdate(BaseModel):
     """
     target_url: Optional[str] = Field(None, description="Nueva dirección web (opcional)")
     is_active: Optional[bool] = Field(None, description="Activar o desactivar el enlace")
+    redirect_type: Optional[RedirectType] = Field(None, description="Cambiar la política de redirección")
+    expires_at: Optional[FechaUTC] = Field(None, description="Nueva fecha de caducidad (null la quita)")
+    max_clicks: Optional[int] = Field(None, ge=1, description="Nuevo máximo de visitas (null lo quita)")
 
 # ==============================================================================
 # 3. ESQUEMAS DE SALIDA (OUTPUTS)
@@ -51,6 +76,12 @@ class URLInfo(URLBase):
     is_active: bool
     clicks: int
     key: str = Field(..., title="Clave Única", description="El código corto generado (ej: AbC12)")
+    check_status: Optional[str] = Field(
+        None, description="Accesibilidad del destino: pending, ok, unreachable o null si no se comprobó"
+    )
+    redirect_type: Optional[RedirectType] = Field(None, description="Política de redirección (null = la global)")
+    expires_at: Optional[datetime] = Field(None, description="Fecha de caducidad en UTC (null = no caduca)")
+    max_clicks: Optional[int] = Field(None, description="Máximo de visitas (null = sin límite)")
     
     # Campo calculado: No se guarda en la DB, se genera al vuelo en el main.py
     url_completa: Optional[str] = Field(None, description="URL corta completa lista para compartir")
@@ -67,7 +98,87 @@ class URLInfo(URLBase):
                 "is_active": True,
                 "clicks": 42,
                 "key": "A8sK2",
+                "check_status": "ok",
                 "url_completa": "https://tu-dominio.com/A8sK2"
             }
         }
-    )
\ No newline at end of file
+    )
+
+# ==============================================================================
+# 4. ESQUEMAS DE CREACIÓN MASIVA (BULK)
+# ==============================================================================
+
+class URLBulkCreate(BaseModel):
+    """
+    Lote de URLs a acortar de una sola vez.
+    También se acepta NDJSON (una URL o un objeto {"target_url": ...} por línea).
+    """
+    target_urls: list[str] = Field(
+        ...,
+        description="Lista de direcciones web originales",
+        json_schema_extra={"example": ["https://www.google.com", "https://www.python.org"]}
+    )
+
+class URLBulkItemResult(BaseModel):
+    """Resultado individual de cada URL del lote (en el mismo orden de entrada)."""
+    index: int
+    target_url: str
+    ok: bool
+    key: Optional[str] = None
+    url_completa: Optional[str] = None
+    error: Optional[str] = None
+
+class URLBulkResponse(BaseModel):
+    """Resumen del lote: cuántas se crearon, cuántas fallaron y el detalle."""
+    created: int
+    failed: int
+    results: list[URLBulkItemResult]
+
+# ==============================================================================
+# 5. ESQUEMAS DE ESTADÍSTICAS
+# ==============================================================================
+
+class URLStatsBucket(BaseModel):
+    """Visitas en un intervalo (hora o día, en UTC)."""
+    bucket: datetime
+    clicks: int
+
+class URLStats(BaseModel):
+    """
+    Estadísticas de una URL corta en un rango de fechas.
+    Se calculan a partir de los agregados; las visitas de los últimos
+    segundos pueden no aparecer aún.
+    """
+    key: str
+    granularity: str
+    start: datetime
+    end: datetime
+    total: int
+    series: list[URLStatsBucket]
+    referrers: dict[str, int] = Field(default_factory=dict, description="Top dominios de origen")
+    browsers: dict[str, int] = Field(default_factory=dict, description="Top familias de navegador")
+    countries: dict[str, int] = Field(default_factory=dict, description="Top países (si hay base GeoIP)")
+
+# ==============================================================================
+# 6. ESQUEMAS DEL PANEL DE ADMINISTRACIÓN
+# ==============================================================================
+
+class AdminTopLink(BaseModel):
+    """Un enlace del ranking de más visitados."""
+    key: str
+    target_url: str
+    clicks: int
+    is_active: bool
+    url_completa: Optional[str] = None
+
+class AdminSummary(BaseModel):
+    """
+    Resumen global para el panel. Los totales son contadores mantenidos
+    al crear, editar, borrar y volcar visitas; las visitas de los últimos
+    segundos pueden no estar sumadas aún.
+    """
+    total_links: int
+    active_links: int
+    inactive_links: int
+    total_clicks: int
+    top_links: list[AdminTopLink]
@@ -0,0 +1,81 @@
+"""
+Arranque de la aplicación en producción, con uno o varios procesos.
+
+Configuración por variables de entorno:
+    HOST            Interfaz de escucha (por defecto 0.0.0.0)
+    PORT            Puerto (por defecto 8000)
+    WEB_CONCURRENCY Número de workers (por defecto 1). 'auto' = núcleos de CPU
+    SERVER          'uvicorn' (por defecto) o 'gunicorn' (si está instalado,
+                    con workers uvicorn.workers.UvicornWorker)
+
+Cada worker es un proceso con sus propias cachés; las ediciones y borrados
+se propagan entre ellos con el canal de invalidación (invalidation.py).
+
+Las métricas de /metrics también son de cada proceso: cada petición la
+responde un worker distinto con sus propias cuentas. Con más de un worker
+se activa METRICS_WORKER_LABEL, que etiqueta cada serie con el pid del
+worker; para ver el total hay que sumarlas en Prometheus. /api/health
+también describe solo al worker que responde.
+
+Uso (desde backend/):
+    WEB_CONCURRENCY=4 python server.py
+    python server.py --migrate     # solo crea/actualiza el esquema y sale
+"""
+import os
+import sys
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+SERVER = os.getenv("SERVER", "uvicorn").lower()
+
+
+def numero_workers() -> int:
+    valor = os.getenv("WEB_CONCURRENCY", "1").strip().lower()
+    if valor == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(valor))
+
+
+def preparar_base_de_datos() -> None:
+    """
+    Crea/actualiza el esquema una sola vez antes de lanzar los workers,
+    para que no compitan entre ellos haciendo CREATE TABLE a la vez.
+    """
+    import crud
+    import models  # noqa: F401 (registra las tablas en Base.metadata)
+    from database import actualizar_esquema, engine, SessionLocal
+
+    actualizar_esquema(engine)
+    with SessionLocal() as db:
+        crud.fill_missing_target_hashes(db)  # enlaces anteriores a target_hash
+    engine.dispose()
+
+
+def main() -> None:
+    preparar_base_de_datos()
+    if "--migrate" in sys.argv[1:]:
+        return
+
+    # El esquema ya está al día: los workers no lo repiten en su arranque
+    os.environ["AUTO_MIGRATE"] = "false"
+    workers = numero_workers()
+    if workers > 1:
+        # Cada worker exporta sus métricas con su pid (ver metrics.py)
+        os.environ.setdefault("METRICS_WORKER_LABEL", "true")
+
+    if SERVER == "gunicorn":
+        argumentos = [
+            "gunicorn", "main:app",
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--workers", str(workers),
+            "--bind", f"{HOST}:{PORT}",
+        ]
+        os.execvp("gunicorn", argumentos)
+
+    import uvicorn
+
+    uvicorn.run("main:app", host=HOST, port=PORT, workers=workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,46 @@
+import atexit
+import os
+import tempfile
+
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 # Importamos tu app y las configuraciones de base de datos
 # Asegúrate de que los nombres coincidan con tus archivos (main, database, models)
-from main import app, get_db
+from main import app, get_db, get_async_db
 from database import Base
 import models
 
-# 1. Configuración de Base de Datos TEMPORAL (SQLite en memoria)
-# Esto evita que borremos o escribamos en tu base de datos real 'sql_app.db'
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# 1. Configuración de Base de Datos TEMPORAL (SQLite en un fichero temporal)
+# Esto evita que borremos o escribamos en tu base de datos real 'sql_app.db'.
+# Se usa un fichero y no ':memory:' porque el motor síncrono (sqlite3) y el
+# asíncrono (aiosqlite) tienen que ver los mismos datos.
+_fd, TEST_DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DB_PATH}")
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Creamos las tablas en la base de datos temporal
 Base.metadata.create_all(bind=engine)
 
+@atexit.register
+def _borrar_db_temporal():
+    engine.dispose()
+    try:
+        os.remove(TEST_DB_PATH)
+    except OSError:
+        pass
+
 # 2. Sobrescribir la dependencia (Dependency Override)
 # Le decimos a FastAPI: "Cuando pidas 'get_db', no uses la real, usa esta de prueba"
 def override_get_db():
@@ -32,7 +50,16 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+
+# El camino rápido de redirección no usa dependencias: se le indica el motor
+from redirect import RedireccionRapida
+RedireccionRapida.engine = async_engine
 
 # 3. Inicializamos el Cliente de Pruebas
 client = TestClient(app)
@@ -60,4 +87,900 @@ def test_leer_url_inexistente():
     response = client.get("/esta-clave-no-existe")
     
     # Debería dar error 404 Not Found
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def test_cache_resolucion_se_invalida_al_borrar():
+    """La redirección se sirve desde caché y deja de hacerlo tras borrar el enlace"""
+    from cache import cache_resolucion
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="cache1", target_url="https://www.python.org"))
+    db.commit()
+    db.close()
+
+    # Primera visita: fallo de caché, se consulta la BD
+    response = client.get("/cache1", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://www.python.org"
+    assert cache_resolucion.get("cache1") is not None
+
+    # Al borrar, la entrada desaparece de la caché y la clave deja de existir
+    assert client.delete("/urls/cache1").status_code == 200
+    assert cache_resolucion.get("cache1") is None
+    assert client.get("/cache1", follow_redirects=False).status_code == 404
+
+    assert "hits" in client.get("/api/health").json()["cache"]
+
+
+def test_visitas_se_acumulan_y_vuelcan_por_lotes():
+    """Las visitas no se escriben en cada redirección, sino al volcar el acumulador"""
+    from clicks import acumulador_clicks
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="clk1", target_url="https://www.python.org", clicks=0))
+    db.commit()
+
+    for _ in range(3):
+        assert client.get("/clk1", follow_redirects=False).status_code == 307
+
+    assert acumulador_clicks.pendientes("clk1") == 3
+    acumulador_clicks.flush(TestingSessionLocal)
+    assert acumulador_clicks.pendientes("clk1") == 0
+
+    db.expire_all()
+    assert db.query(models.URLItem).filter_by(key="clk1").one().clicks == 3
+    db.close()
+
+    # Si la BD falla al apagar, las visitas se conservan y el apagado sigue
+    from clicks import AcumuladorClicks
+
+    def sin_bd():
+        raise RuntimeError("BD caída")
+
+    acumulador = AcumuladorClicks(session_factory=sin_bd)
+    acumulador.registrar("clk1")
+    acumulador.stop()
+    assert acumulador.pendientes("clk1") == 1
+
+
+def test_creacion_masiva_devuelve_resultado_por_url(monkeypatch):
+    """El lote crea las URLs válidas y reporta el error de las inválidas, en orden"""
+    import main
+
+    async def red_simulada(_):
+        # Evitamos DNS/HTTP reales: todo dominio resuelve y responde
+        return True, ""
+
+    monkeypatch.setattr(main, "verificar_resolucion_dns", red_simulada)
+    monkeypatch.setattr(main, "verificar_url_accesible", red_simulada)
+
+    payload = {"target_urls": ["https://www.python.org", "pizza", "https://fastapi.tiangolo.com"]}
+    response = client.post("/urls/bulk", json=payload)
+    assert response.status_code == 200
+
+    data = response.json()
+    assert (data["created"], data["failed"]) == (2, 1)
+    assert [r["ok"] for r in data["results"]] == [True, False, True]
+    assert data["results"][1]["error"]
+
+    # Las claves creadas redirigen a su destino
+    key = data["results"][2]["key"]
+    assert client.get(f"/{key}", follow_redirects=False).headers["location"] == "https://fastapi.tiangolo.com"
+
+    # También se acepta NDJSON
+    ndjson = '"https://www.djangoproject.com"\n{"target_url": "https://flask.palletsprojects.com"}\n'
+    response = client.post("/urls/bulk", content=ndjson, headers={"Content-Type": "application/x-ndjson"})
+    assert response.json()["created"] == 2
+
+
+def test_cache_dns_deduplica_consultas_simultaneas():
+    """Varias resoluciones simultáneas del mismo dominio comparten una sola consulta"""
+    import asyncio
+    from cache import CacheDNS
+
+    llamadas = []
+
+    async def resolutor_falso(hostname):
+        llamadas.append(hostname)
+        await asyncio.sleep(0.01)
+        return hostname != "no-existe.com", ""
+
+    async def escenario():
+        cache = CacheDNS()
+        resultados = await asyncio.gather(*(cache.resolver("ejemplo.com", resolutor_falso) for _ in range(5)))
+        assert all(ok for ok, _ in resultados)
+        # Segunda ronda: sale de la caché (también la respuesta negativa)
+        await cache.resolver("EJEMPLO.com", resolutor_falso)
+        assert (await cache.resolver("no-existe.com", resolutor_falso))[0] is False
+        assert (await cache.resolver("no-existe.com", resolutor_falso))[0] is False
+        return cache
+
+    cache = asyncio.run(escenario())
+    assert llamadas == ["ejemplo.com", "no-existe.com"]
+    assert cache.deduplicated == 4
+
+
+
+def test_validacion_diferida_responde_sin_esperar_a_la_red(monkeypatch):
+    """En modo diferido el enlace se crea 'pending' y el verificador lo completa después"""
+    import asyncio
+    import main
+    from reachability import verificador_diferido
+
+    async def red_no_disponible(_):
+        raise AssertionError("No se debe tocar la red al crear en modo diferido")
+
+    monkeypatch.setattr(main, "DEFERRED_VALIDATION", True)
+    monkeypatch.setattr(main, "verificar_resolucion_dns", red_no_disponible)
+
+    response = client.post("/url", json={"target_url": "https://www.python.org/about"})
+    assert response.status_code == 200
+    assert response.json()["check_status"] == "pending"
+    key = response.json()["key"]
+
+    # El verificador de fondo comprueba el destino y guarda el resultado
+    async def destino_caido(_):
+        return False, "URL devolvió código 503"
+
+    monkeypatch.setattr(verificador_diferido, "session_factory", TestingAsyncSessionLocal)
+    monkeypatch.setattr(verificador_diferido, "comprobar", destino_caido)
+    assert asyncio.run(verificador_diferido.procesar(key, "https://www.python.org/about")) == "unreachable"
+
+    db = TestingSessionLocal()
+    assert db.query(models.URLItem).filter_by(key=key).one().check_status == "unreachable"
+    db.close()
+
+
+def test_verificador_diferido_reserva_pendientes_por_lotes():
+    """Varios workers reservan los pendientes por lotes sin repetir destinos y retoman los abandonados"""
+    import asyncio
+    from datetime import datetime, timedelta, timezone
+    from reachability import VerificadorDiferido
+
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    hace_una_hora = ahora - timedelta(hours=1)
+    db = TestingSessionLocal()
+    for i in range(7):
+        db.add(models.URLItem(key=f"dif{i}", target_url=f"https://diferido.example.com/{i}", check_status="pending"))
+    # Reservada por un worker que se cayó hace una hora, y otra en curso
+    db.add(models.URLItem(key="difcaido", target_url="https://diferido.example.com/caido",
+                          check_status="checking", check_started_at=hace_una_hora))
+    db.add(models.URLItem(key="difencurso", target_url="https://diferido.example.com/encurso",
+                          check_status="checking", check_started_at=ahora))
+    db.commit()
+
+    comprobadas = []
+
+    async def comprobar(url):
+        comprobadas.append(url)
+        await asyncio.sleep(0)
+        return True, "ok"
+
+    async def dos_workers():
+        verificadores = [VerificadorDiferido(TestingAsyncSessionLocal, workers=2, batch_size=2, poll_interval=0.05)
+                         for _ in range(2)]
+        for verificador in verificadores:
+            await verificador.start(comprobar)
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            terminado = all(v.procesadas == v.reservadas for v in verificadores)
+            if terminado and sum(1 for url in comprobadas if "diferido.example" in url) >= 8:
+                break
+        for verificador in verificadores:
+            await verificador.stop()
+        await async_engine.dispose()
+
+    asyncio.run(dos_workers())
+    propias = sorted(url for url in comprobadas if "diferido.example" in url)
+    assert propias == sorted([f"https://diferido.example.com/{i}" for i in range(7)] + ["https://diferido.example.com/caido"])
+    estados = {u.key: u.check_status for u in db.query(models.URLItem).filter(models.URLItem.key.startswith("dif"))}
+    assert estados.pop("difencurso") == "checking"
+    assert set(estados.values()) == {"ok"}
+
+    # Al parar, lo reservado que no se llegó a comprobar vuelve a 'pending'
+    for i in range(2):
+        db.add(models.URLItem(key=f"difsuelta{i}", target_url=f"https://suelta.example.com/{i}", check_status="pending"))
+    db.commit()
+
+    async def sin_workers():
+        verificador = VerificadorDiferido(TestingAsyncSessionLocal, workers=0, batch_size=5, poll_interval=0.05)
+        await verificador.start(comprobar)
+        await asyncio.sleep(0.2)
+        reservadas = verificador.estadisticas()["claimed"]
+        await verificador.stop()
+        await async_engine.dispose()
+        return reservadas
+
+    assert asyncio.run(sin_workers()) == 2
+    db.expire_all()
+    assert {u.check_status for u in db.query(models.URLItem).filter(models.URLItem.key.startswith("difsuelta"))} == {"pending"}
+    db.close()
+
+
+def test_url_asincrona_cambia_los_drivers_sincronos():
+    """La URL de DATABASE_URL se traduce al driver asíncrono aunque indique uno síncrono"""
+    from database import obtener_url_asincrona
+
+    assert obtener_url_asincrona("sqlite:///./sql_app.db") == "sqlite+aiosqlite:///./sql_app.db"
+    assert obtener_url_asincrona("sqlite+pysqlite:///./sql_app.db") == "sqlite+aiosqlite:///./sql_app.db"
+    for url in ("postgres://u:p@h/db", "postgresql://u:p@h/db", "postgresql+psycopg2://u:p@h/db"):
+        assert obtener_url_asincrona(url) == "postgresql+asyncpg://u:p@h/db"
+    # Los drivers que ya son asíncronos se respetan
+    assert obtener_url_asincrona("postgresql+psycopg://u:p@h/db") == "postgresql+psycopg://u:p@h/db"
+
+
+def test_paginacion_por_cursor_con_busqueda_y_orden():
+    """GET /urls pagina con X-Next-Cursor y filtra/ordena en el servidor"""
+    db = TestingSessionLocal()
+    # Las tres últimas imitan filas antiguas sin contador (clicks NULL)
+    for i, clicks in enumerate([5, 1, 9, 3, 7, None, None, None]):
+        db.add(models.URLItem(key=f"pag{i}", target_url=f"https://paginado.com/{i}", clicks=clicks))
+    db.commit()
+    db.close()
+
+    vistos, cursor = [], None
+    while True:
+        params = {"limit": 2, "sort": "clicks_desc", "q": "paginado"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/urls", params=params)
+        assert response.status_code == 200
+        vistos += [u["clicks"] or 0 for u in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    # Las filas sin contador cuentan como 0 y no se pierden entre páginas
+    assert vistos == [9, 7, 5, 3, 1, 0, 0, 0]
+    assert client.get("/urls", params={"cursor": "basura"}).status_code == 400
+    # Valores que no corresponden a las columnas de la ordenación
+    import crud
+    for valores in ([{"a": 1}], [[1, 2]], [True], [1, "pag1"]):
+        assert client.get("/urls", params={"cursor": crud.encode_cursor(valores)}).status_code == 400
+    assert client.get("/urls", params={"sort": "clicks_desc", "cursor": crud.encode_cursor([None, 1])}).status_code == 400
+
+    # Códigos por prefijo (distinguen mayúsculas) y comodines literales
+    assert [u["key"] for u in client.get("/urls", params={"q": "pag", "sort": "alpha_asc"}).json()] == [
+        f"pag{i}" for i in range(8)
+    ]
+    assert client.get("/urls", params={"q": "PAG0"}).json() == []
+    assert client.get("/urls", params={"q": "%"}).json() == []
+
+
+def test_paginacion_por_fecha_de_creacion():
+    """Las ordenaciones por fecha siguen created_at (fechas importadas incluidas), no el orden de alta"""
+    from datetime import datetime
+
+    db = TestingSessionLocal()
+    # Fechas históricas desordenadas respecto al id, con un empate, y dos
+    # altas con la fecha por defecto de la BD (sin microsegundos en SQLite)
+    fechas = [datetime(2021, 5, 1), datetime(2019, 1, 1, 12, 30, 0, 250000),
+              datetime(2021, 5, 1), None, datetime(2020, 2, 29), None]
+    for i, fecha in enumerate(fechas):
+        db.add(models.URLItem(key=f"fecha{i}", target_url=f"https://fechas.example.com/{i}", created_at=fecha))
+    db.commit()
+    db.close()
+
+    def recorrer(sort):
+        vistos, cursor = [], None
+        while True:
+            params = {"limit": 2, "sort": sort, "q": "fechas.example"}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/urls", params=params)
+            assert response.status_code == 200
+            vistos += [u["key"] for u in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return vistos
+
+    antiguas_primero = ["fecha1", "fecha4", "fecha0", "fecha2", "fecha3", "fecha5"]
+    assert recorrer("date_asc") == antiguas_primero
+    assert recorrer("date_desc") == antiguas_primero[::-1]
+
+    import crud
+    assert client.get("/urls", params={"sort": "date_asc", "cursor": crud.encode_cursor([5, 1])}).status_code == 400
+
+
+def test_generador_secuencial_reserva_bloques_sin_colisiones():
+    """Las claves salen de bloques reservados en la BD, crecen de longitud y no se repiten"""
+    import asyncio
+    from keygen import GeneradorSecuencial, Permutacion
+
+    # La permutación es una biyección del rango completo
+    assert sorted(Permutacion("secreto", 2).aplicar(n) for n in range(62 ** 2)) == list(range(62 ** 2))
+
+    # Dos "workers" contra la misma BD: cada uno reserva sus propios bloques
+    a = GeneradorSecuencial(block_size=50, min_length=1, secuencia="test")
+    b = GeneradorSecuencial(block_size=50, min_length=1, secuencia="test")
+    db = TestingSessionLocal()
+    claves = a.claves(db, 40) + b.claves(db, 40) + a.claves(db, 40)
+    db.close()
+
+    async def en_async():
+        async with TestingAsyncSessionLocal() as adb:
+            resultado = await b.claves_async(adb, 40)
+        # Cierra las conexiones aiosqlite antes de que termine este event loop
+        await async_engine.dispose()
+        return resultado
+
+    claves += asyncio.run(en_async())
+
+    assert len(set(claves)) == 160
+    # 62 claves de 1 carácter y, agotadas, se pasa a 2 caracteres
+    assert sorted(len(c) for c in claves) == [1] * 62 + [2] * 98
+    # a: 40 + 40 > 50 -> dos bloques; b: uno por engine (síncrono y aiosqlite)
+    assert a.bloques_reservados == 2 and b.bloques_reservados == 2
+
+
+def test_estadisticas_por_visita_desde_agregados():
+    """Cada visita genera un evento y /urls/{key}/stats responde desde los agregados"""
+    from analytics import registro_eventos
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="stats1", target_url="https://www.python.org"))
+    db.commit()
+    db.close()
+
+    chrome = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36"
+    for ua in [chrome, chrome, "curl/8.0"]:
+        response = client.get("/stats1", follow_redirects=False,
+                              headers={"User-Agent": ua, "Referer": "https://www.google.com/search?q=x"})
+        assert response.status_code == 307
+
+    registro_eventos.flush(TestingSessionLocal)
+    assert registro_eventos.pendientes() == 0
+
+    db = TestingSessionLocal()
+    assert db.query(models.ClickEvent).filter_by(key="stats1").count() == 3
+    db.close()
+
+    stats = client.get("/urls/stats1/stats", params={"granularity": "hour"}).json()
+    assert stats["total"] == 3
+    assert len(stats["series"]) == 1
+    assert stats["browsers"] == {"Chrome": 2, "curl": 1}
+    assert stats["referrers"] == {"google.com": 3}
+
+    assert client.get("/urls/stats1/stats", params={"granularity": "day"}).json()["total"] == 3
+    assert client.get("/urls/no-existe/stats").status_code == 404
+    assert client.get("/urls/stats1/stats", params={"from": "2030-01-02", "to": "2030-01-01"}).status_code == 400
+
+
+def test_perfil_sqlite_produccion_aplica_pragmas():
+    """El evento 'connect' del perfil de producción deja la conexión en WAL con busy_timeout"""
+    from database import aplicar_perfil_sqlite, SQLITE_BUSY_TIMEOUT_MS
+
+    fd, ruta = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    motor = create_engine(f"sqlite:///{ruta}")
+    aplicar_perfil_sqlite(motor)
+    try:
+        with motor.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == SQLITE_BUSY_TIMEOUT_MS
+    finally:
+        motor.dispose()
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+
+
+def test_invalidacion_se_propaga_entre_procesos():
+    """Un borrado anotado por un worker llega a la caché de otro al sondear"""
+    import asyncio
+    from cache import CacheResolucion
+    from invalidation import CanalInvalidacion
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="inv1", target_url="https://www.python.org"))
+    db.commit()
+    db.close()
+
+    # Otro "worker": su propia caché y su propio canal sobre la misma BD
+    cache_otro = CacheResolucion()
+    cache_otro.set("inv1", "https://www.python.org", True)
+    canal_otro = CanalInvalidacion(session_factory=TestingAsyncSessionLocal, interval=0)
+    canal_otro.suscribir(cache_otro.invalidate)
+
+    async def escenario():
+        await canal_otro.start()
+        assert await canal_otro.sondear() == 0
+
+        assert client.delete("/urls/inv1").status_code == 200
+
+        recibidas = await canal_otro.sondear()
+        await async_engine.dispose()
+        return recibidas
+
+    assert asyncio.run(escenario()) == 1
+    assert cache_otro.get("inv1") is None
+
+
+def test_metricas_prometheus(monkeypatch):
+    """/metrics expone latencia por plantilla de ruta, consultas SQL y etapas de validación"""
+    import os
+    import metrics
+    from metrics import instrumentar_engine
+
+    # La app instrumenta sus motores al importarse; aquí se usa el de pruebas
+    instrumentar_engine(async_engine.sync_engine, "test")
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="met1", target_url="https://www.python.org"))
+    db.commit()
+    db.close()
+
+    from cache import cache_resolucion
+    cache_resolucion.invalidate("met1")
+    assert client.get("/met1", follow_redirects=False).status_code == 307
+    client.post("/api/validate-url", json={"target_url": "no es una url"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    texto = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/{url_key}",status="3xx"}' in texto
+    assert 'db_query_duration_seconds_bucket{engine="test",statement="SELECT",le="+Inf"}' in texto
+    assert 'url_validation_failures_total{stage="format"}' in texto
+    assert 'http_requests_in_flight{method="GET"} 1' in texto  # la propia petición a /metrics
+
+    # Con varios workers, cada serie lleva el pid del proceso que la exporta
+    monkeypatch.setattr(metrics, "METRICS_WORKER_LABEL", True)
+    texto = client.get("/metrics").text
+    assert f'url_validation_failures_total{{stage="format",worker="{os.getpid()}"}}' in texto
+    assert f'deferred_checks_queued{{worker="{os.getpid()}"}}' in texto
+
+
+def test_redireccion_rapida_respeta_is_active_y_escapa_la_clave():
+    """El camino rápido redirige sin pasar por FastAPI, respeta is_active y escapa el 404"""
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="rap1", target_url="https://www.python.org/ñ", is_active=True))
+    db.add(models.URLItem(key="rap2", target_url="https://www.python.org", is_active=False))
+    db.commit()
+    db.close()
+
+    response = client.get("/rap1", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://www.python.org/%C3%B1"
+    assert client.head("/rap1", follow_redirects=False).status_code == 307
+
+    # Un enlace desactivado ya no redirige
+    response = client.get("/rap2", follow_redirects=False)
+    assert response.status_code == 404
+    assert "desactivado" in response.text
+
+    response = client.get("/<script>x", follow_redirects=False)
+    assert response.status_code == 404
+    assert "<script>" not in response.text and "&lt;script&gt;x" in response.text
+
+    # Las rutas fijas de un segmento siguen llegando a FastAPI
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/urls").status_code == 200
+
+
+def test_politica_de_redireccion_y_peticiones_condicionales(monkeypatch):
+    """301 cacheable para enlaces permanentes, ETag/304 y cambio de política al editar"""
+    import redirect
+    from cache import cache_resolucion
+    from clicks import acumulador_clicks
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="pol1", target_url="https://www.python.org", redirect_type="permanent"))
+    db.commit()
+    db.close()
+
+    for rapido in (True, False):  # camino rápido y ruta FastAPI
+        monkeypatch.setattr(redirect, "REDIRECT_FAST_PATH", rapido)
+        cache_resolucion.clear()
+
+        response = client.get("/pol1", follow_redirects=False)
+        assert response.status_code == 301
+        assert response.headers["cache-control"] == "public, max-age=86400"
+        assert "last-modified" in response.headers
+        etag = response.headers["etag"]
+
+        # Revalidación: 304 sin cuerpo, pero la visita cuenta
+        antes = acumulador_clicks.pendientes("pol1")
+        response = client.get("/pol1", headers={"If-None-Match": etag}, follow_redirects=False)
+        assert response.status_code == 304 and response.content == b""
+        assert acumulador_clicks.pendientes("pol1") == antes + 1
+        response = client.get("/pol1", headers={"If-Modified-Since": response.headers["last-modified"]},
+                              follow_redirects=False)
+        assert response.status_code == 304
+
+    # Al pasarlo a temporal cambian el código, el TTL y el ETag
+    assert client.put("/urls/pol1", json={"redirect_type": "temporary"}).json()["redirect_type"] == "temporary"
+    response = client.get("/pol1", headers={"If-None-Match": etag}, follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["cache-control"] == "public, max-age=60"
+    assert response.headers["etag"] != etag
+
+    # Modo de analítica exacta: nadie puede servir la redirección sin preguntar
+    monkeypatch.setattr(redirect, "REDIRECT_TRACK_ALL_CLICKS", True)
+    redirect.politica.cache_clear()
+    assert client.get("/pol1", follow_redirects=False).headers["cache-control"] == "private, no-cache"
+    redirect.politica.cache_clear()
+
+
+def test_filtro_de_claves_descarta_inexistentes_sin_consultar_la_bd(monkeypatch):
+    """Bloom: un 'no está' evita la BD; en modo compartido antes se leen las filas nuevas"""
+    import asyncio
+    from keyfilter import FiltroBloom, filtro_claves
+
+    bloom = FiltroBloom(1000, 0.01)
+    for i in range(1000):
+        bloom.agregar(f"k{i}")
+    assert all(f"k{i}" in bloom for i in range(1000))
+    assert sum(f"x{i}" in bloom for i in range(10000)) < 300  # ~1 %
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="blm1", target_url="https://www.python.org"))
+    db.commit()
+
+    async def cargar():
+        # En segundo plano: mientras carga todo "puede existir" y las altas se guardan aparte
+        filtro_claves.iniciar_carga(async_engine)
+        filtro_claves.agregar("blm-durante")
+        assert filtro_claves.filtro is None
+        await filtro_claves._carga
+        await async_engine.dispose()
+
+    asyncio.run(cargar())
+    try:
+        assert "blm-durante" in filtro_claves.filtro
+        assert client.get("/blm1", follow_redirects=False).status_code == 307
+        descartadas = filtro_claves.descartadas
+        assert client.get("/no-existe-blm", follow_redirects=False).status_code == 404
+        assert filtro_claves.descartadas == descartadas + 1
+
+        # Una clave creada por otro proceso: en modo exclusivo no se ve...
+        db.add(models.URLItem(key="blm2", target_url="https://www.python.org"))
+        db.commit()
+        assert client.get("/blm2", follow_redirects=False).status_code == 404
+        # ...en modo compartido se leen las filas nuevas antes de responder 404
+        monkeypatch.setattr(filtro_claves, "modo", "shared")
+        assert client.get("/blm2", follow_redirects=False).status_code == 307
+
+        informe = client.get("/api/health").json()["key_filter"]
+        assert informe["loaded"] and informe["keys"] >= 2 and informe["memory_bytes"] > 0
+        assert "observed_fp_rate" in informe and "estimated_fp_rate" in informe
+    finally:
+        filtro_claves.filtro = None
+        db.close()
+
+
+def test_exportacion_csv_y_ndjson_con_filtros_y_gzip():
+    """GET /urls/export filtra en la BD y envía CSV/NDJSON por lotes, comprimido si se acepta gzip"""
+    import csv
+    import gzip
+    import io
+    import json
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="exp1", target_url="https://www.python.org/a,b", clicks=50, is_active=True))
+    db.add(models.URLItem(key="exp2", target_url="https://www.python.org", clicks=50, is_active=False))
+    db.add(models.URLItem(key="exp3", target_url="https://www.python.org", clicks=0, is_active=True))
+    db.commit()
+    db.close()
+
+    response = client.get("/urls/export", params={"format": "csv", "min_clicks": 50, "active": "true"},
+                          headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert "attachment" in response.headers["content-disposition"]
+    filas = list(csv.DictReader(io.StringIO(response.text)))
+    claves = {f["key"] for f in filas}
+    assert "exp1" in claves and "exp2" not in claves and "exp3" not in claves
+    assert next(f for f in filas if f["key"] == "exp1")["target_url"] == "https://www.python.org/a,b"
+
+    # Comprimido sobre la marcha: se leen los bytes tal cual llegan
+    with client.stream("GET", "/urls/export", params={"format": "ndjson", "active": "false"},
+                       headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        cuerpo = gzip.decompress(b"".join(response.iter_raw()))
+    registros = [json.loads(linea) for linea in cuerpo.decode().splitlines()]
+    assert [r["key"] for r in registros if r["key"].startswith("exp")] == ["exp2"]
+    assert registros[0]["url_completa"].endswith(registros[0]["key"])
+
+
+def test_importacion_por_lotes_con_conflictos_y_reanudacion(tmp_path):
+    """importer.py: conserva claves, salta conflictos y reanuda tras un fallo sin duplicar"""
+    import importer
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="imp-existe", target_url="https://www.python.org"))
+    db.commit()
+
+    fichero = tmp_path / "viejo.csv"
+    fichero.write_text(
+        "key,target_url,clicks,created_at\n"
+        "imp1,https://www.python.org/1,7,2020-01-02T03:04:05Z\n"
+        "imp-existe,https://www.python.org/2,0,\n"          # ya existe
+        "imp1,https://www.python.org/3,0,\n"                # repetida en el fichero
+        "imp4,no es una url,0,\n"                           # inválida
+        ",https://www.python.org/5,1,\n"                    # sin clave: se genera
+        '"imp6","https://www.python.org/6,con,comas",2,\n',
+        encoding="utf-8",
+    )
+
+    # Falla justo después de guardar el primer lote (2 registros)
+    def caida(insertadas):
+        raise RuntimeError("caída simulada")
+
+    try:
+        importer.importar(str(fichero), chunk_size=2, session_factory=TestingSessionLocal, al_insertar=caida)
+    except RuntimeError:
+        pass
+    trabajo = db.get(models.ImportJob, "viejo.csv")
+    assert trabajo.status == "failed" and trabajo.records == 2 and trabajo.imported == 1
+
+    informe = importer.importar(str(fichero), chunk_size=2, session_factory=TestingSessionLocal)
+    assert informe["resumed"] and informe["status"] == "done"
+    assert (informe["records"], informe["imported"], informe["conflicts"], informe["invalid"]) == (6, 3, 2, 1)
+    assert {m["record"] for m in informe["sample"]} == {3, 4}  # los del primer lote ya se informaron
+    assert informe["rows_per_second"] > 0
+
+    db.expire_all()
+    imp1 = db.query(models.URLItem).filter_by(key="imp1").one()
+    assert (imp1.target_url, imp1.clicks, imp1.created_at.year) == ("https://www.python.org/1", 7, 2020)
+    assert db.query(models.URLItem).filter_by(target_url="https://www.python.org/5").one().key
+    assert db.query(models.URLItem).filter_by(key="imp6").one().target_url == "https://www.python.org/6,con,comas"
+    db.close()
+
+
+def test_importacion_desde_el_endpoint_de_admin():
+    """POST /api/admin/imports sube el fichero, importa en segundo plano e informa del progreso"""
+    cuerpo = '{"key": "impapi1", "target_url": "https://www.python.org"}\n"https://www.python.org/x"\n'
+    assert client.post("/api/admin/imports", content=cuerpo).status_code == 401
+
+    auth = ("admin", "1234")
+    response = client.post("/api/admin/imports", params={"format": "ndjson", "job": "api-test"},
+                           content=cuerpo, auth=auth)
+    assert response.status_code == 202
+
+    estado = client.get("/api/admin/imports/api-test", auth=auth).json()
+    assert (estado["status"], estado["imported"]) == ("done", 2)
+    assert client.get("/impapi1", follow_redirects=False).status_code == 307
+
+
+def test_clave_generada_repetida_se_reintenta(monkeypatch):
+    """Si el generador da una clave ya importada, se crea el enlace con la siguiente"""
+    import asyncio
+    import crud
+    import keygen
+    import schemas
+
+    db = TestingSessionLocal()
+    db.add(models.URLItem(key="colision1", target_url="https://www.python.org"))
+    db.commit()
+    db.close()
+
+    claves = iter(["colision1", "libre1"])
+
+    async def claves_falsas(db, n=1):
+        return [next(claves) for _ in range(n)]
+
+    monkeypatch.setattr(keygen.generador_claves, "claves_async", claves_falsas)
+
+    async def crear():
+        async with TestingAsyncSessionLocal() as db:
+            url = await crud.create_url_async(db, schemas.URLCreate(target_url="https://www.python.org/n"))
+        await async_engine.dispose()
+        return url.key
+
+    assert asyncio.run(crear()) == "libre1"
+
+
+def test_resumen_de_admin_con_contadores_incrementales():
+    """Los totales se mantienen al crear, desactivar, visitar y borrar, sin recorrer la tabla"""
+    import crud
+    import schemas
+    from clicks import acumulador_clicks
+
+    auth = ("admin", "1234")
+    assert client.get("/api/admin/summary").status_code == 401
+    acumulador_clicks.flush(TestingSessionLocal)  # visitas pendientes de otros tests
+    antes = client.get("/api/admin/summary", params={"refresh": True}, auth=auth).json()
+
+    db = TestingSessionLocal()
+    a = crud.create_url(db, schemas.URLCreate(target_url="https://www.python.org/a"))
+    b = crud.create_url(db, schemas.URLCreate(target_url="https://www.python.org/b"))
+    crud.update_url(db, b, schemas.URLUpdate(is_active=False))
+    key_a, key_b = a.key, b.key
+    db.close()
+
+    for _ in range(4):
+        assert client.get(f"/{key_a}", follow_redirects=False).status_code == 307
+    acumulador_clicks.flush(TestingSessionLocal)
+
+    resumen = client.get("/api/admin/summary", params={"top": 100}, auth=auth).json()
+    assert resumen["total_links"] == antes["total_links"] + 2
+    assert resumen["active_links"] == antes["active_links"] + 1
+    assert resumen["inactive_links"] == antes["inactive_links"] + 1
+    assert resumen["total_clicks"] == antes["total_clicks"] + 4
+    clicks = [link["clicks"] for link in resumen["top_links"]]
+    assert clicks == sorted(clicks, reverse=True)
+    assert key_a in [link["key"] for link in resumen["top_links"]]
+
+    assert client.delete(f"/urls/{key_a}").status_code == 200
+    despues = client.get("/api/admin/summary", auth=auth).json()
+    assert despues["total_links"] == antes["total_links"] + 1
+    assert despues["total_clicks"] == antes["total_clicks"]
+
+    # Recalcular desde la tabla da lo mismo que los contadores
+    recalculado = client.get("/api/admin/summary", params={"refresh": True}, auth=auth).json()
+    assert recalculado == despues
+
+
+def test_limite_de_peticiones_por_cliente(monkeypatch):
+    """Al agotar el cubo de un cliente se responde 429 con Retry-After; los demás siguen pasando"""
+    import asyncio
+    import ratelimit
+
+    limitador = ratelimit.LimitadorPeticiones(
+        {"create": ratelimit.Regla.desde_texto("2/60"), "bulk": ratelimit.Regla.desde_texto("2/60"), "redirect": None},
+        ratelimit.AlmacenMemoria(),
+    )
+    monkeypatch.setattr(ratelimit, "limitador", limitador)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_TRUST_FORWARDED", True)
+
+    cuerpo = {"target_url": "no es una url"}
+    for _ in range(2):
+        assert client.post("/api/validate-url", json=cuerpo, headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 200
+    response = client.post("/api/validate-url", json=cuerpo, headers={"X-Forwarded-For": "10.0.0.1"})
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["retry-after"]) <= 30
+
+    # Otro cliente tiene su propio cubo, y las rutas sin regla no se limitan
+    assert client.post("/api/validate-url", json=cuerpo, headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+    assert client.get("/api/health", headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 200
+    assert limitador.estadisticas()["rejected"] == {"create": 1, "bulk": 0}
+
+    # Un lote gasta una ficha por URL de su propio cubo: pasa con el cubo lleno y deja
+    # al cliente en deuda para otros lotes, pero puede seguir creando enlaces sueltos
+    lote = {"target_urls": ["no es una url"] * 5}
+    assert client.post("/urls/bulk", json=lote, headers={"X-Forwarded-For": "10.0.0.3"}).status_code == 200
+    assert client.post("/api/validate-url", json=cuerpo, headers={"X-Forwarded-For": "10.0.0.3"}).status_code == 200
+    response = client.post("/urls/bulk", json=lote, headers={"X-Forwarded-For": "10.0.0.3"})
+    assert response.status_code == 429
+    # La deuda no pasa de un cubo: como mucho, lo que tardan en rellenarse dos
+    assert 60 < int(response.headers["retry-after"]) <= 90
+
+    # El almacén en memoria no pasa de su máximo y el barrido quita los cubos ya llenos
+    reloj = [0.0]
+    almacen = ratelimit.AlmacenMemoria(max_cubos=10, intervalo_barrido=60, reloj=lambda: reloj[0])
+    for i in range(25):
+        asyncio.run(almacen.consumir("redirect", f"ip{i}", 5, 1))
+    assert len(almacen) <= 10
+    reloj[0] = 10.0  # con 5 fichas y 1 por segundo, todos se han rellenado
+    almacen.barrer()
+    assert len(almacen) == 0
+
+    # El almacén en la BD comparte el cubo entre procesos
+    async def compartido():
+        almacen_bd = ratelimit.AlmacenBD(engine=async_engine)
+        esperas = [await almacen_bd.consumir("create", "10.9.9.9", 2, 1 / 60) for _ in range(3)]
+        await async_engine.dispose()
+        return esperas
+
+    esperas = asyncio.run(compartido())
+    assert esperas[:2] == [0.0, 0.0] and 0 < esperas[2] <= 60
+
+    async def lote_compartido():
+        almacen_bd = ratelimit.AlmacenBD(engine=async_engine)
+        esperas = [await almacen_bd.consumir("create", "10.9.9.8", 2, 1 / 60, coste=c) for c in (1, 5, 1)]
+        await async_engine.dispose()
+        return esperas
+
+    esperas = asyncio.run(lote_compartido())
+    assert esperas[:2] == [0.0, 0.0] and 60 * 2 < esperas[2] <= 60 * 3
+
+
+def test_deduplicacion_de_destinos_reutiliza_el_enlace(monkeypatch):
+    """Con DEDUP_TARGETS, un destino equivalente devuelve el enlace existente sin validar ni insertar"""
+    import crud
+    import main
+    import schemas
+    from validation import huella_destino
+
+    assert huella_destino("https://Dedup.example.com:443/a/?b=2&a=1") == huella_destino("dedup.example.com/a?a=1&b=2")
+    assert huella_destino("https://dedup.example.com/a?a=1") != huella_destino("https://dedup.example.com/b?a=1")
+
+    db = TestingSessionLocal()
+    existente = crud.create_url(db, schemas.URLCreate(target_url="https://Dedup.example.com:443/a/?b=2&a=1"))
+    # Filas de antes de la columna: se rellenan al migrar
+    db.add(models.URLItem(key="dedupviejo", target_url="https://dedup.example.com/viejo"))
+    db.commit()
+    assert crud.fill_missing_target_hashes(db) >= 1
+    total = db.query(models.URLItem).count()
+
+    validadas = []
+
+    async def validar_falso(url):
+        validadas.append(url)
+        return False, "sin red en los tests", None
+
+    monkeypatch.setattr(main, "DEDUP_TARGETS", True)
+    monkeypatch.setattr(main, "validar_para_guardar", validar_falso)
+
+    response = client.post("/url", json={"target_url": "dedup.example.com/a?a=1&b=2"})
+    assert response.status_code == 200
+    assert response.json()["key"] == existente.key
+    assert client.post("/url", json={"target_url": "https://DEDUP.example.com/viejo/"}).json()["key"] == "dedupviejo"
+    assert validadas == []
+
+    # Otra política de redirección o un enlace desactivado no se reutilizan
+    cuerpo = {"target_url": "dedup.example.com/a?a=1&b=2", "redirect_type": "permanent"}
+    assert client.post("/url", json=cuerpo).status_code == 400
+    crud.update_url(db, existente, schemas.URLUpdate(is_active=False))
+    assert client.post("/url", json={"target_url": "dedup.example.com/a?a=1&b=2"}).status_code == 400
+    # Una URL que urlsplit no puede descomponer no rompe la búsqueda: la rechaza la validación
+    assert client.post("/url", json={"target_url": "http://[abc"}).status_code == 400
+    assert len(validadas) == 3
+
+    db.expire_all()
+    assert db.query(models.URLItem).count() == total
+    db.close()
+
+    # La migración borra el índice sobre target_url de versiones anteriores
+    from sqlalchemy import inspect, text
+    from database import actualizar_esquema, _nombres_indices
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX ix_urls_target_url ON urls (target_url)"))
+    actualizar_esquema(engine)
+    with engine.connect() as conn:
+        assert "ix_urls_target_url" not in _nombres_indices(conn, inspect(engine), "urls")
+
+
+def test_caducidad_de_enlaces_y_purga_por_lotes(monkeypatch):
+    """Un enlace caducado o sin visitas restantes responde 410 y la purga lo archiva por lotes"""
+    from datetime import datetime, timedelta, timezone
+    import crud
+    import schemas
+    from clicks import acumulador_clicks
+    from purge import purga_enlaces
+
+    auth = ("admin", "1234")
+    pasado = datetime.now(timezone.utc) - timedelta(hours=1)
+    respuesta = client.post("/url", json={"target_url": "https://www.python.org", "expires_at": pasado.isoformat()})
+    assert respuesta.status_code == 400
+
+    db = TestingSessionLocal()
+    vencido = crud.create_url(db, schemas.URLCreate(target_url="https://www.python.org/vencido", expires_at=pasado))
+    agotable = crud.create_url(db, schemas.URLCreate(target_url="https://www.python.org/agotable", max_clicks=2))
+    vencido_key, agotable_key = vencido.key, agotable.key
+
+    assert client.get(f"/{vencido_key}", follow_redirects=False).status_code == 410
+    for _ in range(2):
+        respuesta = client.get(f"/{agotable_key}", follow_redirects=False)
+        assert respuesta.status_code == 307
+        assert "no-cache" in respuesta.headers["cache-control"]
+    assert client.get(f"/{agotable_key}", follow_redirects=False).status_code == 410
+
+    acumulador_clicks.flush(TestingSessionLocal)
+    antes = client.get("/api/admin/summary", params={"refresh": True}, auth=auth).json()
+
+    monkeypatch.setattr(purga_enlaces, "action", "archive")
+    monkeypatch.setattr(purga_enlaces, "batch_size", 1)
+    monkeypatch.setattr(purga_enlaces, "pause", 0)
+    informe = purga_enlaces.ejecutar(TestingSessionLocal)
+    assert informe["purged"] == 2
+    assert informe["batches"] == 2 and len(informe["batch_ms"]) == 2
+    assert "analyze_ms" in informe
+
+    assert db.query(models.URLItem).filter(models.URLItem.key.in_([vencido_key, agotable_key])).count() == 0
+    archivados = {fila.key: fila.clicks for fila in db.query(models.URLArchive)}
+    assert archivados == {vencido_key: 0, agotable_key: 2}
+    assert client.get(f"/{vencido_key}", follow_redirects=False).status_code == 404
+    db.close()
+
+    despues = client.get("/api/admin/summary", auth=auth).json()
+    assert despues["total_links"] == antes["total_links"] - 2
+    assert despues["total_clicks"] == antes["total_clicks"] - 2
+
+    # Desde el endpoint de admin: ya no queda nada que purgar
+    assert client.post("/api/admin/purge").status_code == 401
+    respuesta = client.post("/api/admin/purge", auth=auth)
+    assert respuesta.status_code == 200 and respuesta.json()["purged"] == 0
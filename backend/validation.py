@@ -0,0 +1,312 @@
+import re
+import hashlib
+import ipaddress
+import time
+from typing import Iterable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from metrics import medir_etapa
+
+# ==============================================================================
+# 1. CONFIGURACIÓN
+# ==============================================================================
+
+MAX_URL_LENGTH = 2048
+
+# Lista de TLDs válidos (se puede expandir)
+VALID_TLDS = {
+    'com', 'org', 'net', 'edu', 'gov', 'mil', 'int', 
+    'arpa', 'ac', 'ad', 'ae', 'af', 'ag', 'ai', 'al', 
+    'am', 'ao', 'aq', 'ar', 'as', 'at', 'au', 'aw', 
+    'ax', 'az', 'ba', 'bb', 'bd', 'be', 'bf', 'bg', 
+    'bh', 'bi', 'bj', 'bm', 'bn', 'bo', 'br', 'bs', 
+    'bt', 'bv', 'bw', 'by', 'bz', 'ca', 'cc', 'cd', 
+    'cf', 'cg', 'ch', 'ci', 'ck', 'cl', 'cm', 'cn', 
+    'co', 'cr', 'cu', 'cv', 'cx', 'cy', 'cz', 'de', 
+    'dj', 'dk', 'dm', 'do', 'dz', 'ec', 'ee', 'eg', 
+    'eh', 'er', 'es', 'et', 'eu', 'fi', 'fj', 'fk', 
+    'fm', 'fo', 'fr', 'ga', 'gb', 'gd', 'ge', 'gf', 
+    'gg', 'gh', 'gi', 'gl', 'gm', 'gn', 'gp', 'gq', 
+    'gr', 'gs', 'gt', 'gu', 'gw', 'gy', 'hk', 'hm', 
+    'hn', 'hr', 'ht', 'hu', 'id', 'ie', 'il', 'im', 
+    'in', 'io', 'iq', 'ir', 'is', 'it', 'je', 'jm', 
+    'jo', 'jp', 'ke', 'kg', 'kh', 'ki', 'km', 'kn', 
+    'kp', 'kr', 'kw', 'ky', 'kz', 'la', 'lb', 'lc', 
+    'li', 'lk', 'lr', 'ls', 'lt', 'lu', 'lv', 'ly', 
+    'ma', 'mc', 'md', 'me', 'mg', 'mh', 'mk', 'ml', 
+    'mm', 'mn', 'mo', 'mp', 'mq', 'mr', 'ms', 'mt', 
+    'mu', 'mv', 'mw', 'mx', 'my', 'mz', 'na', 'nc', 
+    'ne', 'nf', 'ng', 'ni', 'nl', 'no', 'np', 'nr', 
+    'nu', 'nz', 'om', 'pa', 'pe', 'pf', 'pg', 'ph', 
+    'pk', 'pl', 'pm', 'pn', 'pr', 'ps', 'pt', 'pw', 
+    'py', 'qa', 're', 'ro', 'rs', 'ru', 'rw', 'sa', 
+    'sb', 'sc', 'sd', 'se', 'sg', 'sh', 'si', 'sj', 
+    'sk', 'sl', 'sm', 'sn', 'so', 'sr', 'ss', 'st', 
+    'sv', 'sx', 'sy', 'sz', 'tc', 'td', 'tf', 'tg', 
+    'th', 'tj', 'tk', 'tl', 'tm', 'tn', 'to', 'tr', 
+    'tt', 'tv', 'tw', 'tz', 'ua', 'ug', 'uk', 'us', 
+    'uy', 'uz', 'va', 'vc', 've', 'vg', 'vi', 'vn', 
+    'vu', 'wf', 'ws', 'ye', 'yt', 'za', 'zm', 'zw'
+}
+
+# Nombres de host que nunca se pueden acortar
+BLOCKED_HOSTNAMES = frozenset({"localhost"})
+
+# Rangos de red bloqueados (loopback, privados, link-local...).
+# Se comprueban con 'ipaddress' en vez de comparar prefijos de texto, así
+# "10.ejemplo.com" ya no se confunde con una IP privada.
+BLOCKED_NETWORKS = tuple(ipaddress.ip_network(red) for red in (
+    "0.0.0.0/8",
+    "10.0.0.0/8",
+    "127.0.0.0/8",
+    "169.254.0.0/16",
+    "172.16.0.0/12",
+    "192.168.0.0/16",
+    "::1/128",
+    "fc00::/7",
+    "fe80::/10",
+))
+
+# Dominios principales de menos de 2 letras que se aceptan igualmente
+DOMINIOS_CORTOS_PERMITIDOS = frozenset({'co', 'ac', 'go', 'or', 'ne', 'com'})
+
+# ==============================================================================
+# 2. PATRONES PRECOMPILADOS
+# ==============================================================================
+# Se compilan una sola vez al importar el módulo, no en cada validación.
+
+# Una parte (etiqueta) del dominio: letras, números y guiones internos
+_PATRON_ETIQUETA = re.compile(r'[a-z0-9]([a-z0-9-]*[a-z0-9])?')
+
+# Dominio completo con todas sus etiquetas válidas y de 63 caracteres como
+# máximo (camino rápido: si encaja, no hace falta aplicar _PATRON_URL)
+_PATRON_DOMINIO = re.compile(r'(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?')
+
+# Patrón regex más estricto para URL completa
+_PATRON_URL = re.compile(
+    r'^(https?://)?'  # http:// o https:// (opcional)
+    r'([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+'  # dominio
+    r'[A-Za-z]{2,}'  # extensión de dominio (al menos 2 caracteres)
+    r'(:[0-9]{1,5})?'  # puerto opcional
+    r'(/.*)?$',  # ruta opcional
+    re.IGNORECASE
+)
+
+# ==============================================================================
+# 3. VALIDACIÓN DE FORMATO Y DOMINIO (UNA SOLA PASADA)
+# ==============================================================================
+
+def _separar_url(url: str) -> tuple[str, str]:
+    """
+    Separa una URL en (dominio en minúsculas, resto desde la primera '/').
+    Solo se pasa a minúsculas el dominio, no la ruta (que puede ser larga).
+    """
+    prefijo = url[:8].lower()
+    if prefijo.startswith('https://'):
+        inicio = 8
+    elif prefijo.startswith('http://'):
+        inicio = 7
+    else:
+        inicio = 0
+    barra = url.find('/', inicio)
+    if barra < 0:
+        return url[inicio:].lower(), ""
+    return url[inicio:barra].lower(), url[barra:]
+
+def _error_formato(url: str, dominio: str, ruta: str) -> str:
+    """Comprueba el formato a partir del dominio ya extraído. Devuelve el error o ''."""
+    if '.' not in dominio:
+        return "El dominio debe contener un punto (ej: ejemplo.com)"
+
+    rapido = _PATRON_DOMINIO.fullmatch(dominio) is not None
+    if not rapido:
+        # Camino lento, solo para URLs dudosas: localizar la parte culpable
+        for part in dominio.split('.'):
+            if not part:
+                return "Parte del dominio vacía"
+            if not _PATRON_ETIQUETA.fullmatch(part):
+                return f"Parte del dominio inválida: '{part}'"
+
+    # Verificar el TLD (extensión del dominio)
+    ultimo_punto = dominio.rfind('.')
+    tld = dominio[ultimo_punto + 1:]
+    if tld not in VALID_TLDS:
+        return f"Extensión de dominio no válida: '.{tld}'"
+
+    # Verificar que el dominio principal (sin TLD) no sea demasiado corto
+    main_domain = dominio[dominio.rfind('.', 0, ultimo_punto) + 1:ultimo_punto]
+    if len(main_domain) < 2 and main_domain not in DOMINIOS_CORTOS_PERMITIDOS:
+        return "Nombre de dominio principal demasiado corto"
+
+    if rapido:
+        # Con el dominio ya validado, _PATRON_URL solo añadiría que la ruta
+        # no tenga saltos de línea ('.' no los acepta; '$' admite uno final)
+        salto = ruta.find('\n')
+        if salto < 0 or salto == len(ruta) - 1:
+            return ""
+    elif _PATRON_URL.match(url):
+        return ""
+
+    return "Formato de URL inválido"
+
+def _error_host(hostname: str) -> str:
+    """Comprueba que el host no sea local, privado o incompleto. Devuelve el error o ''."""
+    if hostname in BLOCKED_HOSTNAMES or hostname.endswith('.localhost'):
+        return f"Dominio no permitido: {hostname}"
+
+    # Solo se intenta interpretar como IP si puede serlo (empieza por dígito o es IPv6)
+    if hostname[:1].isdigit() or ':' in hostname:
+        try:
+            ip = ipaddress.ip_address(hostname)
+        except ValueError:
+            ip = None
+        if ip is not None and any(ip in red for red in BLOCKED_NETWORKS):
+            return f"Dominio no permitido: {hostname}"
+
+    # Verificar que el dominio tenga al menos 2 partes separadas por punto
+    ultimo_punto = hostname.rfind('.')
+    if ultimo_punto < 0:
+        return "Dominio debe tener al menos un punto separador"
+
+    # Verificar que el último segmento (TLD) tenga al menos 2 caracteres
+    if len(hostname) - ultimo_punto - 1 < 2:
+        return "Extensión de dominio demasiado corta"
+
+    # Verificar dominio principal
+    if ultimo_punto - hostname.rfind('.', 0, ultimo_punto) - 1 < 2:
+        return "Nombre de dominio principal demasiado corto"
+
+    return ""
+
+def validar_formato_url(url: str) -> tuple[bool, str]:
+    """Valida el formato básico de una URL de manera estricta"""
+    if len(url) > MAX_URL_LENGTH:
+        return False, f"La URL es demasiado larga (máximo {MAX_URL_LENGTH} caracteres)"
+
+    dominio, ruta = _separar_url(url)
+    error = _error_formato(url, dominio, ruta)
+    return (False, error) if error else (True, "")
+
+def validar_dominio(url: str) -> tuple[bool, str]:
+    """Valida que el dominio no sea local, privado o sospechoso"""
+    try:
+        hostname = urlsplit(url).hostname
+        if not hostname:
+            return False, "URL sin dominio válido"
+
+        error = _error_host(hostname)
+        return (False, error) if error else (True, "")
+
+    except Exception as e:
+        return False, f"Error validando dominio: {str(e)}"
+
+def validar_url(url: str) -> tuple[bool, str]:
+    """
+    validar_formato_url + validar_dominio en una sola pasada.
+
+    La URL se trocea una única vez. Si el formato es correcto, el dominio
+    extraído ya es el hostname (sin usuario ni puerto, que el formato no
+    admite), así que no hace falta volver a parsearla con urlparse.
+    """
+    if len(url) > MAX_URL_LENGTH:
+        return False, f"La URL es demasiado larga (máximo {MAX_URL_LENGTH} caracteres)"
+
+    dominio, ruta = _separar_url(url)
+    error = _error_formato(url, dominio, ruta) or _error_host(dominio)
+    return (False, error) if error else (True, "")
+
+# ==============================================================================
+# 4. VALIDACIÓN SINTÁCTICA COMPLETA (SIN RED)
+# ==============================================================================
+
+_validators = None
+
+def _formato_validators(url: str) -> bool:
+    """
+    Comprobación de formato con la biblioteca 'validators', que se importa
+    en la primera llamada y no al cargar el módulo (arranque más rápido).
+    """
+    global _validators
+    if _validators is None:
+        import validators
+        _validators = validators
+    return bool(_validators.url(url))
+
+def validar_url_sintaxis(url: str) -> tuple[bool, str]:
+    """
+    Validaciones baratas (sin red): formato y dominio.
+    Devuelve (True, url_normalizada) o (False, mensaje_error).
+    """
+    if not url:
+        return False, "La URL no puede estar vacía"
+
+    # Eliminar espacios y asegurar que tenga protocolo
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+
+    # Validar con validators (biblioteca existente)
+    inicio = time.perf_counter()
+    formato_ok = _formato_validators(url)
+    medir_etapa("format", inicio, formato_ok)
+    if not formato_ok:
+        return False, "Formato de URL inválido. Ejemplo: https://ejemplo.com"
+
+    # Formato estricto + dominio permitido (una sola pasada, ver validar_url)
+    inicio = time.perf_counter()
+    valida, mensaje = validar_url(url)
+    medir_etapa("domain", inicio, valida)
+    return (True, url) if valida else (False, mensaje)
+
+def validate_many(urls: Iterable[str]) -> list[tuple[bool, str]]:
+    """
+    Versión por lotes de validar_url_sintaxis, para importaciones masivas.
+
+    Devuelve un resultado por URL, en el mismo orden. Las URLs repetidas
+    dentro del lote (muy habituales) solo se validan una vez.
+    """
+    vistos: dict[str, tuple[bool, str]] = {}
+    resultados = []
+    for url in urls:
+        resultado = vistos.get(url)
+        if resultado is None:
+            resultado = vistos[url] = validar_url_sintaxis(url)
+        resultados.append(resultado)
+    return resultados
+
+# ==============================================================================
+# 5. NORMALIZACIÓN PARA DEDUPLICAR DESTINOS
+# ==============================================================================
+
+_PUERTOS_POR_DEFECTO = {"http": "80", "https": "443"}
+
+def normalizar_destino(url: str) -> str:
+    """
+    Forma canónica de una URL para reconocer destinos repetidos: esquema y
+    host en minúsculas, sin puerto por defecto ni barra final y con los
+    parámetros de la query ordenados por nombre (los repetidos conservan
+    su orden). Solo sirve para comparar: el enlace guarda la URL validada.
+    Una URL que no se puede descomponer (ej: "http://[abc") se devuelve tal
+    cual: solo coincide consigo misma.
+    """
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url  # igual que validar_url_sintaxis
+
+    try:
+        partes = urlsplit(url)
+    except ValueError:
+        return url
+    esquema = partes.scheme.lower()
+    usuario, arroba, host = partes.netloc.rpartition("@")
+    host = host.lower()
+    puerto = _PUERTOS_POR_DEFECTO.get(esquema)
+    if puerto and host.endswith(":" + puerto):
+        host = host[: -len(puerto) - 1]
+
+    query = urlencode(sorted(parse_qsl(partes.query, keep_blank_values=True), key=lambda par: par[0]))
+    return urlunsplit((esquema, usuario + arroba + host, partes.path.rstrip("/"), query, partes.fragment))
+
+def huella_destino(url: str) -> str:
+    """Resumen de longitud fija (32 caracteres hex) de normalizar_destino(url)."""
+    return hashlib.blake2b(normalizar_destino(url).encode("utf-8"), digest_size=16).hexdigest()